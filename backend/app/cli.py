@@ -0,0 +1,237 @@
+"""
+運用向けコマンドラインツール
+
+使い方（backend ディレクトリで実行）:
+    # 特徴点データをアーカイブに書き出す
+    python -m app.cli export-points gallery.npz [--url http://host:8000] [--compress]
+
+    # アーカイブの特徴点データを読み込む
+    python -m app.cli import-points gallery.npz [--url http://host:8000] [--skip-existing]
+
+    # ディレクトリ・zip の画像から特徴点を抽出して保存する
+    python -m app.cli ingest photos/ [--workers 4] [--checkpoint photos.ingest.jsonl] [--save-images]
+
+--url を指定した場合は稼働中のサーバーのAPIを使用し、
+省略した場合は FACE_STATE_BACKEND で指定された保存先を直接読み書きする
+（複数ノード間の移行では sqlite / redis を指定する）。
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import urllib.parse
+import urllib.request
+
+BULK_ENDPOINT = "/api/bulk/feature-points"
+
+# 直接読み書きする場合に一度に保存する画像数
+IMPORT_BATCH_SIZE = 1000
+
+# 取り込み時に一度に保存する画像数（チェックポイントもこの単位で記録する）
+INGEST_BATCH_SIZE = 50
+
+
+def _export_via_api(url: str, output: str, compress: bool) -> int:
+    query = urllib.parse.urlencode({"compress": "true" if compress else "false"})
+    with urllib.request.urlopen(f"{url.rstrip('/')}{BULK_ENDPOINT}?{query}") as response:
+        with open(output, "wb") as output_file:
+            shutil.copyfileobj(response, output_file)
+        return int(response.headers.get("X-Point-Set-Count", "0"))
+
+
+def _export_direct(output: str, compress: bool) -> int:
+    from app.services.point_archive import write_archive
+    from app.services.state_backend import get_state_backend
+
+    store = get_state_backend().store("feature_points")
+    with open(output, "wb") as output_file:
+        return write_archive(output_file, store.items(), compress=compress)
+
+
+def _import_via_api(url: str, input_path: str, skip_existing: bool) -> dict:
+    query = urllib.parse.urlencode({"skip_existing": "true" if skip_existing else "false"})
+    with open(input_path, "rb") as input_file:
+        request = urllib.request.Request(
+            f"{url.rstrip('/')}{BULK_ENDPOINT}?{query}",
+            data=input_file,
+            method="POST",
+            headers={
+                "Content-Type": "application/x-npz",
+                "Content-Length": str(os.path.getsize(input_path))
+            }
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+
+def _import_direct(input_path: str, skip_existing: bool) -> dict:
+    from app.services.point_archive import read_archive
+    from app.services.state_backend import get_state_backend
+
+    store = get_state_backend().store("feature_points")
+    imported = 0
+    skipped = 0
+    batch = {}
+
+    with open(input_path, "rb") as input_file:
+        for image_id, points in read_archive(input_file):
+            if skip_existing and image_id in store:
+                skipped += 1
+                continue
+            batch[image_id] = points
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                store.put_many(batch)
+                imported += len(batch)
+                batch = {}
+
+    if batch:
+        store.put_many(batch)
+        imported += len(batch)
+
+    return {"imported": imported, "skipped": skipped}
+
+
+def export_points(args: argparse.Namespace) -> None:
+    start_time = time.time()
+    if args.url:
+        count = _export_via_api(args.url, args.output, args.compress)
+    else:
+        count = _export_direct(args.output, args.compress)
+    size = os.path.getsize(args.output)
+    print(f"{count}件の特徴点データを書き出しました: {args.output} "
+          f"({size / 1024:.1f} KiB, {time.time() - start_time:.2f}s)")
+
+
+def import_points(args: argparse.Namespace) -> None:
+    start_time = time.time()
+    if args.url:
+        result = _import_via_api(args.url, args.input, args.skip_existing)
+    else:
+        result = _import_direct(args.input, args.skip_existing)
+    print(f"{result['imported']}件の特徴点データを読み込みました"
+          f"（スキップ: {result['skipped']}件, {time.time() - start_time:.2f}s）")
+
+
+def _warn_if_memory_backend(backend) -> None:
+    if backend.get_backend_info().get("backend") == "memory":
+        print("警告: FACE_STATE_BACKEND=memory のため、保存した特徴点データはコマンド終了時に失われます",
+              file=sys.stderr)
+
+
+def _print_progress(done: int, total: int, counts: dict, start_time: float) -> None:
+    elapsed = time.time() - start_time
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 else 0.0
+    print(f"\r[{done}/{total}] 取り込み: {counts['ingested']} 顔なし: {counts['no_face']} "
+          f"低品質: {counts['low_quality']} エラー: {counts['error']} ({rate:.1f}枚/s, 残り約{eta:.0f}s)", end="", file=sys.stderr, flush=True)
+
+
+def ingest(args: argparse.Namespace) -> None:
+    from app.services.ingestion import IngestCheckpoint, init_worker, iter_image_sources, process_image
+    from app.services.state_backend import get_state_backend
+
+    backend = get_state_backend()
+    _warn_if_memory_backend(backend)
+    feature_points_store = backend.store("feature_points")
+    processed_images_store = backend.store("processed_images")
+
+    uploads_dir = None
+    if args.save_images:
+        # サーバーと同じ uploads ディレクトリ（プロジェクトルート直下）
+        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        uploads_dir = os.path.join(project_root, "uploads")
+        os.makedirs(uploads_dir, exist_ok=True)
+
+    checkpoint = IngestCheckpoint(args.checkpoint or f"{args.source.rstrip('/')}.ingest.jsonl")
+    tasks = [
+        (source, relative_path) for source, relative_path in iter_image_sources(args.source)
+        if not checkpoint.is_completed(relative_path)
+    ]
+    skipped = len(checkpoint.completed)
+    print(f"{len(tasks)}枚の画像を取り込みます（処理済みのためスキップ: {skipped}枚, ワーカー: {args.workers}）",
+          file=sys.stderr)
+
+    counts = {"ingested": 0, "no_face": 0, "low_quality": 0, "error": 0}
+    batch = []
+    start_time = time.time()
+
+    def flush() -> None:
+        # 特徴点データを保存してからチェックポイントに記録する
+        ingested = [entry for entry in batch if entry["status"] == "ingested"]
+        feature_points_store.put_many({entry["image_id"]: entry["feature_points"] for entry in ingested})
+        processed = {entry["image_id"]: entry["processed_info"] for entry in ingested if entry.get("processed_info")}
+        if processed:
+            processed_images_store.put_many(processed)
+        checkpoint.record([
+            {key: entry.get(key) for key in ("path", "image_id", "status", "message")}
+            for entry in batch
+        ])
+        batch.clear()
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+            futures = [
+                executor.submit(process_image, source, relative_path, uploads_dir, pipeline=args.pipeline)
+                for source, relative_path in tasks
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                entry = future.result()
+                counts[entry["status"]] += 1
+                batch.append(entry)
+                if len(batch) >= INGEST_BATCH_SIZE:
+                    flush()
+                _print_progress(done, len(tasks), counts, start_time)
+    finally:
+        # 中断された場合も、完了した分は保存・記録する
+        if batch:
+            flush()
+        checkpoint.close()
+        print(file=sys.stderr)
+
+    print(f"{counts['ingested']}枚の画像の特徴点データを保存しました"
+          f"（顔なし: {counts['no_face']}枚, 低品質: {counts['low_quality']}枚, エラー: {counts['error']}枚, {time.time() - start_time:.2f}s）")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="顔比較システムの運用ツール")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export-points", help="特徴点データをアーカイブ（.npz）に書き出す")
+    export_parser.add_argument("output", help="出力ファイル")
+    export_parser.add_argument("--url", help="サーバーのURL（省略時は保存先を直接読み込む）")
+    export_parser.add_argument("--compress", action="store_true", help="圧縮する")
+    export_parser.set_defaults(handler=export_points)
+
+    import_parser = subparsers.add_parser("import-points", help="アーカイブ（.npz）の特徴点データを読み込む")
+    import_parser.add_argument("input", help="入力ファイル")
+    import_parser.add_argument("--url", help="サーバーのURL（省略時は保存先に直接書き込む）")
+    import_parser.add_argument("--skip-existing", action="store_true", help="既存の特徴点データを上書きしない")
+    import_parser.set_defaults(handler=import_points)
+
+    ingest_parser = subparsers.add_parser("ingest", help="ディレクトリ・zip の画像から特徴点を抽出して保存する")
+    ingest_parser.add_argument("source", help="画像のディレクトリまたは zip ファイル")
+    ingest_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数")
+    ingest_parser.add_argument("--checkpoint", help="チェックポイントファイル（既定: <source>.ingest.jsonl）")
+    ingest_parser.add_argument("--save-images", action="store_true",
+                               help="元画像・処理済み画像を uploads に保存し、Web画面から参照できるようにする")
+    ingest_parser.add_argument("--pipeline", choices=["accurate", "fast"],
+                               help="顔の位置を求める処理の構成（既定: FACE_PIPELINE）")
+    ingest_parser.set_defaults(handler=ingest)
+
+    return parser
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    try:
+        args.handler(args)
+    except Exception as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,56 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import importlib
 import os
+import time
+import uuid
 
-# ルーターのインポート
-from app.routers import images, comparison, face_detection, auto_features
+from app.routers import health
+from app.services.memory_accounting import DEFAULT_TRACEMALLOC_FRAMES, memory_accountant
+from app.services.metrics import latency_recorder
+from app.services.model_registry import model_registry
+from app.services.profiler import request_profiler
+from app.services.speculative import speculative_processor
+from app.services.warmup import warmup_service
+
+# FACE_TRACEMALLOC_FRAMES を指定した場合、モジュールの読み込みを含めて割り当てを追跡する
+if DEFAULT_TRACEMALLOC_FRAMES > 0:
+    memory_accountant.start_tracing(DEFAULT_TRACEMALLOC_FRAMES)
+
+# FACE_PRELOAD_MODELS=1 の場合、重いモジュールをインポート時に読み込む
+# （gunicorn --preload 等で fork 前に読み込み、ワーカー間でメモリを共有する）
+PRELOAD_MODELS = os.environ.get("FACE_PRELOAD_MODELS", "0") == "1"
+if PRELOAD_MODELS:
+    model_registry.preload_modules()
+
+# 有効にするルーター（モジュール名: タグ）
+# FACE_API_ROUTERS=images,comparison とすると mediapipe・OpenCV を一切読み込まない
+# 比較専用の構成で起動できる
+AVAILABLE_ROUTERS = {
+    "images": "images",
+    "comparison": "comparison",
+    "face_detection": "face-detection",
+    "auto_features": "auto-features",
+    "bulk": "bulk",
+    "videos": "videos",
+    "diagnostics": "diagnostics"
+}
+ENABLED_ROUTERS = [
+    name.strip() for name in
+    os.environ.get("FACE_API_ROUTERS", ",".join(AVAILABLE_ROUTERS)).split(",")
+    if name.strip()
+]
+
+# モデルを使用するルーターが有効な場合、起動時にウォームアップを行う（FACE_WARMUP=0 で無効）
+MODEL_ROUTERS = {"face_detection", "auto_features", "videos"}
+WARMUP_ENABLED = (
+    os.environ.get("FACE_WARMUP", "1") == "1"
+    and any(name in MODEL_ROUTERS for name in ENABLED_ROUTERS)
+)
 
 app = FastAPI(
     title="Face Comparison API",
@@ -37,11 +82,100 @@ frontend_dir = os.path.join(project_root, "frontend")
 if os.path.exists(frontend_dir):
     app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
 
-# APIルーターを追加
-app.include_router(images.router, prefix="/api", tags=["images"])
-app.include_router(comparison.router, prefix="/api", tags=["comparison"])
-app.include_router(face_detection.router, prefix="/api", tags=["face-detection"])
-app.include_router(auto_features.router, prefix="/api", tags=["auto-features"])
+# どのルートにも一致しなかったリクエストをまとめて記録するエンドポイント名
+# （存在しないパスごとに記録すると、任意のパスへのリクエストで記録が際限なく増える）
+UNMATCHED_ENDPOINT = "* /api/<unmatched>"
+# エンドポイント名に使用するメソッド（それ以外は OTHER にまとめる）
+HTTP_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+
+def endpoint_name(request: Request) -> str:
+    """パスパラメータを含まないテンプレートでエンドポイント名を求める"""
+    route = request.scope.get("route")
+    if route is None:
+        return UNMATCHED_ENDPOINT
+    method = request.method if request.method in HTTP_METHODS else "OTHER"
+    path = route.path
+    if not path.startswith("/api/"):
+        # FastAPI のバージョンによってはルーターの prefix を含まない
+        path = "/api" + path
+    return f"{method} {path}"
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    """APIのレイテンシをエンドポイントごとに記録する"""
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    
+    if request.url.path.startswith("/api/"):
+        latency_recorder.record(endpoint_name(request), time.perf_counter() - start_time, response.status_code)
+    
+    return response
+
+@app.middleware("http")
+async def profile_slow_requests(request: Request, call_next):
+    """
+    一部のリクエストでスタックサンプリングを行い、遅かった場合にプロファイルを保存する
+    
+    FACE_PROFILE_SAMPLE_RATE の割合のリクエスト、または X-Profile ヘッダーに FACE_PROFILE_TOKEN を
+    指定したリクエストが対象。保存するのはどちらも FACE_PROFILE_THRESHOLD_MS を超えた場合だけ。
+    """
+    path = request.url.path
+    force = request_profiler.is_requested(request.headers.get("X-Profile"))
+    session = None
+    if path.startswith("/api/") and not path.startswith("/api/profiles"):
+        session = request_profiler.start(force)
+    if session is None:
+        return await call_next(request)
+    
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        request_info = {
+            "request_id": request_id,
+            "method": request.method,
+            "endpoint": endpoint_name(request),
+            "path": path,
+            "params": {**request.path_params, **dict(request.query_params)},
+            "status_code": status_code
+        }
+        profile_id = await run_in_threadpool(request_profiler.finish, session, request_info)
+    
+    response.headers["X-Request-ID"] = request_id
+    if profile_id:
+        response.headers["X-Profile-ID"] = profile_id
+    return response
+
+# ヘルスチェック（死活監視・準備完了）
+app.include_router(health.router, tags=["health"])
+
+# APIルーターを追加（有効なルーターのモジュールだけをインポートする）
+for router_name in ENABLED_ROUTERS:
+    if router_name not in AVAILABLE_ROUTERS:
+        raise ValueError(f"未対応のルーターです: {router_name}")
+    router_module = importlib.import_module(f"app.routers.{router_name}")
+    app.include_router(router_module.router, prefix="/api", tags=[AVAILABLE_ROUTERS[router_name]])
+
+memory_accountant.register("latency_samples", latency_recorder.get_memory_usage)
+memory_accountant.register("speculative_results", speculative_processor.get_memory_usage)
+memory_accountant.register("models", model_registry.get_memory_usage)
+
+@app.on_event("startup")
+async def reset_memory_baseline():
+    """割り当てを追跡している場合、起動完了時点を増加の基準にする"""
+    if DEFAULT_TRACEMALLOC_FRAMES > 0:
+        await run_in_threadpool(memory_accountant.reset_baseline)
+
+@app.on_event("startup")
+async def start_warmup():
+    """モデルを使用する構成では、バックグラウンドでウォームアップを開始する"""
+    warmup_service.required = WARMUP_ENABLED
+    if WARMUP_ENABLED:
+        # 完了までは /health/ready が 503 を返す
+        # 失敗した場合は間隔を空けて再試行する
+        app.state.warmup_task = asyncio.create_task(warmup_service.run_with_retry())
 
 @app.get("/")
 async def serve_frontend():
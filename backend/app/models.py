@@ -15,6 +15,11 @@ class ImageUploadResponse(BaseModel):
     url: str
     filename: str
     upload_time: datetime
+    width: Optional[int] = None
+    height: Optional[int] = None
+    original_width: Optional[int] = None
+    original_height: Optional[int] = None
+    scale_factor: float = 1.0  # アップロード画像の大きさ / クライアントで縮小する前の大きさ
 
 class ImageFeatures(BaseModel):
     image_id: str
@@ -25,11 +30,30 @@ class FeaturePointsResponse(BaseModel):
     message: str
     image_id: str
     points_count: int
+    version: Optional[int] = None  # 保存後の特徴点集合のバージョン
+
+class FeaturePointUpsert(BaseModel):
+    key: Optional[str] = None  # 置き換える特徴点のキー（省略時は point から求める）
+    point: FeaturePoint
+
+class FeaturePointsDelta(BaseModel):
+    upsert: List[FeaturePointUpsert] = []
+    delete: List[str] = []  # 削除する特徴点のキー
+    base_version: Optional[int] = None  # 指定した場合、現在のバージョンと異なれば 409 を返す
 
 class ComparisonRequest(BaseModel):
     reference_id: str
     compare_ids: List[str]
 
+class FeatureTypeScore(BaseModel):
+    points_count: int
+    image1_partial_score: float  # 全体のλでの部分距離
+    image2_partial_score: float
+    optimal_lambda1: float       # タイプ単独での最適λ
+    optimal_lambda2: float
+    image1_type_score: float     # タイプ単独の最適λでの距離
+    image2_type_score: float
+
 class ComparisonResult(BaseModel):
     image1_score: float
     image2_score: float
@@ -37,6 +61,7 @@ class ComparisonResult(BaseModel):
     optimal_lambda2: float
     closer_image: Literal['image1', 'image2']
     details: Dict[str, Any]
+    feature_type_scores: Optional[Dict[str, FeatureTypeScore]] = None
     execution_time: float
 
 class ErrorResponse(BaseModel):
@@ -64,6 +89,8 @@ class AutoFeatureExtractionResponse(BaseModel):
     feature_points: List[FeaturePoint]
     total_landmarks_detected: Optional[int] = None
     extraction_parameters: Optional[Dict[str, Any]] = None
+    version: Optional[int] = None  # 保存後の特徴点集合のバージョン
+    landmark_source: Optional[str] = None  # detection（顔検出のランドマークを再利用） / inference（推論）
 
 class FeatureExtractionParametersRequest(BaseModel):
     feature_types: List[str]
@@ -97,9 +124,13 @@ class FaceLandmarks(BaseModel):
     image_size: Dict[str, int]
 
 class ProcessingInfo(BaseModel):
-    detection_confidence: float
+    detection_confidence: Optional[float] = None  # fast 構成では顔検出モデルを使用しないため None
     landmarks_detected: int
     processed_size: List[int]
+    alignment_angle: Optional[float] = None
+    alignment_scale: Optional[float] = None
+    pipeline: Optional[str] = None  # 顔の位置を求めた処理の構成（accurate / fast）
+    decode_scale: Optional[float] = None  # 顔検出に使った画像の元画像に対する縮小率
 
 class FaceDetectionRequest(BaseModel):
     image_id: str
@@ -112,4 +143,30 @@ class FaceDetectionResponse(BaseModel):
     processed_image: Optional[str] = None
     face_bbox: Optional[FaceBoundingBox] = None
     face_landmarks: Optional[FaceLandmarks] = None
-    processing_info: Optional[ProcessingInfo] = None
\ No newline at end of file
+    processing_info: Optional[ProcessingInfo] = None
+    quality: Optional[Dict[str, Any]] = None  # 推論前の品質チェックの結果
+# 動画の取り込み関連のモデル
+class VideoFrame(BaseModel):
+    image_id: str  # 画像として登録したフレームのID（顔検出・特徴点抽出・比較に使用できる）
+    url: str
+    frame_index: int
+    timestamp: float  # 動画の先頭からの秒数
+    width: int
+    height: int
+    score: float  # detection_score × sharpness_score × frontal_score
+    detection_score: float
+    sharpness: float
+    sharpness_score: float  # 候補の中での最大値を 1 とした鮮明さ
+    frontal_score: float
+    yaw: float
+    pitch: float
+    face_bbox: FaceBoundingBox
+
+class VideoUploadResponse(BaseModel):
+    success: bool
+    message: str
+    video_id: str
+    filename: str
+    frames: List[VideoFrame]
+    video: Optional[Dict[str, Any]] = None  # フレームレート・フレーム数・長さ・大きさ
+    sampling: Optional[Dict[str, Any]] = None  # 解析したフレーム数・処理時間等
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from app.models import (
     AutoFeatureExtractionRequest, 
@@ -8,52 +9,130 @@ from app.models import (
     FeatureExtractionParametersRequest,
     FeatureExtractionInfo
 )
+from app.services.admission import admitted
 from app.services.auto_feature_extraction import AutoFeatureExtractionService
-from app.routers.images import feature_points_storage
-from app.routers.face_detection import processed_images_storage
+from app.services.point_sets import upsert_points
+from app.services.single_flight import single_flight_controller
+from app.services.speculative import speculative_processor
+from app.services.wire_format import compact_response, encode_points, wants_msgpack
+from app.routers.images import feature_points_storage, store_feature_points, validate_wire_format
+from app.routers.face_detection import (
+    detect_flight,
+    face_detection_service,
+    find_uploaded_image,
+    image_quality_service,
+    processed_images_storage,
+    run_face_detection
+)
 
 router = APIRouter()
 auto_feature_service = AutoFeatureExtractionService()
 
+# 同じ画像・パラメータの抽出が同時に要求された場合は1回だけ実行する
+extract_flight = single_flight_controller.flight("extract_auto_features")
+
+async def run_feature_extraction(image_id: str, image_path: str, request: AutoFeatureExtractionRequest,
+                                 mesh_landmarks: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    自動特徴点抽出を実行し、特徴点をストレージに保存する
+    
+    過負荷時は実行枠を確保できた時点で 429 / 503 を返す。
+    
+    Args:
+        mesh_landmarks: 顔検出で求めた全ランドマーク（処理済み画像から抽出する場合、推論の代わりに使用する）
+    
+    Returns:
+        AutoFeatureExtractionResponse のデータ
+    """
+    async with admitted("extract_auto_features"):
+        # 推論はスレッドプールで実行
+        result = await run_in_threadpool(
+            auto_feature_service.extract_auto_features,
+            image_path=image_path,
+            feature_types=request.feature_types,
+            points_per_type=request.points_per_type,
+            confidence_threshold=request.confidence_threshold,
+            mesh_landmarks=mesh_landmarks
+        )
+    
+    # 抽出した特徴点をストレージに保存（手動特徴点と統合）
+    # 推論中に画像が削除された場合は保存しない（保存すると削除した特徴点が復活する）
+    version = None
+    if result["success"] and result["feature_points"] and find_uploaded_image(image_id):
+        # 既存の特徴点を取得
+        existing_points = feature_points_storage.get(image_id, [])
+        
+        # ランドマーク番号が同じ特徴点は置き換える（再抽出しても重複しない）
+        combined_points, _, _ = upsert_points(
+            existing_points, [(None, point) for point in result["feature_points"]]
+        )
+        version = store_feature_points(image_id, combined_points)
+    
+    # レスポンスデータを構築
+    return {
+        "success": result["success"],
+        "message": result["message"],
+        "image_id": image_id,
+        "feature_points": result["feature_points"],
+        "total_landmarks_detected": result.get("total_landmarks_detected"),
+        "extraction_parameters": result.get("extraction_parameters"),
+        "version": version,
+        "landmark_source": result.get("landmark_source")
+    }
+
+def find_processed_image(image_id: str) -> Optional[str]:
+    """顔検出で作成した処理済み画像のパスを探す（見つからない場合は None）"""
+    processed_info = processed_images_storage.get(image_id)
+    if processed_info and processed_info.get("processed_image_filename"):
+        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        potential_path = os.path.join(project_root, "uploads", processed_info["processed_image_filename"])
+        if os.path.exists(potential_path):
+            return potential_path
+    return None
+
+def processed_mesh_landmarks(image_id: str) -> Optional[Dict[str, Any]]:
+    """顔検出で求めた全ランドマークと処理済み画像への変換行列（記録されていない場合は None）"""
+    processed_info = processed_images_storage.get(image_id)
+    return processed_info.get("mesh_landmarks") if processed_info else None
+
+def extraction_key(image_id: str, image_path: str, request: AutoFeatureExtractionRequest) -> tuple:
+    """同じ処理とみなすリクエストのキー（画像とパラメータ）"""
+    return (
+        image_id,
+        image_path,
+        tuple(request.feature_types) if request.feature_types is not None else None,
+        tuple(sorted(request.points_per_type.items())) if request.points_per_type is not None else None,
+        request.confidence_threshold
+    )
+
 @router.post("/extract-auto-features", response_model=AutoFeatureExtractionResponse)
-async def extract_auto_features(request: AutoFeatureExtractionRequest) -> AutoFeatureExtractionResponse:
+async def extract_auto_features(request: AutoFeatureExtractionRequest, http_request: Request,
+                                format: str = Query("json")):
     """
     画像から自動で特徴点を抽出する
     
+    同じ画像・パラメータの抽出が実行中の場合は新たに実行せず、その結果を返す。
+    
     Args:
         request: 自動特徴点抽出リクエスト
+        format: 特徴点の表現形式（json / columnar / binary）
         
     Returns:
         自動特徴点抽出結果
     """
     
+    validate_wire_format(format)
     image_id = request.image_id
     
-    # プロジェクトルートとuploadsディレクトリ
-    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-    uploads_dir = os.path.join(project_root, "uploads")
-    
     # 処理済み画像ファイルを確認
-    processed_image_path = None
-    if image_id in processed_images_storage and "processed_image_filename" in processed_images_storage[image_id]:
-        processed_filename = processed_images_storage[image_id]["processed_image_filename"]
-        if processed_filename:
-            potential_path = os.path.join(uploads_dir, processed_filename)
-            if os.path.exists(potential_path):
-                processed_image_path = potential_path
+    processed_image_path = find_processed_image(image_id)
     
     # 処理済み画像がない場合は元画像を使用
     image_path = None
     if not processed_image_path:
         
         # 対応する画像ファイルを検索
-        allowed_extensions = ['jpg', 'jpeg', 'png', 'bmp']
-        
-        for ext in allowed_extensions:
-            potential_path = os.path.join(uploads_dir, f"{image_id}.{ext}")
-            if os.path.exists(potential_path):
-                image_path = potential_path
-                break
+        image_path = find_uploaded_image(image_id)
         
         if not image_path:
             raise HTTPException(
@@ -75,41 +154,30 @@ async def extract_auto_features(request: AutoFeatureExtractionRequest) -> AutoFe
             )
         
         # 自動特徴点抽出を実行（処理済み画像ファイルを優先使用）
-        if processed_image_path:
-            result = auto_feature_service.extract_auto_features(
-                image_path=processed_image_path,
-                feature_types=request.feature_types,
-                points_per_type=request.points_per_type,
-                confidence_threshold=request.confidence_threshold
-            )
+        # 処理済み画像の場合は顔検出で求めたランドマークを変換して使い、FaceMesh を再実行しない
+        image_path = processed_image_path or image_path
+        mesh_landmarks = processed_mesh_landmarks(image_id) if processed_image_path else None
+        key = extraction_key(image_id, image_path, request)
+        
+        # アップロード直後のバックグラウンド処理で抽出済みの場合はその結果を返す
+        response_data = speculative_processor.take(image_id, ("extract",) + key)
+        if response_data is not None:
+            response_data = dict(response_data, version=feature_points_storage.version(image_id))
         else:
-            result = auto_feature_service.extract_auto_features(
-                image_path=image_path,
-                feature_types=request.feature_types,
-                points_per_type=request.points_per_type,
-                confidence_threshold=request.confidence_threshold
+            response_data, _ = await extract_flight.do(
+                key, lambda: run_feature_extraction(image_id, image_path, request, mesh_landmarks)
             )
         
-        # 抽出した特徴点をストレージに保存（手動特徴点と統合）
-        if result["success"] and result["feature_points"]:
-            # 既存の手動特徴点を取得
-            existing_points = feature_points_storage.get(image_id, [])
-            
-            # 自動抽出した特徴点を追加
-            combined_points = existing_points + result["feature_points"]
-            feature_points_storage[image_id] = combined_points
-        
-        # レスポンスデータを構築
-        response_data = {
-            "success": result["success"],
-            "message": result["message"],
-            "image_id": image_id,
-            "feature_points": result["feature_points"],
-            "total_landmarks_detected": result.get("total_landmarks_detected"),
-            "extraction_parameters": result.get("extraction_parameters")
-        }
+        if format == "json":
+            return AutoFeatureExtractionResponse(**response_data)
         
-        return AutoFeatureExtractionResponse(**response_data)
+        # サーバーが生成したデータのため、レスポンスモデルでの再検証を省略する
+        # （まとめた他のリクエストと共有しているため、コピーしてから書き換える）
+        response_data = dict(response_data, format=format)
+        response_data["feature_points"] = encode_points(
+            response_data["feature_points"], format, raw_buffers=wants_msgpack(http_request)
+        )
+        return compact_response(response_data, http_request)
         
     except HTTPException:
         raise
@@ -119,6 +187,40 @@ async def extract_auto_features(request: AutoFeatureExtractionRequest) -> AutoFe
             detail=f"自動特徴点抽出中にエラーが発生しました: {str(e)}"
         )
 
+async def run_speculative_processing(image_id: str) -> None:
+    """
+    アップロード直後のバックグラウンド処理（顔検出 → 自動特徴点抽出、既定のパラメータ）
+    
+    明示的な要求と同じキーで実行するため、処理中に要求が来た場合はこの処理の結果を待つ。
+    """
+    image_path = find_uploaded_image(image_id)
+    # 明示的な要求で顔検出済みの場合は行わない
+    if not image_path or image_id in processed_images_storage:
+        return
+    
+    probe = image_quality_service.probe_mode
+    pipeline = face_detection_service.pipeline
+    detection, _ = await detect_flight.do(
+        (image_id, probe, pipeline),
+        lambda: run_face_detection(image_id, image_path, probe, pipeline)
+    )
+    speculative_processor.keep(image_id, ("detect", probe, pipeline), detection)
+    
+    processed_image_path = find_processed_image(image_id)
+    if not detection["success"] or not processed_image_path:
+        return
+    
+    request = AutoFeatureExtractionRequest(image_id=image_id)
+    key = extraction_key(image_id, processed_image_path, request)
+    mesh_landmarks = processed_mesh_landmarks(image_id)
+    extraction, _ = await extract_flight.do(
+        key, lambda: run_feature_extraction(image_id, processed_image_path, request, mesh_landmarks)
+    )
+    speculative_processor.keep(image_id, ("extract",) + key, extraction)
+
+# FACE_UPLOAD_POLICY=speculative の場合、アップロード直後にこの処理を予約する
+speculative_processor.configure(run_speculative_processing)
+
 @router.post("/validate-extraction-parameters")
 async def validate_extraction_parameters(request: FeatureExtractionParametersRequest):
     """
@@ -217,18 +319,20 @@ async def clear_auto_features(image_id: str):
     """
     
     try:
-        if image_id in feature_points_storage:
+        points = feature_points_storage.get(image_id)
+        if points is not None:
             # 手動特徴点のみを残し、自動特徴点を削除
             manual_points = [
-                point for point in feature_points_storage[image_id]
+                point for point in points
                 if point.get('landmark_index') is None
             ]
-            feature_points_storage[image_id] = manual_points
+            version = store_feature_points(image_id, manual_points)
             
             return {
                 "success": True,
                 "message": f"画像 {image_id} の自動抽出特徴点をクリアしました",
-                "remaining_points": len(manual_points)
+                "remaining_points": len(manual_points),
+                "version": version
             }
         else:
             return {
@@ -0,0 +1,133 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import tempfile
+from typing import Optional
+
+from app.routers.images import feature_points_storage, store_feature_points_bulk
+from app.services.point_archive import ARCHIVE_MEDIA_TYPE, write_archive, read_archive
+
+router = APIRouter()
+
+# 一度に保存する画像数
+IMPORT_BATCH_SIZE = 1000
+
+# メモリ上に保持するアーカイブの上限（超えた分は一時ファイルに書き出す）
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+# 作成したアーカイブをレスポンスとして送る単位
+RESPONSE_CHUNK_SIZE = 1024 * 1024
+
+def _iter_file(fileobj):
+    """一時ファイルをチャンクごとに返し、最後に閉じる"""
+    try:
+        while True:
+            chunk = fileobj.read(RESPONSE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+@router.get("/bulk/feature-points")
+async def export_feature_points(compress: bool = False, image_ids: Optional[str] = None):
+    """
+    特徴点データを列指向のバイナリ形式（.npz）でまとめて書き出す
+    
+    アーカイブは全画像分を作成し終えてから送信する（作成中の配列は全画像分がメモリ上に載る）。
+    
+    Args:
+        compress: 圧縮するかどうか
+        image_ids: 書き出す画像ID（カンマ区切り、省略時は全画像）
+        
+    Returns:
+        .npz 形式のアーカイブ
+    """
+    
+    def build_archive():
+        if image_ids:
+            selected = [image_id for image_id in image_ids.split(",") if image_id]
+            point_sets = (
+                (image_id, points) for image_id in selected
+                if (points := feature_points_storage.get(image_id)) is not None
+            )
+        else:
+            point_sets = feature_points_storage.items()
+        
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        count = write_archive(spool, point_sets, compress=compress)
+        spool.seek(0)
+        return spool, count
+    
+    try:
+        spool, count = await run_in_threadpool(build_archive)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"特徴点データの書き出しに失敗しました: {str(e)}")
+    
+    return StreamingResponse(
+        _iter_file(spool),
+        media_type=ARCHIVE_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": "attachment; filename=feature_points.npz",
+            "X-Point-Set-Count": str(count)
+        }
+    )
+
+@router.post("/bulk/feature-points")
+async def import_feature_points(request: Request, skip_existing: bool = False):
+    """
+    列指向のバイナリ形式（.npz）の特徴点データをまとめて読み込む
+    
+    リクエストボディにアーカイブをそのまま送信する（Content-Type: application/x-npz）。
+    ボディを全て受け取ってから読み込み、全画像分の配列を一度にメモリに展開する。
+    
+    Args:
+        skip_existing: 既に特徴点データがある画像を上書きしない
+        
+    Returns:
+        読み込み結果
+    """
+    
+    # リクエストボディを一時ファイルに受け取る
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        
+        # アーカイブの展開・検証は別スレッドで行い、保存（比較用の統計量やキャッシュの更新を伴う）は
+        # 他のリクエストと同じイベントループ上で行う
+        point_sets = await run_in_threadpool(lambda: list(read_archive(spool)))
+        
+        imported = 0
+        skipped = 0
+        batch = {}
+        for image_id, points in point_sets:
+            if skip_existing and image_id in feature_points_storage:
+                skipped += 1
+                continue
+            batch[image_id] = points
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                store_feature_points_bulk(batch)
+                imported += len(batch)
+                batch = {}
+                # 大量の読み込み中も他のリクエストを処理できるようにする
+                await asyncio.sleep(0)
+        if batch:
+            store_feature_points_bulk(batch)
+            imported += len(batch)
+        
+    except (ValueError, KeyError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"不正なアーカイブです: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"特徴点データの読み込みに失敗しました: {str(e)}")
+    finally:
+        spool.close()
+    
+    return {
+        "success": True,
+        "message": f"{imported}件の特徴点データを読み込みました",
+        "imported": imported,
+        "skipped": skipped
+    }
@@ -1,34 +1,57 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
 from typing import Dict, Any
 
 from app.models import ComparisonRequest, ComparisonResult
 from app.services.face_comparison import FaceComparisonService
-from app.routers.images import feature_points_storage
+from app.services.wire_format import compact_response
+from app.routers.images import (
+    feature_points_storage, point_statistics_cache, comparison_cache, load_feature_points, validate_wire_format
+)
 
 router = APIRouter()
 face_comparison_service = FaceComparisonService()
 
+def get_candidate_score(reference_id: str, reference_version, comparison_id: str) -> Dict[str, Any]:
+    """基準画像と比較画像1枚分のスコアを取得する（キャッシュになければ計算する）"""
+    key = comparison_cache.make_key(
+        reference_id,
+        comparison_id,
+        reference_version,
+        point_statistics_cache.get(comparison_id).version,
+        face_comparison_service.get_scoring_parameters()
+    )
+    score = comparison_cache.get(key)
+    if score is None:
+        score = face_comparison_service.score_candidate(
+            point_statistics_cache.pair_statistics(reference_id, comparison_id)
+        )
+        comparison_cache.put(key, score)
+    return score
+
 @router.post("/compare", response_model=ComparisonResult)
-async def compare_faces(request: ComparisonRequest) -> ComparisonResult:
+async def compare_faces(request: ComparisonRequest, http_request: Request,
+                        format: str = Query("json")):
     """
     顔画像の比較を実行する
     
     Args:
         request: 比較リクエスト（基準画像IDと比較画像ID2つ）
+        format: json 以外を指定した場合、レスポンスモデルでの再検証を省略して返す
         
     Returns:
         比較結果
     """
     
+    validate_wire_format(format)
+    
     # 基準画像の特徴点を取得
-    if request.reference_id not in feature_points_storage:
+    reference_points = load_feature_points(request.reference_id)
+    if reference_points is None:
         raise HTTPException(
             status_code=404, 
             detail=f"Feature points not found for reference image: {request.reference_id}"
         )
     
-    reference_points = feature_points_storage[request.reference_id]
-    
     # 比較画像の特徴点を取得
     if len(request.compare_ids) != 2:
         raise HTTPException(
@@ -38,21 +61,20 @@ async def compare_faces(request: ComparisonRequest) -> ComparisonResult:
     
     comparison1_id, comparison2_id = request.compare_ids
     
-    if comparison1_id not in feature_points_storage:
+    comparison1_points = load_feature_points(comparison1_id)
+    if comparison1_points is None:
         raise HTTPException(
             status_code=404,
             detail=f"Feature points not found for comparison image 1: {comparison1_id}"
         )
     
-    if comparison2_id not in feature_points_storage:
+    comparison2_points = load_feature_points(comparison2_id)
+    if comparison2_points is None:
         raise HTTPException(
             status_code=404,
             detail=f"Feature points not found for comparison image 2: {comparison2_id}"
         )
     
-    comparison1_points = feature_points_storage[comparison1_id]
-    comparison2_points = feature_points_storage[comparison2_id]
-    
     # 特徴点数の一致をチェック
     if len(reference_points) != len(comparison1_points) or len(reference_points) != len(comparison2_points):
         raise HTTPException(
@@ -70,13 +92,27 @@ async def compare_faces(request: ComparisonRequest) -> ComparisonResult:
         )
     
     try:
+        # 取得時に保存先のバージョンへ追従済みの十分統計量を使用
+        reference_statistics = point_statistics_cache.get(request.reference_id)
+        
+        # 比較画像ごとのスコアは、特徴点データのバージョンが同じであればキャッシュを再利用
+        candidate_scores = [
+            get_candidate_score(request.reference_id, reference_statistics.version, comparison_id)
+            for comparison_id in (comparison1_id, comparison2_id)
+        ]
+        
         # 顔比較を実行
         result = face_comparison_service.compare_faces(
             reference_points,
             comparison1_points,
-            comparison2_points
+            comparison2_points,
+            type_counts=reference_statistics.count_by_type,
+            candidate_scores=candidate_scores
         )
         
+        if format != "json":
+            return compact_response(result, http_request)
+        
         return ComparisonResult(**result)
         
     except ValueError as e:
@@ -90,6 +126,9 @@ async def get_comparison_status():
     return {
         "service_status": "active",
         "stored_images": len(feature_points_storage),
+        "state_backend": feature_points_storage.backend.get_backend_info(),
         "available_images": list(feature_points_storage.keys()),
-        "lambda_range": face_comparison_service.lambda_range
+        "lambda_range": face_comparison_service.lambda_range,
+        "statistics_cache": point_statistics_cache.get_cache_info(),
+        "comparison_cache": comparison_cache.get_cache_info()
     }
\ No newline at end of file
@@ -0,0 +1,100 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.services.memory_accounting import ALLOCATION_GROUPS, memory_accountant
+from app.services.profiler import request_profiler
+
+router = APIRouter()
+
+@router.get("/profiles")
+async def list_profiles():
+    """保存されている遅いリクエストのプロファイルの一覧（新しい順）"""
+    return {
+        "profiler": request_profiler.get_profiler_info(),
+        "profiles": request_profiler.list_profiles()
+    }
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str = Query("json")):
+    """
+    プロファイルをダウンロードする
+    
+    Args:
+        format: json（リクエスト情報・集計・スタックを含む）/ folded（flamegraph.pl・speedscope 用の
+            「呼び出し元;...;呼び出し先 回数」形式）
+    """
+    
+    if format not in ("json", "folded"):
+        raise HTTPException(status_code=400, detail=f"未対応の形式です: {format}（json, folded）")
+    
+    path = request_profiler.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="プロファイルが見つかりません")
+    
+    if format == "json":
+        return FileResponse(path, media_type="application/json", filename=f"{profile_id}.json")
+    
+    profile = request_profiler.load_profile(profile_id)
+    folded = "\n".join(f"{stack} {count}" for stack, count in profile["samples"].items())
+    return PlainTextResponse(
+        folded + "\n",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'}
+    )
+
+@router.get("/memory")
+async def get_memory_usage(top: int = Query(10, ge=0, le=100)):
+    """
+    ストア・キャッシュごとのおおよそのメモリ使用量（エントリ数・バイト数・大きいエントリ）と
+    プロセスの常駐メモリを取得する
+    
+    バイト数は保持しているPythonオブジェクトを辿って求めるため、エントリ数に比例した時間がかかる。
+    """
+    return await run_in_threadpool(memory_accountant.get_usage, top)
+
+@router.get("/memory/allocations")
+async def get_memory_allocations(top: int = Query(20, ge=1, le=200), group_by: str = Query("lineno")):
+    """
+    基準時点（起動完了時・追跡開始時・基準の更新時）からの割り当ての増加が大きい箇所を取得する
+    
+    Args:
+        group_by: lineno（行ごと）/ filename（ファイルごと）/ traceback（スタックごと）
+    """
+    if group_by not in ALLOCATION_GROUPS:
+        raise HTTPException(status_code=400, detail=f"未対応の集計単位です: {group_by}（{', '.join(ALLOCATION_GROUPS)}）")
+    
+    try:
+        return await run_in_threadpool(memory_accountant.get_allocations, top, group_by)
+    except RuntimeError:
+        raise HTTPException(
+            status_code=409,
+            detail="割り当ての追跡が開始されていません（POST /api/memory/allocations/start で開始してください）"
+        )
+
+@router.post("/memory/allocations/start")
+async def start_memory_tracing(frames: int = Query(1, ge=1, le=64)):
+    """割り当ての追跡を開始し、現時点を基準にする（追跡中は割り当てが遅くなる）"""
+    started = await run_in_threadpool(memory_accountant.start_tracing, frames)
+    return {
+        "success": True,
+        "message": "割り当ての追跡を開始しました" if started else "既に割り当てを追跡しています",
+        "tracemalloc": memory_accountant.get_tracing_info()
+    }
+
+@router.post("/memory/allocations/baseline")
+async def reset_memory_baseline():
+    """現時点を割り当ての増加を比較する基準にする"""
+    try:
+        await run_in_threadpool(memory_accountant.reset_baseline)
+    except RuntimeError:
+        raise HTTPException(status_code=409, detail="割り当ての追跡が開始されていません")
+    return {"success": True, "message": "基準を更新しました", "tracemalloc": memory_accountant.get_tracing_info()}
+
+@router.post("/memory/allocations/stop")
+async def stop_memory_tracing():
+    """割り当ての追跡を終了する"""
+    stopped = memory_accountant.stop_tracing()
+    return {
+        "success": True,
+        "message": "割り当ての追跡を終了しました" if stopped else "割り当てを追跡していません"
+    }
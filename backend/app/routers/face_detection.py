@@ -1,97 +1,205 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from starlette.concurrency import run_in_threadpool
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from app.models import FaceDetectionRequest, FaceDetectionResponse
-from app.services.face_detection import FaceDetectionService
+from app.services.admission import admission_controller, admitted
+from app.services.face_detection import PIPELINE_MODES, FaceDetectionService
+from app.services.image_quality import FACE_QUALITY_GATE, PROBE_MODES, ImageQualityService
 from app.routers.images import feature_points_storage
+from app.services.memory_accounting import memory_accountant
+from app.services.model_registry import ModelCheckoutTimeout
+from app.services.single_flight import single_flight_controller
+from app.services.speculative import speculative_processor
+from app.services.state_backend import get_state_backend
 
 router = APIRouter()
 face_detection_service = FaceDetectionService()
+image_quality_service = ImageQualityService()
 
-# 処理済み画像を一時的に保存（本番環境ではデータベースを使用）
-processed_images_storage = {}
+# 同じ画像・パラメータの顔検出が同時に要求された場合は1回だけ実行する
+detect_flight = single_flight_controller.flight("detect_face")
+
+# 処理済み画像情報の保存先（FACE_STATE_BACKEND でワーカー間共有のバックエンドに切り替え可能）
+processed_images_storage = get_state_backend().store("processed_images")
+memory_accountant.register("processed_images_storage", processed_images_storage.get_memory_usage)
+
+def find_uploaded_image(image_id: str) -> Optional[str]:
+    """アップロードされた元画像のパスを探す（見つからない場合は None）"""
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    uploads_dir = os.path.join(project_root, "uploads")
+    
+    for ext in ['jpg', 'jpeg', 'png', 'bmp']:
+        potential_path = os.path.join(uploads_dir, f"{image_id}.{ext}")
+        if os.path.exists(potential_path):
+            return potential_path
+    return None
+
+def validate_probe_mode(probe: Optional[str]) -> None:
+    """顔検出による事前確認のモードを検証する"""
+    if probe is not None and probe not in PROBE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未対応の事前確認モードです: {probe}（{', '.join(PROBE_MODES)}）"
+        )
+
+def validate_pipeline(pipeline: Optional[str]) -> None:
+    """顔の位置を求める処理の構成を検証する"""
+    if pipeline is not None and pipeline not in PIPELINE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未対応の処理構成です: {pipeline}（{', '.join(PIPELINE_MODES)}）"
+        )
+
+async def run_face_detection(image_id: str, image_path: str, probe: Optional[str] = None,
+                             pipeline: Optional[str] = None) -> Dict[str, Any]:
+    """
+    品質チェック・顔検出を実行し、処理済み画像情報を保存する
+    
+    過負荷時は実行枠を確保できた時点で 429 / 503 を返す。
+    
+    Returns:
+        FaceDetectionResponse のデータ
+    """
+    uploads_dir = os.path.dirname(image_path)
+    
+    async with admitted("detect_face"):
+        # 品質チェック（不合格の場合は推論を行わない）
+        quality = None
+        if FACE_QUALITY_GATE:
+            quality = await run_in_threadpool(image_quality_service.assess, image_path, probe)
+            if not quality["passed"]:
+                return {
+                    "success": False,
+                    "message": "画像の品質が不十分です: " + "、".join(
+                        reason["message"] for reason in quality["reasons"]
+                    ),
+                    "image_id": image_id,
+                    "quality": quality
+                }
+        
+        # 顔検出・処理を実行（uploads_dirを渡す）
+        # 推論はスレッドプールで実行（モデルはプールから借りるため並行実行できる）
+        result = await run_in_threadpool(
+            face_detection_service.detect_and_process_face, image_path, uploads_dir, pipeline
+        )
+    
+    # 処理済み画像情報をストレージに保存
+    if result["success"] and result["processed_image_id"]:
+        processed_images_storage[image_id] = {
+            "processed_image": result["processed_image"],  # 後方互換性のため残す
+            "processed_image_id": result["processed_image_id"],
+            "processed_image_filename": result["processed_image_filename"],
+            "processed_image_url": result["processed_image_url"],
+            "face_landmarks": result["face_landmarks"],
+            "mesh_landmarks": result["mesh_landmarks"],  # 特徴点抽出で再利用する
+            "processing_info": result["processing_info"]
+        }
+    
+    # レスポンスデータを構築
+    return {
+        "success": result["success"],
+        "message": result["message"],
+        "image_id": image_id,
+        "original_image": result.get("original_image"),
+        "processed_image": result.get("processed_image"),
+        "face_bbox": result.get("face_bbox"),
+        "face_landmarks": result.get("face_landmarks"),
+        "processing_info": result.get("processing_info"),
+        "quality": quality
+    }
 
 @router.post("/detect-face", response_model=FaceDetectionResponse)
-async def detect_and_process_face(request: FaceDetectionRequest) -> FaceDetectionResponse:
+async def detect_and_process_face(request: FaceDetectionRequest,
+                                  probe: Optional[str] = Query(None),
+                                  pipeline: Optional[str] = Query(None)) -> FaceDetectionResponse:
     """
     顔検出・トリミング・正面化処理を実行する
     
+    推論の前に縮小画像で品質チェックを行い、小さすぎる・ぼけている・露出が極端な画像は
+    モデルを実行せずに理由を付けて返す。
+    同じ画像・パラメータの処理が実行中の場合は新たに実行せず、その結果を返す。
+    
     Args:
         request: 顔検出リクエスト（画像ID）
+        probe: 縮小画像での顔検出による事前確認（off / flag / reject、省略時は FACE_QUALITY_PROBE）
+        pipeline: 顔の位置を求める処理の構成（accurate / fast、省略時は FACE_PIPELINE）
         
     Returns:
         顔検出・処理結果
     """
     
+    validate_probe_mode(probe)
+    validate_pipeline(pipeline)
     image_id = request.image_id
     
-    # 画像ファイルのパスを構築
-    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-    uploads_dir = os.path.join(project_root, "uploads")
-    
     # 対応する画像ファイルを検索
-    image_path = None
-    allowed_extensions = ['jpg', 'jpeg', 'png', 'bmp']
-    
-    for ext in allowed_extensions:
-        potential_path = os.path.join(uploads_dir, f"{image_id}.{ext}")
-        if os.path.exists(potential_path):
-            image_path = potential_path
-            break
-    
+    image_path = find_uploaded_image(image_id)
     if not image_path:
         raise HTTPException(
             status_code=404,
             detail=f"画像が見つかりません: {image_id}"
         )
     
+    # 既定値を明示したリクエストと省略したリクエストを同じ処理にまとめる
+    probe = probe or image_quality_service.probe_mode
+    pipeline = pipeline or face_detection_service.pipeline
+    
     try:
-        # 顔検出・処理を実行（uploads_dirを渡す）
-        result = face_detection_service.detect_and_process_face(image_path, uploads_dir)
-        
-        # 処理済み画像情報をストレージに保存
-        if result["success"] and result["processed_image_id"]:
-            processed_images_storage[image_id] = {
-                "processed_image": result["processed_image"],  # 後方互換性のため残す
-                "processed_image_id": result["processed_image_id"],
-                "processed_image_filename": result["processed_image_filename"],
-                "processed_image_url": result["processed_image_url"],
-                "face_landmarks": result["face_landmarks"],
-                "processing_info": result["processing_info"]
-            }
-        
-        # レスポンスデータを構築
-        response_data = {
-            "success": result["success"],
-            "message": result["message"],
-            "image_id": image_id,
-            "original_image": result.get("original_image"),
-            "processed_image": result.get("processed_image"),
-            "face_bbox": result.get("face_bbox"),
-            "face_landmarks": result.get("face_landmarks"),
-            "processing_info": result.get("processing_info")
-        }
-        
+        # アップロード直後のバックグラウンド処理で検出済みの場合はその結果を返す
+        response_data = speculative_processor.take(image_id, ("detect", probe, pipeline))
+        if response_data is None:
+            response_data, _ = await detect_flight.do(
+                (image_id, probe, pipeline),
+                lambda: run_face_detection(image_id, image_path, probe, pipeline)
+            )
         return FaceDetectionResponse(**response_data)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"顔検出処理中にエラーが発生しました: {str(e)}"
         )
 
+@router.get("/image-quality/{image_id}")
+async def check_image_quality(image_id: str, probe: Optional[str] = Query(None)):
+    """
+    アップロードされた画像の品質チェックだけを行う（顔検出の前の確認用）
+    
+    Args:
+        probe: 縮小画像での顔検出による事前確認（off / flag / reject）
+    """
+    
+    validate_probe_mode(probe)
+    image_path = find_uploaded_image(image_id)
+    if not image_path:
+        raise HTTPException(
+            status_code=404,
+            detail=f"画像が見つかりません: {image_id}"
+        )
+    
+    try:
+        quality = await run_in_threadpool(image_quality_service.assess, image_path, probe)
+    except ModelCheckoutTimeout as e:
+        # 縮小画像での顔検出に使うモデルが全て使用中
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"image_id": image_id, **quality}
+
 @router.get("/processed-image/{image_id}")
 async def get_processed_image(image_id: str):
     """処理済み画像データを取得する"""
     
-    if image_id not in processed_images_storage:
+    processed_info = processed_images_storage.get(image_id)
+    if processed_info is None:
         raise HTTPException(
             status_code=404,
             detail="処理済み画像が見つかりません"
         )
     
-    return processed_images_storage[image_id]
+    return processed_info
 
 @router.get("/face-detection-info")
 async def get_face_detection_info():
@@ -102,8 +210,8 @@ async def get_face_detection_info():
 async def delete_processed_image(image_id: str):
     """処理済み画像データを削除する"""
     
-    if image_id in processed_images_storage:
-        del processed_images_storage[image_id]
+    speculative_processor.discard_results(image_id)
+    if processed_images_storage.discard(image_id):
         return {"success": True, "message": "処理済み画像データを削除しました"}
     else:
         raise HTTPException(
@@ -118,5 +226,20 @@ async def get_detection_status():
         "service_status": "active",
         "processed_images": len(processed_images_storage),
         "available_processed_images": list(processed_images_storage.keys()),
-        "detection_service_info": face_detection_service.get_processing_info()
-    }
\ No newline at end of file
+        "detection_service_info": face_detection_service.get_processing_info(),
+        "quality_gate": image_quality_service.get_quality_info(),
+        "model_registry": face_detection_service.model_registry.get_registry_info(),
+        "admission": admission_controller.get_controller_info(),
+        "single_flight": single_flight_controller.get_controller_info(),
+        "speculative": speculative_processor.get_processor_info()
+    }
+
+@router.get("/model-pools")
+async def get_model_pools():
+    """モデルプールの状態（インスタンスごとの利用統計）を取得"""
+    return face_detection_service.model_registry.get_registry_info()
+
+@router.post("/model-pools/health-check")
+async def check_model_pools():
+    """待機中のモデルインスタンスの健全性を確認し、異常なものを破棄する"""
+    return await run_in_threadpool(face_detection_service.model_registry.check_health)
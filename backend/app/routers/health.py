@@ -0,0 +1,37 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services.admission import admission_controller
+from app.services.metrics import latency_recorder
+from app.services.model_registry import model_registry
+from app.services.single_flight import single_flight_controller
+from app.services.warmup import warmup_service
+
+router = APIRouter()
+
+@router.get("/health/live")
+async def liveness_check():
+    """プロセスが応答できるかを返す（ロードバランサーの死活監視用）"""
+    return {"status": "alive"}
+
+@router.get("/health/ready")
+async def readiness_check():
+    """
+    リクエストを受け付ける準備ができているかを返す
+    
+    モデルを使用する構成ではウォームアップが完了するまで 503 を返す。
+    """
+    ready = warmup_service.is_ready
+    registry_info = model_registry.get_registry_info()
+    
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "warmup": warmup_service.get_status(),
+            "loaded_models": registry_info["loaded_models"],
+            "latency": latency_recorder.get_percentiles(),
+            "admission": admission_controller.get_controller_info(),
+            "single_flight": single_flight_controller.get_controller_info()
+        }
+    )
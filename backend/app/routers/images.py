@@ -1,12 +1,24 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
 import uuid
 import os
 from datetime import datetime
-from PIL import Image
 import shutil
+from typing import Optional
 
-from app.models import ImageUploadResponse, ImageFeatures, FeaturePointsResponse
+from app.models import ImageUploadResponse, ImageFeatures, FeaturePointsResponse, FeaturePointsDelta
+from app.services.comparison_cache import ComparisonCache
+from app.services.image_decode import ImageTooLargeError, read_image_header
+from app.services.memory_accounting import memory_accountant
+from app.services.point_sets import delete_points, upsert_points
+from app.services.point_statistics import PointStatisticsCache
+from app.services.speculative import speculative_processor
+from app.services.state_backend import get_state_backend
+from app.services.wire_format import WIRE_FORMATS, compact_response, encode_points, wants_msgpack
+from app.utils.lazy_import import lazy_import
+
+# 画像の検証時にのみ使用するため遅延読み込み
+Image = lazy_import("PIL.Image")
 
 router = APIRouter()
 
@@ -14,8 +26,63 @@ router = APIRouter()
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 
-# 特徴点データを一時的に保存（本番環境ではデータベースを使用）
-feature_points_storage = {}
+# 特徴点データの保存先（FACE_STATE_BACKEND でワーカー間共有のバックエンドに切り替え可能）
+feature_points_storage = get_state_backend().store("feature_points")
+
+# 画像の情報（大きさ・クライアントでの縮小率）
+image_metadata_storage = get_state_backend().store("images")
+
+# 比較用の十分統計量（特徴点の保存・削除に合わせて差分更新する）
+point_statistics_cache = PointStatisticsCache()
+
+# 比較結果（特徴点データのバージョンをキーに含める）
+comparison_cache = ComparisonCache()
+
+memory_accountant.register("feature_points_storage", feature_points_storage.get_memory_usage)
+memory_accountant.register("image_metadata_storage", image_metadata_storage.get_memory_usage)
+memory_accountant.register("point_statistics_cache", point_statistics_cache.get_memory_usage)
+memory_accountant.register("comparison_cache", comparison_cache.get_memory_usage)
+
+def store_feature_points(image_id: str, points) -> int:
+    """
+    特徴点データを保存し、比較用の統計量を差分更新する
+    
+    Returns:
+        保存後のバージョン
+    """
+    version = feature_points_storage.put(image_id, points)
+    try:
+        point_statistics_cache.update(image_id, points, version)
+    finally:
+        # 統計量の更新に失敗しても、保存済みの特徴点に基づかない結果は残さない
+        comparison_cache.invalidate(image_id)
+        # 保持している抽出結果は保存前の特徴点に基づくため渡さない
+        speculative_processor.discard_results(image_id, "extract")
+    return version
+
+def store_feature_points_bulk(point_sets) -> None:
+    """複数画像の特徴点データをまとめて保存する（比較用の統計量は比較時に再構築する）"""
+    feature_points_storage.put_many(point_sets)
+    for image_id in point_sets:
+        point_statistics_cache.remove(image_id)
+        comparison_cache.invalidate(image_id)
+        speculative_processor.discard_results(image_id, "extract")
+
+def load_feature_points(image_id: str):
+    """特徴点データを取得し、比較用の統計量を保存先のバージョンに追従させる"""
+    # 取得中に更新されても次回の取得で追従できるよう、バージョンを先に読む
+    version = feature_points_storage.version(image_id)
+    points = feature_points_storage.get(image_id)
+    if points is not None:
+        point_statistics_cache.ensure(image_id, points, version)
+    return points
+
+def remove_feature_points(image_id: str) -> None:
+    """特徴点データと比較用の統計量を削除する"""
+    feature_points_storage.discard(image_id)
+    point_statistics_cache.remove(image_id)
+    comparison_cache.invalidate(image_id)
+    speculative_processor.discard_results(image_id, "extract")
 
 def allowed_file(filename: str) -> bool:
     """ファイル形式をチェック"""
@@ -33,8 +100,22 @@ def validate_image(file: UploadFile) -> bool:
     return True
 
 @router.post("/upload-image", response_model=ImageUploadResponse)
-async def upload_image(file: UploadFile = File(...)):
-    """画像をアップロードする"""
+async def upload_image(file: UploadFile = File(...),
+                       original_width: Optional[int] = Form(None, gt=0),
+                       original_height: Optional[int] = Form(None, gt=0)):
+    """
+    画像をアップロードする
+    
+    クライアントで縮小してからアップロードする場合は、縮小前の大きさを
+    original_width / original_height に指定する（縮小率を記録する）。
+    両方を指定し、それぞれアップロードした画像の大きさ以上である必要がある。
+    """
+    
+    if (original_width is None) != (original_height is None):
+        raise HTTPException(
+            status_code=400,
+            detail="original_width and original_height must be specified together"
+        )
     
     # ファイル検証
     if not validate_image(file):
@@ -56,21 +137,61 @@ async def upload_image(file: UploadFile = File(...)):
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
         
-        # 画像が正常に開けるかチェック
+        # 画像が正常に開けるかチェック（画素数の上限もヘッダーで確認する）
         try:
+            header = read_image_header(file_path)
+            width, height = header["width"], header["height"]
             with Image.open(file_path) as img:
                 img.verify()
+        except ImageTooLargeError as e:
+            os.remove(file_path)
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception:
             os.remove(file_path)
             raise HTTPException(status_code=400, detail="Invalid image file")
         
+        # 縮小前の大きさはアップロードした画像より小さくならない（拡大してアップロードすることはない）
+        if original_width is not None and (original_width < width or original_height < height):
+            os.remove(file_path)
+            raise HTTPException(
+                status_code=400,
+                detail=f"Original size ({original_width}x{original_height}) is smaller than "
+                       f"the uploaded image ({width}x{height})"
+            )
+        
+        # クライアントでの縮小率（特徴点の座標はアップロード画像が基準）
+        scale_factor = 1.0
+        if original_width is not None:
+            scale_factor = width / original_width
+        
+        upload_time = datetime.now()
+        image_metadata_storage[image_id] = {
+            "filename": filename,
+            "width": width,
+            "height": height,
+            "original_width": original_width or width,
+            "original_height": original_height or height,
+            "scale_factor": scale_factor,
+            "upload_time": upload_time.isoformat()
+        }
+        
+        # FACE_UPLOAD_POLICY=speculative の場合は顔検出・特徴点抽出をバックグラウンドで始めておく
+        speculative_processor.schedule(image_id)
+        
         return ImageUploadResponse(
             image_id=image_id,
             url=f"/uploads/{filename}",
             filename=filename,
-            upload_time=datetime.now()
+            upload_time=upload_time,
+            width=width,
+            height=height,
+            original_width=original_width or width,
+            original_height=original_height or height,
+            scale_factor=scale_factor
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
@@ -79,36 +200,110 @@ async def save_feature_points(image_features: ImageFeatures):
     """特徴点データを保存する"""
     
     try:
-        # 特徴点データを保存（メモリ内）
-        feature_points_storage[image_features.image_id] = image_features.points
+        # 特徴点データを保存（特徴点集合全体を置き換える）
+        version = store_feature_points(image_features.image_id, image_features.points)
         
         return FeaturePointsResponse(
             success=True,
             message="Feature points saved successfully",
             image_id=image_features.image_id,
-            points_count=len(image_features.points)
+            points_count=len(image_features.points),
+            version=version
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save feature points: {str(e)}")
 
+@router.patch("/feature-points/{image_id}", response_model=FeaturePointsResponse)
+async def patch_feature_points(image_id: str, delta: FeaturePointsDelta):
+    """
+    特徴点データを差分で更新する
+    
+    delete のキーの特徴点を削除した後、upsert の特徴点を同じキーの位置で置き換える
+    （該当する特徴点がない場合は末尾に追加する）。キーは自動抽出した特徴点が
+    "landmark:<タイプ>:<ランドマーク番号>"、手動の特徴点が "label:<ラベル>"。
+    """
+    
+    # 読み込みから保存までの間に await を挟まないため、同じワーカー内では競合しない
+    current_version = feature_points_storage.version(image_id)
+    if delta.base_version is not None and delta.base_version != current_version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"特徴点データが更新されています（現在のバージョン: {current_version}）"
+        )
+    
+    try:
+        points = feature_points_storage.get(image_id, [])
+        points, deleted = delete_points(points, delta.delete)
+        points, replaced, added = upsert_points(points, [(item.key, item.point) for item in delta.upsert])
+        version = store_feature_points(image_id, points)
+        
+        return FeaturePointsResponse(
+            success=True,
+            message=f"Feature points updated (added: {added}, replaced: {replaced}, deleted: {deleted})",
+            image_id=image_id,
+            points_count=len(points),
+            version=version
+        )
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to update feature points: {str(e)}")
+
+def validate_wire_format(format: str) -> None:
+    """特徴点の表現形式をチェック"""
+    if format not in WIRE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"無効な表現形式です: {format}（{', '.join(WIRE_FORMATS)} のいずれかを指定してください）"
+        )
+
 @router.get("/feature-points/{image_id}")
-async def get_feature_points(image_id: str):
-    """指定された画像の特徴点データを取得する"""
+async def get_feature_points(image_id: str, request: Request, format: str = Query("json")):
+    """
+    指定された画像の特徴点データを取得する
     
-    if image_id not in feature_points_storage:
+    format に columnar / binary を指定すると、特徴点を列指向の配列で返す
+    （Accept: application/x-msgpack の場合は msgpack で返す）。
+    """
+    
+    validate_wire_format(format)
+    version = feature_points_storage.version(image_id)
+    points = feature_points_storage.get(image_id)
+    if points is None:
         raise HTTPException(status_code=404, detail="Feature points not found for this image")
     
-    return {
+    if format == "json":
+        return {
+            "image_id": image_id,
+            "version": version,
+            "points": points
+        }
+    
+    return compact_response({
         "image_id": image_id,
-        "points": feature_points_storage[image_id]
-    }
+        "version": version,
+        "format": format,
+        "points": encode_points(points, format, raw_buffers=wants_msgpack(request))
+    }, request)
+
+@router.get("/image/{image_id}")
+async def get_image_info(image_id: str):
+    """画像の情報（大きさ・クライアントでの縮小率）を取得する"""
+    
+    metadata = image_metadata_storage.get(image_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    return {"image_id": image_id, **metadata}
 
 @router.delete("/image/{image_id}")
 async def delete_image(image_id: str):
     """画像とその特徴点データを削除する"""
     
     try:
+        # 実行中・実行待ちのバックグラウンド処理を取り消す
+        speculative_processor.cancel(image_id)
+        
         # 画像ファイルを削除
         project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
         uploads_dir = os.path.join(project_root, "uploads")
@@ -118,11 +313,24 @@ async def delete_image(image_id: str):
                 os.remove(file_path)
                 break
         
-        # 特徴点データを削除
-        if image_id in feature_points_storage:
-            del feature_points_storage[image_id]
+        # 特徴点データと画像の情報を削除
+        remove_feature_points(image_id)
+        image_metadata_storage.discard(image_id)
         
         return {"success": True, "message": "Image and feature points deleted successfully"}
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to delete image: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to delete image: {str(e)}")
+
+@router.get("/speculative-status")
+async def get_speculative_status():
+    """アップロード直後のバックグラウンド処理の状態を取得する"""
+    return speculative_processor.get_processor_info()
+
+@router.delete("/speculative/{image_id}")
+async def cancel_speculative_processing(image_id: str):
+    """画像のバックグラウンド処理を取り消す"""
+    
+    if speculative_processor.cancel(image_id):
+        return {"success": True, "message": "バックグラウンド処理を取り消しました"}
+    raise HTTPException(status_code=404, detail="実行中のバックグラウンド処理はありません")
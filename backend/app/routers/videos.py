@@ -0,0 +1,145 @@
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from starlette.concurrency import run_in_threadpool
+import os
+import tempfile
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from app.models import VideoUploadResponse
+from app.routers.images import image_metadata_storage
+from app.services.admission import admission_controller, admitted
+from app.services.model_registry import DEFAULT_TRACKING_POOL_SIZE
+from app.services.speculative import speculative_processor
+from app.services.video_ingestion import DEFAULT_MAX_VIDEO_SIZE, VIDEO_EXTENSIONS, VideoIngestionService
+
+router = APIRouter()
+video_ingestion_service = VideoIngestionService()
+
+# 動画の解析は追跡用の FaceMesh を1本ごとに借りたままにするため、同時実行数をインスタンス数に合わせる
+admission_controller.limiter("upload_video", max_concurrent=DEFAULT_TRACKING_POOL_SIZE)
+
+# 受信した動画を一時ファイルに書き出す単位
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def save_video_to_temp(file: UploadFile, suffix: str) -> str:
+    """アップロードされた動画を一時ファイルに保存する（上限を超えた場合は 413）"""
+    fd, temp_path = tempfile.mkstemp(suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while chunk := file.file.read(COPY_CHUNK_SIZE):
+                size += len(chunk)
+                if size > DEFAULT_MAX_VIDEO_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"動画が大きすぎます（最大 {DEFAULT_MAX_VIDEO_SIZE // (1024 * 1024)}MB）"
+                    )
+                buffer.write(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+@router.post("/upload-video", response_model=VideoUploadResponse)
+async def upload_video(file: UploadFile = File(...),
+                       max_frames: Optional[int] = Query(None, ge=1, le=10)):
+    """
+    動画をアップロードし、顔の比較に適したフレームを画像として登録する
+
+    追跡モードの FaceMesh でフレームを解析し、検出スコア・鮮明さ・正面度の高いフレームを選ぶ。
+    選んだフレームは通常のアップロード画像と同じく、顔検出・特徴点抽出・比較に使用できる。
+    動画ファイル自体は保存しない。
+
+    Args:
+        max_frames: 選ぶフレーム数（省略時は FACE_VIDEO_SELECT_FRAMES）
+    """
+
+    extension = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    if extension not in VIDEO_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未対応の動画形式です（{', '.join(VIDEO_EXTENSIONS)}）"
+        )
+
+    video_path = await run_in_threadpool(save_video_to_temp, file, f".{extension}")
+    try:
+        async with admitted("upload_video"):
+            selection = await run_in_threadpool(
+                video_ingestion_service.select_best_frames, video_path, max_frames
+            )
+    finally:
+        os.remove(video_path)
+
+    video_id = str(uuid.uuid4())
+    if not selection["success"]:
+        if "video" not in selection:
+            raise HTTPException(status_code=400, detail=selection["message"])
+        return VideoUploadResponse(
+            success=False,
+            message=selection["message"],
+            video_id=video_id,
+            filename=file.filename,
+            frames=[],
+            video=selection["video"],
+            sampling=selection["sampling"]
+        )
+
+    try:
+        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        uploads_dir = os.path.join(project_root, "uploads")
+
+        frames = []
+        upload_time = datetime.now()
+        for frame in selection["frames"]:
+            # 選んだフレームを通常のアップロード画像として保存する
+            image_id = str(uuid.uuid4())
+            filename = f"{image_id}.jpg"
+            with open(os.path.join(uploads_dir, filename), "wb") as buffer:
+                buffer.write(frame["jpeg"])
+
+            image_metadata_storage[image_id] = {
+                "filename": filename,
+                "width": frame["width"],
+                "height": frame["height"],
+                "original_width": frame["width"],
+                "original_height": frame["height"],
+                "scale_factor": 1.0,
+                "upload_time": upload_time.isoformat(),
+                "source": {
+                    "video_id": video_id,
+                    "video_filename": file.filename,
+                    "frame_index": frame["frame_index"],
+                    "timestamp": frame["timestamp"]
+                }
+            }
+
+            # FACE_UPLOAD_POLICY=speculative の場合は顔検出・特徴点抽出をバックグラウンドで始めておく
+            speculative_processor.schedule(image_id)
+
+            frames.append({
+                **{key: value for key, value in frame.items() if key != "jpeg"},
+                "image_id": image_id,
+                "url": f"/uploads/{filename}"
+            })
+
+        return VideoUploadResponse(
+            success=True,
+            message=selection["message"],
+            video_id=video_id,
+            filename=file.filename,
+            frames=frames,
+            video=selection["video"],
+            sampling=selection["sampling"]
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"フレームの保存に失敗しました: {str(e)}")
+
+@router.get("/video-info")
+async def get_video_info():
+    """動画の取り込みの設定と状態を取得する"""
+    return {
+        **video_ingestion_service.get_video_info(),
+        "admission": admission_controller.limiter("upload_video").get_limiter_info()
+    }
@@ -0,0 +1,183 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from app.services.model_registry import DEFAULT_POOL_SIZE, ModelCheckoutTimeout
+
+# 同時に実行する重い処理の上限数（既定はモデルプールの大きさ）
+DEFAULT_MAX_CONCURRENT = int(os.environ.get("FACE_ADMISSION_MAX_CONCURRENT", str(DEFAULT_POOL_SIZE)))
+# 実行待ちにできるリクエスト数（超えた場合は即座に 429 を返す）
+DEFAULT_MAX_QUEUE = int(os.environ.get("FACE_ADMISSION_MAX_QUEUE", str(DEFAULT_MAX_CONCURRENT * 4)))
+# 実行待ちの最大時間（秒、超えた場合は 503 を返す）
+DEFAULT_QUEUE_TIMEOUT = float(os.environ.get("FACE_ADMISSION_QUEUE_TIMEOUT", "10"))
+
+
+class AdmissionRejected(Exception):
+    """リクエストを受け付けられない（過負荷）"""
+
+    def __init__(self, status_code: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    エンドポイントごとの同時実行数の制限
+
+    同時実行数が上限に達している間は待ち行列に入れ、
+    待ち行列が満杯の場合（429）や待ち時間が上限を超えた場合（503）は
+    処理を行わずに Retry-After 付きで拒否する。
+    """
+
+    def __init__(self, name: str, max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                 max_queue: int = DEFAULT_MAX_QUEUE, queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        # 処理時間の指数移動平均（Retry-After の見積もりに使用）
+        self.average_duration: Optional[float] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # セマフォはイベントループごとに作成する（テスト等でループが切り替わる場合に対応）
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._loop = loop
+        return self._semaphore
+
+    def retry_after(self) -> int:
+        """待ち行列が捌けるまでのおおよその秒数"""
+        duration = self.average_duration or 1.0
+        return max(1, math.ceil(duration * (self.waiting + 1) / self.max_concurrent))
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """実行枠を確保する（確保できない場合は AdmissionRejected）"""
+        semaphore = self._get_semaphore()
+
+        if semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise AdmissionRejected(
+                    429, f"処理待ちのリクエストが多すぎます（{self.name}）", self.retry_after()
+                )
+
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise AdmissionRejected(
+                    503, f"処理待ちがタイムアウトしました（{self.name}）", self.retry_after()
+                )
+            finally:
+                self.waiting -= 1
+        else:
+            await semaphore.acquire()
+
+        self.active += 1
+        self.admitted += 1
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_time
+            self.average_duration = (
+                duration if self.average_duration is None
+                else 0.8 * self.average_duration + 0.2 * duration
+            )
+            self.active -= 1
+            semaphore.release()
+
+    def get_limiter_info(self) -> Dict[str, Any]:
+        """制限の状態を取得"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "average_duration": self.average_duration
+        }
+
+
+class AdmissionController:
+    """エンドポイントごとの AdmissionLimiter を管理する"""
+
+    def __init__(self):
+        self._limiters: Dict[str, AdmissionLimiter] = {}
+
+    def limiter(self, name: str, **kwargs) -> AdmissionLimiter:
+        """制限を取得する（初回のみ作成）"""
+        if name not in self._limiters:
+            self._limiters[name] = AdmissionLimiter(name, **kwargs)
+        return self._limiters[name]
+
+    def get_controller_info(self) -> Dict[str, Any]:
+        """全ての制限の状態を取得"""
+        return {name: limiter.get_limiter_info() for name, limiter in self._limiters.items()}
+
+
+admission_controller = AdmissionController()
+
+
+@asynccontextmanager
+async def admitted(name: str) -> AsyncIterator[None]:
+    """
+    実行枠を確保する（確保できない場合は Retry-After 付きの HTTPException）
+
+    重複リクエストをまとめる場合など、エンドポイントの一部の処理だけを制限するときに使用する。
+    実行中にモデルインスタンスの貸し出し待ちがタイムアウトした場合も 503 を返す。
+    """
+    limiter = admission_controller.limiter(name)
+    try:
+        async with limiter.admit():
+            yield
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except ModelCheckoutTimeout as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(limiter.retry_after())}
+        )
+
+
+def admission_dependency(name: str) -> Callable[[], AsyncIterator[None]]:
+    """
+    同時実行数を制限するFastAPIの依存関係を作成する
+
+    使い方: @router.post("/...", dependencies=[Depends(admission_dependency("name"))])
+    """
+    admission_controller.limiter(name)
+
+    async def admit() -> AsyncIterator[None]:
+        async with admitted(name):
+            yield
+
+    return admit
@@ -1,24 +1,31 @@
-import cv2
 import numpy as np
-import mediapipe as mp
+import os
 from typing import List, Dict, Any, Optional, Tuple
 import base64
 from io import BytesIO
-from PIL import Image
+
+from app.services.image_decode import decode_image
+from app.services.model_registry import ModelCheckoutTimeout, model_registry
+from app.utils.lazy_import import lazy_import
+
+# 重いモジュールは初回使用時に読み込む
+cv2 = lazy_import("cv2")
+mp = lazy_import("mediapipe")
+Image = lazy_import("PIL.Image")
+
+# 処理済み画像からの抽出で、顔検出で求めたランドマークを再利用するか（0 で毎回推論する）
+REUSE_DETECTION_LANDMARKS = os.environ.get("FACE_REUSE_DETECTION_LANDMARKS", "1") != "0"
+# 再利用できるランドマーク数の下限（FaceMesh の顔のランドマーク数）
+MIN_MESH_LANDMARKS = 468
 
 
 class AutoFeatureExtractionService:
     """自動特徴点抽出サービス"""
     
-    def __init__(self):
-        self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+    def __init__(self, reuse_detection_landmarks: bool = REUSE_DETECTION_LANDMARKS):
+        # MediaPipe のモデルはレジストリのプールから処理ごとに借りる
+        self.model_registry = model_registry
+        self.reuse_detection_landmarks = reuse_detection_landmarks
         
         # MediaPipeの顔ランドマークインデックス定義
         self.landmark_indices = {
@@ -35,7 +42,8 @@ class AutoFeatureExtractionService:
         image_data: str = None,
         feature_types: List[str] = None,
         points_per_type: Dict[str, int] = None,
-        confidence_threshold: float = 0.5
+        confidence_threshold: float = 0.5,
+        mesh_landmarks: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         画像から自動で特徴点を抽出する
@@ -46,6 +54,8 @@ class AutoFeatureExtractionService:
             feature_types: 抽出する特徴点のタイプリスト
             points_per_type: 各特徴点タイプごとの点数
             confidence_threshold: 検出信頼度の閾値
+            mesh_landmarks: 顔検出で求めた全ランドマークと処理済み画像への変換行列
+                （指定した場合は処理済み画像の座標に変換して使用し、推論を行わない）
             
         Returns:
             抽出結果の辞書
@@ -65,68 +75,17 @@ class AutoFeatureExtractionService:
             }
         
         try:
-            # 画像を読み込み（パスまたはBase64データから）
-            if image_data:
-                # Base64データから画像を復元
-                try:
-                    image_bytes = base64.b64decode(image_data)
-                    pil_image = Image.open(BytesIO(image_bytes))
-                    # PIL→OpenCV形式に変換
-                    rgb_image = np.array(pil_image)
-                    # RGB→BGR変換（OpenCV用）
-                    if len(rgb_image.shape) == 3 and rgb_image.shape[2] == 3:
-                        image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
-                    else:
-                        image = rgb_image
-                except Exception as e:
-                    return {
-                        'success': False,
-                        'message': f'Base64画像データの読み込みに失敗しました: {str(e)}',
-                        'feature_points': []
-                    }
-            elif image_path:
-                # ファイルパスから画像を読み込み
-                image = cv2.imread(image_path)
-                if image is None:
-                    return {
-                        'success': False,
-                        'message': f'画像の読み込みに失敗しました: {image_path}',
-                        'feature_points': []
-                    }
-                # RGB変換
-                rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            else:
-                return {
-                    'success': False,
-                    'message': '画像パスまたは画像データが指定されていません',
-                    'feature_points': []
-                }
-            
-            # RGB画像への変換が必要な場合は変換
-            if 'rgb_image' not in locals():
-                # image_dataから来た場合はすでにRGB形式の可能性があるため確認
-                if len(image.shape) == 3 and image.shape[2] == 3:
-                    # 既にカラー画像の場合
-                    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if not image_data else rgb_image
-                else:
-                    # グレースケールの場合
-                    rgb_image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-            
-            # MediaPipeで顔ランドマークを検出
-            results = self.face_mesh.process(rgb_image)
-            
-            if not results.multi_face_landmarks:
-                return {
-                    'success': False,
-                    'message': '顔のランドマークが検出されませんでした',
-                    'feature_points': []
-                }
-            
-            # 最初の顔のランドマークを使用
-            face_landmarks = results.multi_face_landmarks[0]
+            # 顔検出で求めたランドマークがあれば処理済み画像の座標に変換する
+            landmarks = None
+            landmark_source = 'detection'
+            if mesh_landmarks is not None and self.reuse_detection_landmarks:
+                landmarks = self._landmarks_from_detection(mesh_landmarks)
             
-            # 画像サイズを取得
-            height, width = rgb_image.shape[:2]
+            if landmarks is None:
+                landmark_source = 'inference'
+                landmarks, failure = self._infer_landmarks(image_path, image_data)
+                if failure is not None:
+                    return failure
             
             # 特徴点を抽出
             extracted_points = []
@@ -142,13 +101,12 @@ class AutoFeatureExtractionService:
                 # ランドマークから座標を抽出
                 type_points = []
                 for i, idx in enumerate(indices[:max_points]):
-                    if idx < len(face_landmarks.landmark):
-                        landmark = face_landmarks.landmark[idx]
-                        x = int(landmark.x * width)
-                        y = int(landmark.y * height)
+                    if idx < len(landmarks):
+                        x = int(landmarks[idx, 0])
+                        y = int(landmarks[idx, 1])
                         
                         # 信頼度をチェック（zスコアを信頼度として使用）
-                        confidence = max(0.0, min(1.0, 1.0 - abs(landmark.z)))
+                        confidence = max(0.0, min(1.0, 1.0 - abs(float(landmarks[idx, 2]))))
                         
                         if confidence >= confidence_threshold:
                             type_points.append({
@@ -166,7 +124,8 @@ class AutoFeatureExtractionService:
                 'success': True,
                 'message': f'{len(extracted_points)}個の特徴点を自動抽出しました',
                 'feature_points': extracted_points,
-                'total_landmarks_detected': len(face_landmarks.landmark),
+                'total_landmarks_detected': len(landmarks),
+                'landmark_source': landmark_source,
                 'extraction_parameters': {
                     'feature_types': feature_types,
                     'points_per_type': points_per_type,
@@ -174,6 +133,9 @@ class AutoFeatureExtractionService:
                 }
             }
             
+        except ModelCheckoutTimeout:
+            # 過負荷のため呼び出し元で 503 にする（処理の失敗として返さない）
+            raise
         except Exception as e:
             return {
                 'success': False,
@@ -181,6 +143,100 @@ class AutoFeatureExtractionService:
                 'feature_points': []
             }
     
+    def _landmarks_from_detection(self, mesh_landmarks: Dict[str, Any]) -> Optional[np.ndarray]:
+        """
+        顔検出で求めた全ランドマーク（元画像の座標）を処理済み画像の座標に変換する
+        
+        Returns:
+            (N, 3) の配列（x, y は処理済み画像のピクセル座標、z は処理済み画像の幅で正規化した奥行き）。
+            データが不完全な場合は None（推論で求め直す）
+        """
+        try:
+            points = np.asarray(mesh_landmarks['points'], dtype=np.float64)
+            transform = np.asarray(mesh_landmarks['transform'], dtype=np.float64)
+            width = float(mesh_landmarks['image_size']['width'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if points.ndim != 2 or points.shape[1] != 3 or len(points) < MIN_MESH_LANDMARKS \
+                or transform.shape != (2, 3) or width <= 0:
+            return None
+        
+        # 回転・拡大縮小・平行移動を適用し、奥行きは拡大率だけを掛ける
+        scale = np.sqrt(abs(np.linalg.det(transform[:, :2])))
+        xy = points[:, :2] @ transform[:, :2].T + transform[:, 2]
+        return np.column_stack([xy, points[:, 2] * scale / width])
+    
+    def _infer_landmarks(self, image_path: Optional[str],
+                         image_data: Optional[str]) -> Tuple[Optional[np.ndarray], Optional[Dict[str, Any]]]:
+        """
+        画像を読み込み、FaceMesh でランドマークを求める
+        
+        Returns:
+            ((N, 3) の配列（x, y はピクセル座標、z は正規化された奥行き）, None)、
+            失敗した場合は (None, 抽出結果の辞書)
+        """
+        # 画像を読み込み（パスまたはBase64データから）
+        if image_data:
+            # Base64データから画像を復元
+            try:
+                image_bytes = base64.b64decode(image_data)
+                pil_image = Image.open(BytesIO(image_bytes))
+                # PIL→OpenCV形式に変換
+                rgb_image = np.array(pil_image)
+                # RGB→BGR変換（OpenCV用）
+                if len(rgb_image.shape) == 3 and rgb_image.shape[2] == 3:
+                    image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
+                else:
+                    image = rgb_image
+            except Exception as e:
+                return None, {
+                    'success': False,
+                    'message': f'Base64画像データの読み込みに失敗しました: {str(e)}',
+                    'feature_points': []
+                }
+        elif image_path:
+            # ファイルパスから画像を読み込み（特徴点の座標は元の大きさが基準のため縮小しない）
+            try:
+                image, _ = decode_image(image_path)
+            except (ValueError, OSError) as e:
+                return None, {
+                    'success': False,
+                    'message': f'画像の読み込みに失敗しました: {e}',
+                    'feature_points': []
+                }
+            # RGB変換
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        else:
+            return None, {
+                'success': False,
+                'message': '画像パスまたは画像データが指定されていません',
+                'feature_points': []
+            }
+        
+        # グレースケールの場合はRGBに変換
+        if len(rgb_image.shape) == 2:
+            rgb_image = cv2.cvtColor(rgb_image, cv2.COLOR_GRAY2RGB)
+        
+        # MediaPipeで顔ランドマークを検出
+        with self.model_registry.acquire("face_mesh") as face_mesh:
+            results = face_mesh.process(rgb_image)
+        
+        if not results.multi_face_landmarks:
+            return None, {
+                'success': False,
+                'message': '顔のランドマークが検出されませんでした',
+                'no_face': True,  # 画像は読めたが顔がない（処理の失敗と区別する）
+                'feature_points': []
+            }
+        
+        # 最初の顔のランドマークを画像サイズのピクセル座標にする
+        height, width = rgb_image.shape[:2]
+        landmarks = np.array([
+            (landmark.x * width, landmark.y * height, landmark.z)
+            for landmark in results.multi_face_landmarks[0].landmark
+        ])
+        return landmarks, None
+    
     def _get_feature_label(self, feature_type: str) -> str:
         """特徴点タイプのラベルを取得"""
         labels = {
@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+from app.services.memory_accounting import DEFAULT_TOP_ENTRIES, measure_entries
+
+# 保持する比較結果の上限数
+DEFAULT_MAX_ENTRIES = int(os.environ.get("FACE_COMPARISON_CACHE_SIZE", "10000"))
+
+
+class ComparisonCache:
+    """
+    比較結果（基準画像と比較画像1枚分のスコア）のLRUキャッシュ
+
+    キーは (基準画像ID, 比較画像ID, 基準画像のバージョン, 比較画像のバージョン, スコアのパラメータ)。
+    特徴点データが保存されるたびに保存先のバージョンが上がるため、
+    古い結果は他のワーカーで更新された場合も含めて使われない。
+    同じプロセスで更新された画像の結果は invalidate で即座に破棄する。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        # image_id -> その画像を含むキー
+        self._keys_by_image: Dict[str, Set[Tuple]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(reference_id: str, candidate_id: str, reference_version: Optional[int],
+                 candidate_version: Optional[int], parameters: Hashable) -> Optional[Tuple]:
+        """キャッシュキーを作成する（バージョンが不明な場合はキャッシュしない）"""
+        if reference_version is None or candidate_version is None:
+            return None
+        return (reference_id, candidate_id, reference_version, candidate_version, parameters)
+
+    def get(self, key: Optional[Tuple]) -> Optional[Any]:
+        """比較結果を取得する"""
+        if key is None:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Optional[Tuple], value: Any) -> None:
+        """比較結果を保存する（上限を超えた場合は最も古く使われた結果を破棄）"""
+        if key is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            for image_id in key[:2]:
+                self._keys_by_image.setdefault(image_id, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._unindex(old_key)
+                self.evictions += 1
+
+    def invalidate(self, image_id: str) -> int:
+        """指定画像を含む比較結果を破棄する"""
+        with self._lock:
+            keys = self._keys_by_image.pop(image_id, set())
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+                self._unindex(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        """全ての比較結果を破棄する"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_image.clear()
+
+    def _unindex(self, key: Tuple) -> None:
+        for image_id in key[:2]:
+            keys = self._keys_by_image.get(image_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_image[image_id]
+
+    def get_cache_info(self) -> Dict[str, Any]:
+        """キャッシュの状態を取得"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+    def get_memory_usage(self, top: int = DEFAULT_TOP_ENTRIES) -> Dict[str, Any]:
+        """比較結果のおおよそのメモリ使用量を取得する（画像ごとの索引は含まない）"""
+        with self._lock:
+            entries = list(self._entries.items())
+        return measure_entries(entries, top)
@@ -1,9 +1,11 @@
 import numpy as np
-from typing import List, Dict, Tuple
-from scipy.optimize import minimize_scalar
+from typing import List, Dict, Tuple, Optional
 import time
 
 from app.models import FeaturePoint
+from app.services.point_statistics import (
+    FEATURE_TYPES, point_coordinates, point_type_codes, grouped_pair_statistics
+)
 
 class FaceComparisonService:
     """顔比較サービス"""
@@ -58,24 +60,99 @@ class FaceComparisonService:
         Returns:
             (最適なλ値, 最小距離)
         """
-        def objective_function(lambda_val):
-            return self.calculate_distance(reference_points, comparison_points, lambda_val)
-        
-        # 黄金分割法を使用してλを最適化
-        result = minimize_scalar(
-            objective_function, 
-            bounds=self.lambda_range, 
-            method='bounded'
+        if len(reference_points) != len(comparison_points):
+            raise ValueError("Reference and comparison points must have the same length")
+        
+        reference_coords = point_coordinates(reference_points)
+        comparison_coords = point_coordinates(comparison_points)
+        
+        return self.optimize_lambda_from_statistics(
+            float(np.sum(reference_coords * reference_coords)),
+            float(np.sum(reference_coords * comparison_coords)),
+            float(np.sum(comparison_coords * comparison_coords))
         )
+    
+    def optimize_lambda_from_statistics(self, sum_ref_sq: float, sum_cross: float,
+                                        sum_comp_sq: float) -> Tuple[float, float]:
+        """
+        十分統計量からλを最適化する
+        
+        D(λ) = Σx² - 2λΣx·y + λ²Σy² はλの2次関数なので、
+        最小値は λ = Σx·y / Σy² を探索範囲に収めた点で得られる
+        
+        Args:
+            sum_ref_sq: 基準画像の Σx²
+            sum_cross: 基準画像と比較画像の Σx·y
+            sum_comp_sq: 比較画像の Σy²
+            
+        Returns:
+            (最適なλ値, 最小距離)
+        """
+        lambda_min, lambda_max = self.lambda_range
+        
+        if sum_comp_sq > 0:
+            optimal_lambda = min(max(sum_cross / sum_comp_sq, lambda_min), lambda_max)
+        else:
+            optimal_lambda = lambda_min
+        
+        min_distance = sum_ref_sq - 2 * optimal_lambda * sum_cross + optimal_lambda ** 2 * sum_comp_sq
+        
+        # 丸め誤差で負にならないようにする
+        return optimal_lambda, max(min_distance, 0.0)
+    
+    def _distances_by_type(self, statistics: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                           lambda_val: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        タイプ別の十分統計量から部分距離とタイプ別の最適λを一括で求める
+        
+        Returns:
+            (全体λでの部分距離, タイプ別の最適λ, タイプ別λでの距離) それぞれ FEATURE_TYPES 順
+        """
+        sum_ref_sq, sum_cross, sum_comp_sq = statistics
+        lambda_min, lambda_max = self.lambda_range
+        
+        # 全体のλでの部分距離（合計すると全体の距離になる）
+        partial = sum_ref_sq - 2 * lambda_val * sum_cross + lambda_val ** 2 * sum_comp_sq
         
-        optimal_lambda = result.x
-        min_distance = result.fun
+        # タイプ別の閉形式解（再最適化は行わない）
+        safe_comp_sq = np.where(sum_comp_sq > 0, sum_comp_sq, 1.0)
+        lambdas = np.where(sum_comp_sq > 0, np.clip(sum_cross / safe_comp_sq, lambda_min, lambda_max), lambda_min)
+        type_distances = sum_ref_sq - 2 * lambdas * sum_cross + lambdas ** 2 * sum_comp_sq
         
-        return optimal_lambda, min_distance
+        return np.maximum(partial, 0.0), lambdas, np.maximum(type_distances, 0.0)
+    
+    def score_candidate(self, statistics: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> Dict:
+        """
+        タイプ別の十分統計量から比較画像1枚分のスコアを求める
+        
+        Returns:
+            {optimal_lambda, distance, partial, type_lambdas, type_distances}
+            （配列は FEATURE_TYPES 順）
+        """
+        # タイプ別の合計が全体の統計量
+        optimal_lambda, min_distance = self.optimize_lambda_from_statistics(
+            *(float(np.sum(values)) for values in statistics)
+        )
+        partial, type_lambdas, type_distances = self._distances_by_type(statistics, optimal_lambda)
+        
+        return {
+            "optimal_lambda": optimal_lambda,
+            "distance": min_distance,
+            "partial": partial,
+            "type_lambdas": type_lambdas,
+            "type_distances": type_distances
+        }
+    
+    def get_scoring_parameters(self) -> Tuple:
+        """スコアに影響するパラメータ（比較結果のキャッシュキーに使用）"""
+        return (tuple(self.lambda_range),)
     
     def compare_faces(self, reference_points: List[FeaturePoint],
                      comparison1_points: List[FeaturePoint],
-                     comparison2_points: List[FeaturePoint]) -> Dict:
+                     comparison2_points: List[FeaturePoint],
+                     pair_statistics: Optional[List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = None,
+                     type_counts: Optional[np.ndarray] = None,
+                     candidate_scores: Optional[List[Dict]] = None) -> Dict:
         """
         2つの画像を基準画像と比較する
         
@@ -83,6 +160,11 @@ class FaceComparisonService:
             reference_points: 基準画像の特徴点
             comparison1_points: 比較画像1の特徴点
             comparison2_points: 比較画像2の特徴点
+            pair_statistics: 比較画像1・2それぞれのタイプ別十分統計量 (Σx², Σx·y, Σy²)。
+                指定された場合は特徴点を走査せずに最適化する
+            type_counts: 基準画像のタイプ別特徴点数（FEATURE_TYPES 順）
+            candidate_scores: 比較画像1・2それぞれの score_candidate の結果。
+                指定された場合は統計量からの計算を省略する
             
         Returns:
             比較結果の辞書
@@ -90,15 +172,40 @@ class FaceComparisonService:
         start_time = time.time()
         
         try:
-            # 画像1との比較
-            optimal_lambda1, min_distance1 = self.optimize_lambda(
-                reference_points, comparison1_points
-            )
+            if len(reference_points) != len(comparison1_points) or len(reference_points) != len(comparison2_points):
+                raise ValueError("Reference and comparison points must have the same length")
             
-            # 画像2との比較
-            optimal_lambda2, min_distance2 = self.optimize_lambda(
-                reference_points, comparison2_points
-            )
+            if candidate_scores is None:
+                if pair_statistics is None:
+                    # タイプ別の十分統計量を1回の走査で集計
+                    pair_statistics = [
+                        grouped_pair_statistics(reference_points, comparison1_points),
+                        grouped_pair_statistics(reference_points, comparison2_points)
+                    ]
+                candidate_scores = [self.score_candidate(statistics) for statistics in pair_statistics]
+            
+            if type_counts is None:
+                type_counts = np.bincount(point_type_codes(reference_points), minlength=len(FEATURE_TYPES))
+            
+            score1, score2 = candidate_scores
+            optimal_lambda1, min_distance1 = score1["optimal_lambda"], score1["distance"]
+            optimal_lambda2, min_distance2 = score2["optimal_lambda"], score2["distance"]
+            partial1, type_lambdas1, type_distances1 = score1["partial"], score1["type_lambdas"], score1["type_distances"]
+            partial2, type_lambdas2, type_distances2 = score2["partial"], score2["type_lambdas"], score2["type_distances"]
+            
+            feature_type_scores = {
+                feature_type: {
+                    "points_count": int(type_counts[code]),
+                    "image1_partial_score": float(partial1[code]),
+                    "image2_partial_score": float(partial2[code]),
+                    "optimal_lambda1": float(type_lambdas1[code]),
+                    "optimal_lambda2": float(type_lambdas2[code]),
+                    "image1_type_score": float(type_distances1[code]),
+                    "image2_type_score": float(type_distances2[code])
+                }
+                for code, feature_type in enumerate(FEATURE_TYPES)
+                if type_counts[code] > 0
+            }
             
             # より近い画像を判定
             closer_image = "image1" if min_distance1 < min_distance2 else "image2"
@@ -110,11 +217,11 @@ class FaceComparisonService:
                 "comparison2_points_count": len(comparison2_points),
                 "lambda_optimization_range": self.lambda_range,
                 "distance_difference": abs(min_distance1 - min_distance2),
-                "similarity_ratio": min(min_distance1, min_distance2) / max(min_distance1, min_distance2),
-                "feature_types_used": list(set([
-                    point.type if hasattr(point, 'type') else point.get('type', 'unknown') 
-                    for point in reference_points
-                ]))
+                "similarity_ratio": (
+                    min(min_distance1, min_distance2) / max(min_distance1, min_distance2)
+                    if max(min_distance1, min_distance2) > 0 else 1.0
+                ),
+                "feature_types_used": list(feature_type_scores.keys())
             }
             
             execution_time = time.time() - start_time
@@ -126,6 +233,7 @@ class FaceComparisonService:
                 "optimal_lambda2": float(optimal_lambda2),
                 "closer_image": closer_image,
                 "details": details,
+                "feature_type_scores": feature_type_scores,
                 "execution_time": execution_time
             }
             
@@ -1,92 +1,107 @@
-import cv2
 import numpy as np
-import mediapipe as mp
-from PIL import Image
 import io
 import base64
+import logging
 import os
 import uuid
 from typing import Tuple, Optional, Dict, Any
 
+from app.services.image_decode import DEFAULT_DECODE_MAX_EDGE, decode_image
+from app.services.model_registry import ModelCheckoutTimeout, model_registry
+from app.utils.lazy_import import lazy_import
+
+# 重いモジュールは初回使用時に読み込む
+cv2 = lazy_import("cv2")
+mp = lazy_import("mediapipe")
+Image = lazy_import("PIL.Image")
+
+logger = logging.getLogger(__name__)
+
+# 処理済み画像の一辺の長さ（入力画像の大きさによらず一定にする）
+DEFAULT_CANONICAL_SIZE = int(os.environ.get("FACE_CANONICAL_SIZE", "512"))
+
+# 顔の位置を求める処理の構成
+# accurate: 顔検出モデルで顔領域を求め、切り出した顔に FaceMesh を実行する（2モデル）
+# fast: 縮小画像に FaceMesh を1回だけ実行し、ランドマークの範囲から顔領域を求める
+PIPELINE_MODES = ("accurate", "fast")
+DEFAULT_PIPELINE = os.environ.get("FACE_PIPELINE", "accurate")
+# fast 構成で FaceMesh に渡す画像の長辺
+DEFAULT_FAST_PIPELINE_EDGE = int(os.environ.get("FACE_FAST_PIPELINE_EDGE", "640"))
+
 class FaceDetectionService:
     """顔検出・処理サービス"""
     
-    def __init__(self):
-        # MediaPipe の初期化
-        self.mp_face_detection = mp.solutions.face_detection
-        self.mp_face_mesh = mp.solutions.face_mesh
-        self.mp_drawing = mp.solutions.drawing_utils
-        
-        # 顔検出用
-        self.face_detection = self.mp_face_detection.FaceDetection(
-            model_selection=1,  # 0: 近距離用, 1: 遠距離用
-            min_detection_confidence=0.5
-        )
-        
-        # 顔ランドマーク検出用
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+    def __init__(self, canonical_size: int = DEFAULT_CANONICAL_SIZE, margin: float = 0.3,
+                 pipeline: str = DEFAULT_PIPELINE, fast_pipeline_edge: int = DEFAULT_FAST_PIPELINE_EDGE,
+                 decode_max_edge: int = DEFAULT_DECODE_MAX_EDGE):
+        if pipeline not in PIPELINE_MODES:
+            raise ValueError(f"未対応の処理構成です: {pipeline}（{', '.join(PIPELINE_MODES)}）")
+        # MediaPipe のモデルはレジストリのプールから処理ごとに借りる
+        self.model_registry = model_registry
+        self.canonical_size = canonical_size
+        self.margin = margin
+        self.pipeline = pipeline
+        self.fast_pipeline_edge = fast_pipeline_edge
+        self.decode_max_edge = decode_max_edge
     
-    def detect_and_process_face(self, image_path: str, uploads_dir: str = None) -> Dict[str, Any]:
+    def detect_and_process_face(self, image_path: str, uploads_dir: str = None,
+                                pipeline: Optional[str] = None) -> Dict[str, Any]:
         """
         顔を検出し、トリミング・正面化処理を行う
         
         Args:
             image_path: 処理する画像のパス
+            pipeline: 顔の位置を求める処理の構成（accurate / fast、省略時はサービスの設定）
             
         Returns:
             処理結果の辞書
         """
+        pipeline = pipeline or self.pipeline
+        if pipeline not in PIPELINE_MODES:
+            raise ValueError(f"未対応の処理構成です: {pipeline}（{', '.join(PIPELINE_MODES)}）")
+        
         try:
-            # 画像を読み込み
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError(f"画像を読み込めません: {image_path}")
+            # 画像を読み込み（大きな JPEG は顔検出に必要な解像度まで縮小して復号する）
+            image, decode_scale = decode_image(image_path, max_edge=self.decode_max_edge)
             
-            # RGB に変換（MediaPipe 用）
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # 顔検出
-            detection_result = self.face_detection.process(image_rgb)
+            # 顔の位置（境界ボックスと元画像の座標でのランドマーク）を求める
+            if pipeline == "fast":
+                located = self._locate_face_fast(image)
+            else:
+                located = self._locate_face_accurate(image)
             
-            if not detection_result.detections:
+            if located is None:
                 return {
                     "success": False,
                     "message": "顔が検出されませんでした",
+                    "no_face": True,  # 画像は読めたが顔がない（処理の失敗と区別する）
                     "original_image": self._image_to_base64(image),
                     "processed_image": None,
                     "face_landmarks": None
                 }
             
-            # 最初に検出された顔を使用
-            detection = detection_result.detections[0]
+            face_bbox = located["bbox"]
+            face_landmarks = located["landmarks"]
+            source_points = located["points"]
             
-            # 顔の境界ボックスを取得
-            face_bbox = self._get_face_bbox(detection, image.shape)
+            # トリミング・回転・拡大縮小を1回のアフィン変換で行い、一定の大きさに正規化
+            transform, angle, scale = self._canonical_transform(face_bbox, source_points)
+            aligned_face = cv2.warpAffine(
+                image, transform, (self.canonical_size, self.canonical_size), flags=cv2.INTER_LINEAR
+            )
             
-            # 顔をトリミング（余白を追加）
-            cropped_face = self._crop_face_with_margin(image, face_bbox, margin=0.3)
-            
-            # 顔ランドマークを検出
-            landmarks_result = self.face_mesh.process(cv2.cvtColor(cropped_face, cv2.COLOR_BGR2RGB))
-            
-            # 正面化処理
-            if landmarks_result.multi_face_landmarks:
-                aligned_face = self._align_face(cropped_face, landmarks_result.multi_face_landmarks[0])
-            else:
-                aligned_face = cropped_face
-            
-            # ランドマークデータの取得
+            # ランドマークデータの取得（処理済み画像の座標）
             landmarks_data = None
-            if landmarks_result.multi_face_landmarks:
+            mesh_landmarks = None
+            if face_landmarks is not None:
                 landmarks_data = self._extract_landmarks_data(
-                    landmarks_result.multi_face_landmarks[0], 
-                    aligned_face.shape
+                    face_landmarks,
+                    aligned_face.shape,
+                    points=source_points @ transform[:, :2].T + transform[:, 2]
+                )
+                # 全ランドマークと変換行列を残し、処理済み画像からの特徴点抽出で再推論しないようにする
+                mesh_landmarks = self._mesh_landmarks_data(
+                    face_landmarks, source_points, located["depth_scale"], transform, decode_scale
                 )
             
             # 処理済み画像をファイルに保存
@@ -112,15 +127,23 @@ class FaceDetectionService:
                 "processed_image_id": processed_image_id if uploads_dir else None,
                 "processed_image_filename": processed_image_filename,
                 "processed_image_url": processed_image_url,
-                "face_bbox": face_bbox,
+                "face_bbox": self._scale_bbox(face_bbox, 1 / decode_scale),  # 元画像の座標
                 "face_landmarks": landmarks_data,
+                "mesh_landmarks": mesh_landmarks,
                 "processing_info": {
-                    "detection_confidence": detection.score[0],
-                    "landmarks_detected": len(landmarks_result.multi_face_landmarks) if landmarks_result.multi_face_landmarks else 0,
-                    "processed_size": aligned_face.shape[:2]
+                    "pipeline": pipeline,
+                    "detection_confidence": located["confidence"],
+                    "landmarks_detected": 1 if face_landmarks is not None else 0,
+                    "processed_size": aligned_face.shape[:2],
+                    "alignment_angle": angle,
+                    "alignment_scale": scale * decode_scale,  # 元画像に対する拡大率
+                    "decode_scale": decode_scale
                 }
             }
             
+        except ModelCheckoutTimeout:
+            # 過負荷のため呼び出し元で 503 にする（処理の失敗として返さない）
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -130,6 +153,96 @@ class FaceDetectionService:
                 "face_landmarks": None
             }
     
+    def _locate_face_accurate(self, image: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        顔検出モデルで顔領域を求め、余白付きで切り出した顔に FaceMesh を実行する
+        
+        Returns:
+            {bbox, points, landmarks, depth_scale, confidence}。顔が検出されない場合は None
+            （FaceMesh がランドマークを検出できない場合は points・landmarks が None）
+            depth_scale は正規化された奥行き（z）を元画像のピクセル単位にする係数
+        """
+        with self.model_registry.acquire("face_detection") as face_detection:
+            detection_result = face_detection.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        
+        if not detection_result.detections:
+            return None
+        
+        # 最初に検出された顔を使用
+        detection = detection_result.detections[0]
+        
+        # 顔の境界ボックスを取得
+        face_bbox = self._get_face_bbox(detection, image.shape)
+        
+        # 顔をトリミング（余白を追加、ランドマーク検出用のビューでコピーは行わない）
+        cropped_face, crop_origin = self._crop_face_with_margin(image, face_bbox, margin=self.margin)
+        
+        # 顔ランドマークを検出
+        with self.model_registry.acquire("face_mesh") as face_mesh:
+            landmarks_result = face_mesh.process(cv2.cvtColor(cropped_face, cv2.COLOR_BGR2RGB))
+        
+        face_landmarks = (
+            landmarks_result.multi_face_landmarks[0]
+            if landmarks_result.multi_face_landmarks else None
+        )
+        
+        # ランドマークを元画像の座標に変換
+        source_points = None
+        if face_landmarks is not None:
+            crop_h, crop_w = cropped_face.shape[:2]
+            source_points = np.array(
+                [(lm.x * crop_w, lm.y * crop_h) for lm in face_landmarks.landmark]
+            ) + crop_origin
+        
+        return {
+            "bbox": face_bbox,
+            "points": source_points,
+            "landmarks": face_landmarks,
+            "depth_scale": float(cropped_face.shape[1]),
+            "confidence": float(detection.score[0])
+        }
+    
+    def _locate_face_fast(self, image: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        縮小画像に FaceMesh を1回だけ実行し、ランドマークの範囲から顔領域を求める
+        
+        FaceMesh は内部で顔の位置を推定するため、顔検出モデルの実行を省略できる。
+        ランドマークは縮小画像で求めるため、accurate 構成より座標の精度は下がる。
+        
+        Returns:
+            {bbox, points, landmarks, depth_scale, confidence}。顔が検出されない場合は None
+            （FaceMesh は検出の信頼度を返さないため confidence は None）
+        """
+        h, w = image.shape[:2]
+        scale = min(1.0, self.fast_pipeline_edge / max(h, w))
+        frame = image if scale >= 1.0 else cv2.resize(
+            image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA
+        )
+        
+        with self.model_registry.acquire("face_mesh") as face_mesh:
+            landmarks_result = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        
+        if not landmarks_result.multi_face_landmarks:
+            return None
+        
+        face_landmarks = landmarks_result.multi_face_landmarks[0]
+        
+        # 縮小画像の正規化座標を元画像の座標に変換
+        source_points = np.array([(lm.x, lm.y) for lm in face_landmarks.landmark]) * (w, h)
+        
+        # ランドマークの範囲を顔の境界ボックスとする
+        x1, y1 = np.clip(source_points.min(axis=0), 0, (w, h)).astype(int)
+        x2, y2 = np.clip(source_points.max(axis=0), 0, (w, h)).astype(int)
+        face_bbox = {"x": int(x1), "y": int(y1), "width": int(x2 - x1), "height": int(y2 - y1)}
+        
+        return {
+            "bbox": face_bbox,
+            "points": source_points,
+            "landmarks": face_landmarks,
+            "depth_scale": float(w),
+            "confidence": None
+        }
+    
     def _get_face_bbox(self, detection, image_shape) -> Dict[str, int]:
         """顔の境界ボックスを取得"""
         bbox = detection.location_data.relative_bounding_box
@@ -147,8 +260,20 @@ class FaceDetectionService:
             "height": min(height, h - y)
         }
     
-    def _crop_face_with_margin(self, image: np.ndarray, bbox: Dict[str, int], margin: float = 0.3) -> np.ndarray:
-        """顔を余白付きでトリミング"""
+    def _scale_bbox(self, bbox: Dict[str, int], factor: float) -> Dict[str, int]:
+        """境界ボックスを拡大縮小する"""
+        if factor == 1.0:
+            return bbox
+        return {key: int(round(value * factor)) for key, value in bbox.items()}
+    
+    def _crop_face_with_margin(self, image: np.ndarray, bbox: Dict[str, int],
+                               margin: float = 0.3) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        顔を余白付きでトリミング
+        
+        Returns:
+            (トリミングした画像（元画像のビュー）, 元画像でのトリミング位置 (x, y))
+        """
         h, w, _ = image.shape
         
         # 余白を計算
@@ -161,48 +286,85 @@ class FaceDetectionService:
         x2 = min(w, bbox["x"] + bbox["width"] + margin_x)
         y2 = min(h, bbox["y"] + bbox["height"] + margin_y)
         
-        return image[y1:y2, x1:x2]
+        return image[y1:y2, x1:x2], np.array([x1, y1], dtype=np.float64)
     
-    def _align_face(self, face_image: np.ndarray, landmarks) -> np.ndarray:
-        """顔を正面に向ける（基本的な回転補正）"""
-        try:
-            h, w, _ = face_image.shape
-            
-            # 重要なランドマークのインデックス（MediaPipe Face Mesh）
-            # 左目の外側角、右目の外側角
-            left_eye_corner = 33   # 左目外側
-            right_eye_corner = 263 # 右目外側
-            
-            # ランドマーク座標を取得
-            left_eye = np.array([
-                landmarks.landmark[left_eye_corner].x * w,
-                landmarks.landmark[left_eye_corner].y * h
-            ])
-            
-            right_eye = np.array([
-                landmarks.landmark[right_eye_corner].x * w,
-                landmarks.landmark[right_eye_corner].y * h
-            ])
-            
-            # 目の間の角度を計算
-            eye_vector = right_eye - left_eye
-            angle = np.degrees(np.arctan2(eye_vector[1], eye_vector[0]))
-            
-            # 回転行列を作成（中心は画像の中心）
-            center = (w // 2, h // 2)
-            rotation_matrix = cv2.getRotationMatrix2D(center, -angle, 1.0)
-            
-            # 回転適用
-            aligned_face = cv2.warpAffine(face_image, rotation_matrix, (w, h))
-            
-            return aligned_face
+    def _eye_angle(self, points: np.ndarray) -> float:
+        """両目の外側角を結ぶ線の傾き（度）を求める"""
+        # 重要なランドマークのインデックス（MediaPipe Face Mesh）
+        # 左目の外側角、右目の外側角
+        left_eye_corner = 33   # 左目外側
+        right_eye_corner = 263 # 右目外側
+        
+        eye_vector = points[right_eye_corner] - points[left_eye_corner]
+        return float(np.degrees(np.arctan2(eye_vector[1], eye_vector[0])))
+    
+    def _canonical_transform(self, bbox: Dict[str, int],
+                             points: Optional[np.ndarray] = None) -> Tuple[np.ndarray, float, float]:
+        """
+        元画像から正規化画像へのアフィン変換を求める
+        
+        余白付きの顔領域（正方形）を canonical_size × canonical_size に写し、
+        ランドマークがある場合は両目が水平になるよう回転も合成する。
+        
+        Returns:
+            (2×3 の変換行列, 回転角（度）, 拡大率)
+        """
+        center = (bbox["x"] + bbox["width"] / 2, bbox["y"] + bbox["height"] / 2)
+        side = max(bbox["width"], bbox["height"]) * (1 + 2 * self.margin)
+        scale = self.canonical_size / max(side, 1.0)
+        
+        angle = 0.0
+        if points is not None:
+            try:
+                angle = self._eye_angle(points)
+            except Exception as e:
+                logger.warning("顔の正面化でエラー: %s", e)
+                angle = 0.0
+        
+        # 顔の中心を基準に回転・拡大縮小し、中心を出力画像の中心へ移動
+        transform = cv2.getRotationMatrix2D(center, angle, scale)
+        transform[0, 2] += self.canonical_size / 2 - center[0]
+        transform[1, 2] += self.canonical_size / 2 - center[1]
+        
+        return transform, angle, scale
+    
+    def _mesh_landmarks_data(self, landmarks, points: np.ndarray, depth_scale: float,
+                             transform: np.ndarray, decode_scale: float) -> Dict[str, Any]:
+        """
+        全ランドマーク（元画像の座標）と元画像から処理済み画像へのアフィン変換を求める
+        
+        Args:
+            landmarks: MediaPipe のランドマーク
+            points: 復号した画像でのランドマーク座標 (N, 2)
+            depth_scale: 正規化された奥行き（z）を復号した画像のピクセル単位にする係数
+            transform: 復号した画像から処理済み画像への 2×3 の変換行列
+            decode_scale: 復号した画像の元画像に対する縮小率
             
-        except Exception as e:
-            print(f"顔の正面化でエラー: {e}")
-            return face_image  # エラー時は元の画像を返す
+        Returns:
+            {points: [[x, y, z], ...]（元画像のピクセル単位）, transform: 2×3 の変換行列, image_size}
+        """
+        depths = np.array([lm.z for lm in landmarks.landmark]) * depth_scale
+        original_points = np.column_stack([points, depths]) / decode_scale
+        # 元画像の座標を受け取るよう、縮小分を変換行列に含める
+        original_transform = transform.copy()
+        original_transform[:, :2] *= decode_scale
+        
+        return {
+            "points": np.round(original_points, 2).tolist(),
+            "transform": original_transform.tolist(),
+            "image_size": {"width": self.canonical_size, "height": self.canonical_size}
+        }
     
-    def _extract_landmarks_data(self, landmarks, image_shape) -> Dict[str, Any]:
-        """ランドマークデータを抽出"""
+    def _extract_landmarks_data(self, landmarks, image_shape,
+                                points: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """
+        ランドマークデータを抽出
+        
+        Args:
+            landmarks: MediaPipe のランドマーク
+            image_shape: 座標の基準とする画像のサイズ
+            points: 画像上のランドマーク座標 (N, 2)。省略時は正規化座標に画像サイズを掛ける
+        """
         h, w = image_shape[:2]
         
         # 重要なランドマークのインデックス
@@ -222,8 +384,8 @@ class FaceDetectionService:
             if index < len(landmarks.landmark):
                 landmark = landmarks.landmark[index]
                 extracted_landmarks[name] = {
-                    "x": landmark.x * w,
-                    "y": landmark.y * h,
+                    "x": float(points[index][0]) if points is not None else landmark.x * w,
+                    "y": float(points[index][1]) if points is not None else landmark.y * h,
                     "z": landmark.z if hasattr(landmark, 'z') else 0
                 }
         
@@ -253,6 +415,10 @@ class FaceDetectionService:
             "opencv_version": cv2.__version__,
             "face_detection_model": "MediaPipe Face Detection (Long Range)",
             "face_mesh_model": "MediaPipe Face Mesh",
+            "pipeline": self.pipeline,
+            "pipeline_modes": list(PIPELINE_MODES),
+            "fast_pipeline_edge": self.fast_pipeline_edge,
+            "decode_max_edge": self.decode_max_edge,
             "supported_formats": ["JPEG", "PNG", "BMP"],
             "max_faces": 1,
             "landmark_points": 468
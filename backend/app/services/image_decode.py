@@ -0,0 +1,139 @@
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.utils.lazy_import import lazy_import
+
+# 重いモジュールは初回使用時に読み込む
+cv2 = lazy_import("cv2")
+Image = lazy_import("PIL.Image")
+
+# 復号を許可する画素数の上限（展開後に巨大になる画像によるメモリの急増を防ぐ）
+DEFAULT_MAX_IMAGE_PIXELS = int(os.environ.get("FACE_MAX_IMAGE_PIXELS", str(50_000_000)))
+# 顔検出用に復号する画像の長辺の上限（これより大きい画像は縮小して復号する）
+DEFAULT_DECODE_MAX_EDGE = int(os.environ.get("FACE_DECODE_MAX_EDGE", "2048"))
+
+# EXIF の Orientation
+EXIF_ORIENTATION_TAG = 0x0112
+# 縦横が入れ替わる値
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class ImageTooLargeError(ValueError):
+    """画素数が上限を超える画像"""
+
+
+def read_image_header(image_path: str, max_pixels: int = DEFAULT_MAX_IMAGE_PIXELS) -> Dict[str, Any]:
+    """
+    画素を復号せずにヘッダーから画像の大きさと EXIF の向きを読み込む
+
+    Returns:
+        {width, height, orientation, format}（width / height は向きを適用した後の大きさ）
+
+    Raises:
+        ImageTooLargeError: 画素数が max_pixels を超える場合
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+        orientation = 1
+        try:
+            orientation = int(img.getexif().get(EXIF_ORIENTATION_TAG) or 1)
+        except Exception:
+            pass
+        image_format = img.format
+
+    if width * height > max_pixels:
+        raise ImageTooLargeError(
+            f"画像の画素数が上限を超えています（{width}×{height}、上限 {max_pixels:,} 画素）"
+        )
+
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return {"width": width, "height": height, "orientation": orientation, "format": image_format}
+
+
+def reduced_imread_flag(long_edge: int, target_edge: int, grayscale: bool = False) -> int:
+    """
+    長辺 target_edge 以上を保つ範囲で最も小さく縮小して読み込む imread のフラグ
+
+    JPEG は DCT の段階で 1/2・1/4・1/8 に縮小して復号されるため、全画素を復号するより
+    速く、メモリも縮小後の大きさ分しか使わない（他の形式は全体を復号してから縮小される）。
+    EXIF の向きは apply_orientation で適用するため、imread では適用しない。
+    """
+    reductions = [
+        (8, cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    ]
+    flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    for factor, color_flag, gray_flag in reductions:
+        if long_edge // factor >= target_edge:
+            flag = gray_flag if grayscale else color_flag
+            break
+    return flag | cv2.IMREAD_IGNORE_ORIENTATION
+
+
+def apply_orientation(image: np.ndarray, orientation: int) -> np.ndarray:
+    """EXIF の向きを適用する"""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def decode_image(image_path: str, max_edge: Optional[int] = None, grayscale: bool = False,
+                 header: Optional[Dict[str, Any]] = None,
+                 max_pixels: int = DEFAULT_MAX_IMAGE_PIXELS) -> Tuple[np.ndarray, float]:
+    """
+    画像を復号する（EXIF の向きを適用、max_edge 指定時は長辺を max_edge 以下に縮小）
+
+    Args:
+        image_path: 画像のパス
+        max_edge: 長辺の上限（省略時は元の大きさで復号する）
+        grayscale: グレースケールで復号する
+        header: read_image_header の結果（読み込み済みの場合はヘッダーを再度読まない）
+        max_pixels: 復号を許可する画素数の上限
+
+    Returns:
+        (BGR またはグレースケールの画像, 向きを適用した元画像に対する縮小率)
+
+    Raises:
+        ImageTooLargeError: 画素数が上限を超える場合
+        ValueError: 画像を読み込めない場合
+    """
+    if header is None:
+        header = read_image_header(image_path, max_pixels)
+    long_edge = max(header["width"], header["height"])
+
+    if max_edge:
+        flag = reduced_imread_flag(long_edge, max_edge, grayscale)
+    else:
+        flag = (cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR) | cv2.IMREAD_IGNORE_ORIENTATION
+
+    image = cv2.imread(image_path, flag)
+    if image is None:
+        raise ValueError(f"画像を読み込めません: {image_path}")
+    image = apply_orientation(image, header["orientation"])
+
+    # DCT での縮小は 1/2 単位のため、上限を超える分は補間で縮小する
+    h, w = image.shape[:2]
+    if max_edge and max(h, w) > max_edge:
+        resize_scale = max_edge / max(h, w)
+        image = cv2.resize(
+            image, (max(1, round(w * resize_scale)), max(1, round(h * resize_scale))),
+            interpolation=cv2.INTER_AREA
+        )
+
+    return image, image.shape[1] / header["width"]
@@ -0,0 +1,175 @@
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.image_decode import ImageTooLargeError, decode_image, read_image_header
+from app.services.model_registry import model_registry
+from app.utils.lazy_import import lazy_import
+
+# 重いモジュールは初回使用時に読み込む
+cv2 = lazy_import("cv2")
+
+# 品質チェックを行うか（0 で無効化）
+FACE_QUALITY_GATE = os.environ.get("FACE_QUALITY_GATE", "1") != "0"
+# 顔検出に使える画像の短辺の最小ピクセル数
+DEFAULT_MIN_EDGE = int(os.environ.get("FACE_QUALITY_MIN_EDGE", "64"))
+# ぼけの判定に使うラプラシアンの分散の下限（長辺 ANALYSIS_EDGE に縮小した画像での値）
+DEFAULT_MIN_SHARPNESS = float(os.environ.get("FACE_QUALITY_MIN_SHARPNESS", "12"))
+# 露出の判定に使う平均輝度の範囲
+DEFAULT_MIN_BRIGHTNESS = float(os.environ.get("FACE_QUALITY_MIN_BRIGHTNESS", "30"))
+DEFAULT_MAX_BRIGHTNESS = float(os.environ.get("FACE_QUALITY_MAX_BRIGHTNESS", "230"))
+# 縮小画像での顔検出による事前確認（off: 行わない / flag: 警告のみ / reject: 顔がなければ不合格）
+DEFAULT_PROBE_MODE = os.environ.get("FACE_QUALITY_PROBE", "off")
+
+PROBE_MODES = ("off", "flag", "reject")
+
+# 解析に使う画像の長辺（ぼけの指標が解像度に依存しないよう、この大きさに揃える）
+ANALYSIS_EDGE = 512
+# 顔検出による事前確認に使う縮小画像の長辺
+PROBE_EDGE = 192
+# 白飛び・黒つぶれとみなす輝度
+CLIPPED_DARK = 16
+CLIPPED_BRIGHT = 239
+# 白飛び・黒つぶれの画素がこの割合を超えたら警告する
+CLIPPED_WARNING_FRACTION = 0.5
+
+
+class ImageQualityService:
+    """
+    推論前の画像品質チェック
+
+    縮小して復号した画像で大きさ・ぼけ・露出を数ミリ秒で判定し、
+    顔検出に使えない画像をモデルを実行する前に除外する。
+    """
+
+    def __init__(self, min_edge: int = DEFAULT_MIN_EDGE,
+                 min_sharpness: float = DEFAULT_MIN_SHARPNESS,
+                 min_brightness: float = DEFAULT_MIN_BRIGHTNESS,
+                 max_brightness: float = DEFAULT_MAX_BRIGHTNESS,
+                 probe_mode: str = DEFAULT_PROBE_MODE):
+        if probe_mode not in PROBE_MODES:
+            raise ValueError(f"未対応の事前確認モードです: {probe_mode}（{', '.join(PROBE_MODES)}）")
+        self.model_registry = model_registry
+        self.min_edge = min_edge
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.probe_mode = probe_mode
+
+    def assess(self, image_path: str, probe_mode: Optional[str] = None) -> Dict[str, Any]:
+        """
+        画像の品質を判定する
+
+        Args:
+            image_path: 画像のパス
+            probe_mode: 顔検出による事前確認のモード（省略時はサービスの設定）
+
+        Returns:
+            {passed, reasons, warnings, metrics, elapsed_ms}
+            reasons は不合格の理由、warnings は処理は続けるが注意が必要な点
+        """
+        start_time = time.perf_counter()
+        probe_mode = probe_mode or self.probe_mode
+        if probe_mode not in PROBE_MODES:
+            raise ValueError(f"未対応の事前確認モードです: {probe_mode}（{', '.join(PROBE_MODES)}）")
+
+        reasons: List[Dict[str, str]] = []
+        warnings: List[Dict[str, str]] = []
+
+        # 画像の大きさはヘッダーだけで判定する（画素は復号しない）
+        try:
+            header = read_image_header(image_path)
+        except ImageTooLargeError as e:
+            return self._result(False, [{"code": "too_large", "message": str(e)}], [], {}, start_time)
+        except Exception:
+            return self._result(False, [{"code": "unreadable", "message": "画像を読み込めません"}],
+                                [], {}, start_time)
+
+        width, height = header["width"], header["height"]
+        metrics: Dict[str, Any] = {"width": width, "height": height}
+        if min(width, height) < self.min_edge:
+            reasons.append({
+                "code": "too_small",
+                "message": f"画像が小さすぎます（{width}×{height}、短辺 {self.min_edge}px 以上が必要）"
+            })
+            return self._result(False, reasons, warnings, metrics, start_time)
+
+        try:
+            gray, _ = decode_image(image_path, max_edge=ANALYSIS_EDGE, grayscale=True, header=header)
+        except ValueError:
+            return self._result(False, [{"code": "unreadable", "message": "画像を読み込めません"}],
+                                [], metrics, start_time)
+        metrics["analysis_size"] = [int(gray.shape[1]), int(gray.shape[0])]
+
+        # ぼけ: ラプラシアン（エッジの強さ）の分散
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        metrics["sharpness"] = sharpness
+        if sharpness < self.min_sharpness:
+            reasons.append({
+                "code": "too_blurry",
+                "message": f"画像がぼけています（鮮明度 {sharpness:.1f}、{self.min_sharpness:g} 以上が必要）"
+            })
+
+        # 露出: 輝度ヒストグラムの平均と白飛び・黒つぶれの割合
+        histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+        total = float(histogram.sum())
+        brightness = float(np.dot(histogram, np.arange(256)) / total)
+        dark_fraction = float(histogram[:CLIPPED_DARK].sum() / total)
+        bright_fraction = float(histogram[CLIPPED_BRIGHT + 1:].sum() / total)
+        metrics.update({
+            "brightness": brightness,
+            "dark_fraction": dark_fraction,
+            "bright_fraction": bright_fraction
+        })
+
+        if brightness < self.min_brightness:
+            reasons.append({"code": "too_dark", "message": f"画像が暗すぎます（平均輝度 {brightness:.0f}）"})
+        elif brightness > self.max_brightness:
+            reasons.append({"code": "too_bright", "message": f"画像が明るすぎます（平均輝度 {brightness:.0f}）"})
+        else:
+            if dark_fraction > CLIPPED_WARNING_FRACTION:
+                warnings.append({"code": "underexposed", "message": "黒つぶれしている部分が多い画像です"})
+            if bright_fraction > CLIPPED_WARNING_FRACTION:
+                warnings.append({"code": "overexposed", "message": "白飛びしている部分が多い画像です"})
+
+        # 縮小画像での顔検出（不合格が確定している場合は行わない）
+        if probe_mode != "off" and not reasons:
+            face_found = self._probe_face(image_path, header)
+            metrics["probe_face_detected"] = face_found
+            if not face_found:
+                finding = {"code": "no_face_in_probe", "message": "縮小画像で顔が検出されませんでした"}
+                (reasons if probe_mode == "reject" else warnings).append(finding)
+
+        return self._result(not reasons, reasons, warnings, metrics, start_time)
+
+    def _probe_face(self, image_path: str, header: Dict[str, Any]) -> bool:
+        """縮小したカラー画像で顔検出を行う"""
+        thumbnail, _ = decode_image(image_path, max_edge=PROBE_EDGE, header=header)
+        with self.model_registry.acquire("face_detection") as face_detection:
+            result = face_detection.process(cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB))
+        return bool(result.detections)
+
+    def _result(self, passed: bool, reasons: List[Dict[str, str]], warnings: List[Dict[str, str]],
+                metrics: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        return {
+            "passed": passed,
+            "reasons": reasons,
+            "warnings": warnings,
+            "metrics": metrics,
+            "elapsed_ms": (time.perf_counter() - start_time) * 1000
+        }
+
+    def get_quality_info(self) -> Dict[str, Any]:
+        """品質チェックの設定を取得"""
+        return {
+            "enabled": FACE_QUALITY_GATE,
+            "min_edge": self.min_edge,
+            "min_sharpness": self.min_sharpness,
+            "min_brightness": self.min_brightness,
+            "max_brightness": self.max_brightness,
+            "probe_mode": self.probe_mode,
+            "analysis_edge": ANALYSIS_EDGE,
+            "probe_edge": PROBE_EDGE
+        }
@@ -0,0 +1,184 @@
+import json
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+# 取り込み対象の画像形式（顔検出APIと同じ）
+INGEST_EXTENSIONS = ('jpg', 'jpeg', 'png', 'bmp')
+
+# 再開時に処理済みとして扱う状態（error は再試行する）
+# no_face は顔がないと判定できた場合だけで、画像の読み込み失敗・モデルの貸し出し待ちのタイムアウト等は error
+COMPLETED_STATUSES = {"ingested", "no_face", "low_quality"}
+
+# 取り込み元ごとに画像IDを決めるための名前空間
+_IMAGE_ID_NAMESPACE = uuid.UUID("6f1c4d2e-8a57-4b8e-9a1f-3c2d5e7f9b10")
+
+
+def image_id_for(relative_path: str) -> str:
+    """取り込み元での相対パスから画像IDを決める（再実行しても同じIDになる）"""
+    return str(uuid.uuid5(_IMAGE_ID_NAMESPACE, relative_path.replace(os.sep, "/")))
+
+
+def iter_image_sources(source: str) -> Iterator[Tuple[str, str]]:
+    """
+    ディレクトリ（再帰）または zip ファイル内の画像を列挙する
+
+    Returns:
+        (取り込み元, 相対パス) のイテレータ。取り込み元は source 自体
+    """
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = sorted(archive.namelist())
+        for name in names:
+            if not name.endswith("/") and name.rsplit(".", 1)[-1].lower() in INGEST_EXTENSIONS:
+                yield source, name
+        return
+
+    if not os.path.isdir(source):
+        raise ValueError(f"ディレクトリまたは zip ファイルを指定してください: {source}")
+
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.rsplit(".", 1)[-1].lower() in INGEST_EXTENSIONS:
+                yield source, os.path.relpath(os.path.join(root, filename), source)
+
+
+class IngestCheckpoint:
+    """
+    取り込みの進捗（1画像1行のJSON Lines）
+
+    特徴点データを保存した後に追記するため、中断後に再実行すると
+    処理済みの画像を読み飛ばして続きから取り込める。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 書き込み途中で中断された行は無視する
+                        continue
+                    if entry.get("status") in COMPLETED_STATUSES:
+                        self.completed.add(entry["path"])
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_completed(self, relative_path: str) -> bool:
+        return relative_path in self.completed
+
+    def record(self, entries: List[Dict[str, Any]]) -> None:
+        """処理結果を追記する"""
+        for entry in entries:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if entry["status"] in COMPLETED_STATUSES:
+                self.completed.add(entry["path"])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def init_worker() -> None:
+    """ワーカープロセスの初期化（1プロセス1スレッドで推論する）"""
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def _failure_status(service_result: Dict[str, Any]) -> str:
+    """顔検出・特徴点抽出の失敗結果を取り込みの状態にする（顔がない場合のみ no_face）"""
+    return "no_face" if service_result.get("no_face") else "error"
+
+
+def process_image(source: str, relative_path: str, uploads_dir: Optional[str] = None,
+                  feature_types: Optional[List[str]] = None,
+                  points_per_type: Optional[Dict[str, int]] = None,
+                  pipeline: Optional[str] = None) -> Dict[str, Any]:
+    """
+    1枚の画像に顔検出・正規化と自動特徴点抽出を行う（ワーカープロセスで実行）
+
+    Args:
+        source: 取り込み元（ディレクトリまたは zip ファイル）
+        relative_path: 取り込み元での相対パス
+        uploads_dir: 指定した場合は元画像と処理済み画像をこのディレクトリに保存する
+        pipeline: 顔の位置を求める処理の構成（accurate / fast、省略時は FACE_PIPELINE）
+
+    Returns:
+        {path, image_id, status, message, feature_points, processed_info}
+    """
+    from app.services.face_detection import FaceDetectionService
+    from app.services.auto_feature_extraction import AutoFeatureExtractionService
+    from app.services.image_quality import FACE_QUALITY_GATE, ImageQualityService
+
+    image_id = image_id_for(relative_path)
+    extension = relative_path.rsplit(".", 1)[-1].lower()
+    result: Dict[str, Any] = {"path": relative_path, "image_id": image_id}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            # zip 内の画像は一時ファイルに展開する
+            if zipfile.is_zipfile(source):
+                image_path = os.path.join(temp_dir, f"{image_id}.{extension}")
+                with zipfile.ZipFile(source) as archive, archive.open(relative_path) as member, \
+                        open(image_path, "wb") as output_file:
+                    shutil.copyfileobj(member, output_file)
+            else:
+                image_path = os.path.join(source, relative_path)
+
+            if uploads_dir:
+                shutil.copyfile(image_path, os.path.join(uploads_dir, f"{image_id}.{extension}"))
+
+            # 品質チェックに不合格の画像は推論を行わない
+            if FACE_QUALITY_GATE:
+                quality = ImageQualityService().assess(image_path)
+                if not quality["passed"]:
+                    return dict(result, status="low_quality",
+                                message="、".join(reason["message"] for reason in quality["reasons"]))
+
+            detection = FaceDetectionService().detect_and_process_face(
+                image_path, uploads_dir or temp_dir, pipeline
+            )
+            if not detection["success"]:
+                return dict(result, status=_failure_status(detection), message=detection["message"])
+
+            processed_path = os.path.join(uploads_dir or temp_dir, detection["processed_image_filename"])
+            extraction = AutoFeatureExtractionService().extract_auto_features(
+                image_path=processed_path,
+                feature_types=feature_types,
+                points_per_type=points_per_type,
+                mesh_landmarks=detection["mesh_landmarks"]
+            )
+            if not extraction["success"]:
+                return dict(result, status=_failure_status(extraction), message=extraction["message"])
+            if not extraction["feature_points"]:
+                # 信頼度の閾値を満たす特徴点がない（再試行しても同じ結果になる）
+                return dict(result, status="no_face", message=extraction["message"])
+
+            processed_info = None
+            if uploads_dir:
+                processed_info = {
+                    "processed_image_id": detection["processed_image_id"],
+                    "processed_image_filename": detection["processed_image_filename"],
+                    "processed_image_url": detection["processed_image_url"],
+                    "face_landmarks": detection["face_landmarks"],
+                    "mesh_landmarks": detection["mesh_landmarks"],
+                    "processing_info": detection["processing_info"]
+                }
+
+            return dict(
+                result,
+                status="ingested",
+                message=extraction["message"],
+                feature_points=extraction["feature_points"],
+                processed_info=processed_info
+            )
+
+        except Exception as e:
+            return dict(result, status="error", message=str(e))
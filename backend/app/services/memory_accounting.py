@@ -0,0 +1,232 @@
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# 起動時から割り当ての追跡（tracemalloc）を行う場合に記録するスタックの深さ（0 で起動時は追跡しない）
+DEFAULT_TRACEMALLOC_FRAMES = int(os.environ.get("FACE_TRACEMALLOC_FRAMES", "0"))
+# 使用量の大きいエントリを返す既定の件数
+DEFAULT_TOP_ENTRIES = 10
+
+# 割り当ての集計単位
+ALLOCATION_GROUPS = ("lineno", "filename", "traceback")
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """
+    オブジェクトとそこから参照されるオブジェクトのおおよそのバイト数を求める
+
+    numpy 配列はデータ領域を含める。同じオブジェクトは1回だけ数える
+    （ビューはデータ領域を持つ元の配列・バッファを数え、同じ元を共有するビューで重複しない）。
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray):
+        # ビューの場合 getsizeof はデータ領域を含まないため、データ領域を持つ元のオブジェクトを数える
+        return size + (deep_sizeof(obj.base, seen) if obj.base is not None else 0)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_sizeof(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), seen)
+    return size
+
+
+def measure_entries(entries: Iterable[Tuple[Any, Any]], top: int = DEFAULT_TOP_ENTRIES) -> Dict[str, Any]:
+    """
+    (キー, 値) の集まりのエントリ数・おおよそのバイト数・大きいエントリを求める
+
+    Returns:
+        {"entries", "bytes", "largest": [{"key", "bytes"}]}
+    """
+    sizes = [(key, deep_sizeof(value)) for key, value in entries]
+    sizes.sort(key=lambda item: item[1], reverse=True)
+    return {
+        "entries": len(sizes),
+        "bytes": sum(size for _, size in sizes),
+        "largest": [{"key": str(key), "bytes": size} for key, size in sizes[:max(0, top)]]
+    }
+
+
+def read_process_memory() -> Dict[str, Optional[int]]:
+    """プロセスの常駐メモリ（バイト）を取得する（Linux 以外では最大値のみ）"""
+    memory: Dict[str, Optional[int]] = {"rss_bytes": None, "peak_rss_bytes": None}
+    try:
+        with open("/proc/self/status", encoding="ascii") as status_file:
+            for line in status_file:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    # 「1234 kB」の形式
+                    memory["rss_bytes" if name == "VmRSS" else "peak_rss_bytes"] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    if memory["peak_rss_bytes"] is None:
+        try:
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # macOS はバイト、Linux はキロバイト
+            memory["peak_rss_bytes"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+        except (ImportError, OSError):
+            pass
+    return memory
+
+
+class MemoryAccountant:
+    """
+    ストア・キャッシュのメモリ使用量の集計と割り当ての追跡
+
+    各ストア・キャッシュは register で使用量を返す関数を登録する（有効なルーターのものだけが登録される）。
+    使用量はPythonオブジェクトを辿って求めたおおよその値で、MediaPipe・OpenCV のネイティブメモリは含まない。
+    割り当ての増加は tracemalloc のスナップショットを基準時点と比較して求める。
+    """
+
+    def __init__(self):
+        self._providers: Dict[str, Callable[[int], Dict[str, Any]]] = {}
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._baseline_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def register(self, name: str, provider: Callable[[int], Dict[str, Any]]) -> None:
+        """使用量（entries, bytes, largest 等）を返す関数を登録する（引数は大きいエントリの件数）"""
+        self._providers[name] = provider
+
+    def get_usage(self, top: int = DEFAULT_TOP_ENTRIES) -> Dict[str, Any]:
+        """登録されたストア・キャッシュごとのメモリ使用量を取得する"""
+        components = {}
+        for name, provider in list(self._providers.items()):
+            try:
+                components[name] = provider(top)
+            except Exception as e:
+                # 集計中に他のスレッドが更新した場合等
+                components[name] = {"error": str(e)}
+
+        accounted = sum(
+            usage["bytes"] for usage in components.values()
+            if usage.get("resident", True) and isinstance(usage.get("bytes"), int)
+        )
+        return {
+            "process": {
+                **read_process_memory(),
+                "uptime_seconds": time.time() - self.started_at,
+                "gc_objects": len(gc.get_objects()),
+                "gc_counts": list(gc.get_count())
+            },
+            "accounted_bytes": accounted,
+            "components": components,
+            "tracemalloc": self.get_tracing_info()
+        }
+
+    def start_tracing(self, frames: int = 1) -> bool:
+        """
+        割り当ての追跡を開始し、現時点を基準とする
+
+        Returns:
+            新たに開始したか（既に追跡中の場合は False）
+        """
+        with self._lock:
+            if tracemalloc.is_tracing():
+                return False
+            tracemalloc.start(max(1, frames))
+            self._take_baseline()
+            return True
+
+    def stop_tracing(self) -> bool:
+        """割り当ての追跡を終了する（追跡中のオーバーヘッドがなくなる）"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return False
+            tracemalloc.stop()
+            self._baseline = None
+            self._baseline_at = None
+            return True
+
+    def reset_baseline(self) -> None:
+        """現時点を割り当ての増加を比較する基準にする"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("割り当ての追跡が開始されていません")
+            self._take_baseline()
+
+    def _take_baseline(self) -> None:
+        self._baseline = self._snapshot()
+        self._baseline_at = time.time()
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        # tracemalloc 自身の割り当ては除く
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def get_allocations(self, top: int = 20, group_by: str = "lineno") -> Dict[str, Any]:
+        """
+        基準時点からの割り当ての増加が大きい箇所を取得する
+
+        Args:
+            group_by: lineno（行ごと）/ filename（ファイルごと）/ traceback（スタックごと）
+        """
+        if group_by not in ALLOCATION_GROUPS:
+            raise ValueError(f"未対応の集計単位です: {group_by}（{', '.join(ALLOCATION_GROUPS)}）")
+
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("割り当ての追跡が開始されていません")
+            snapshot = self._snapshot()
+            baseline = self._baseline
+            baseline_at = self._baseline_at
+
+        stats = snapshot.compare_to(baseline, group_by)
+        allocations: List[Dict[str, Any]] = []
+        for stat in stats[:max(0, top)]:
+            allocations.append({
+                "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                "size_bytes": stat.size,
+                "size_diff_bytes": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff
+            })
+
+        return {
+            **self.get_tracing_info(),
+            "baseline_at": baseline_at,
+            "group_by": group_by,
+            "total_diff_bytes": sum(stat.size_diff for stat in stats),
+            "allocations": allocations
+        }
+
+    def get_tracing_info(self) -> Dict[str, Any]:
+        """割り当ての追跡の状態を取得"""
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": True,
+            "frames": tracemalloc.get_traceback_limit(),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "baseline_at": self._baseline_at
+        }
+
+
+memory_accountant = MemoryAccountant()
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Any, Optional
+
+import numpy as np
+
+from app.services.memory_accounting import DEFAULT_TOP_ENTRIES, measure_entries
+
+# エンドポイントごとに保持する直近のレイテンシ数
+DEFAULT_WINDOW_SIZE = 1000
+
+
+class LatencyRecorder:
+    """エンドポイントごとの直近のレイテンシを記録し、パーセンタイルを求める"""
+
+    def __init__(self, window_size: int = DEFAULT_WINDOW_SIZE):
+        self.window_size = window_size
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def record(self, endpoint: str, duration: float, status_code: int = 200) -> None:
+        """1リクエスト分のレイテンシ（秒）を記録する"""
+        with self._lock:
+            if endpoint not in self._samples:
+                self._samples[endpoint] = deque(maxlen=self.window_size)
+                self._counts[endpoint] = 0
+                self._errors[endpoint] = 0
+            self._samples[endpoint].append(duration)
+            self._counts[endpoint] += 1
+            if status_code >= 500:
+                self._errors[endpoint] += 1
+
+    def get_percentiles(self, endpoint: Optional[str] = None) -> Dict[str, Any]:
+        """
+        直近のレイテンシのパーセンタイルを取得する
+
+        Returns:
+            エンドポイントごとの {count, errors, p50, p95, p99, max}（ミリ秒）
+        """
+        with self._lock:
+            endpoints = [endpoint] if endpoint else list(self._samples.keys())
+            snapshot = {
+                name: (np.array(self._samples[name]), self._counts[name], self._errors[name])
+                for name in endpoints if name in self._samples
+            }
+
+        result = {}
+        for name, (samples, count, errors) in snapshot.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+            result[name] = {
+                "count": count,
+                "errors": errors,
+                "window": len(samples),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(samples.max() * 1000)
+            }
+        return result
+
+    def get_memory_usage(self, top: int = DEFAULT_TOP_ENTRIES) -> Dict[str, Any]:
+        """直近のレイテンシのおおよそのメモリ使用量を取得する"""
+        with self._lock:
+            samples = [(name, list(values)) for name, values in self._samples.items()]
+        return measure_entries(samples, top)
+
+
+latency_recorder = LatencyRecorder()
@@ -0,0 +1,377 @@
+import importlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# FaceMesh の共通設定（顔検出サービス・自動特徴点抽出サービスで共有）
+FACE_MESH_CONFIG = {
+    "static_image_mode": True,
+    "max_num_faces": 1,
+    "refine_landmarks": True,
+    "min_detection_confidence": 0.5,
+    "min_tracking_confidence": 0.5
+}
+
+# 動画用の FaceMesh の設定（前フレームのランドマークから顔を追跡し、見失った場合だけ顔検出を行う）
+FACE_MESH_TRACKING_CONFIG = dict(FACE_MESH_CONFIG, static_image_mode=False)
+
+# FaceDetection の設定
+FACE_DETECTION_CONFIG = {
+    "model_selection": 1,  # 0: 近距離用, 1: 遠距離用
+    "min_detection_confidence": 0.5
+}
+
+# 事前読み込みの対象となる重いモジュール
+HEAVY_MODULES = ("numpy", "cv2", "mediapipe")
+
+# モデルごとのインスタンス数（FACE_MODEL_POOL_SIZE で変更可能）
+DEFAULT_POOL_SIZE = int(os.environ.get("FACE_MODEL_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+
+# 動画用の FaceMesh のインスタンス数（1つの動画の処理中は貸し出したままになる）
+DEFAULT_TRACKING_POOL_SIZE = int(os.environ.get("FACE_VIDEO_POOL_SIZE", "1"))
+
+# インスタンスの貸し出し待ちのタイムアウト（秒）
+DEFAULT_CHECKOUT_TIMEOUT = float(os.environ.get("FACE_MODEL_CHECKOUT_TIMEOUT", "30"))
+
+
+def _create_face_mesh():
+    import mediapipe as mp
+    return mp.solutions.face_mesh.FaceMesh(**FACE_MESH_CONFIG)
+
+
+def _create_face_mesh_tracking():
+    import mediapipe as mp
+    return mp.solutions.face_mesh.FaceMesh(**FACE_MESH_TRACKING_CONFIG)
+
+
+def _create_face_detection():
+    import mediapipe as mp
+    return mp.solutions.face_detection.FaceDetection(**FACE_DETECTION_CONFIG)
+
+
+def _check_mediapipe_model(model) -> None:
+    """小さな空画像で推論できるかを確認する（失敗時は例外）"""
+    import numpy as np
+    model.process(np.zeros((64, 64, 3), dtype=np.uint8))
+
+
+class ModelCheckoutTimeout(Exception):
+    """モデルインスタンスの貸し出し待ちがタイムアウトした"""
+
+
+class PooledModel:
+    """プール内のモデルインスタンスと利用統計"""
+
+    def __init__(self, instance_id: int, model: Any, load_time: float):
+        self.instance_id = instance_id
+        self.model = model
+        self.load_time = load_time
+        self.uses = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.last_used: Optional[float] = None
+        self.healthy = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "instance_id": self.instance_id,
+            "uses": self.uses,
+            "errors": self.errors,
+            "busy_time": self.busy_time,
+            "average_time": self.busy_time / self.uses if self.uses else 0.0,
+            "last_used": self.last_used,
+            "load_time": self.load_time,
+            "healthy": self.healthy
+        }
+
+
+class ModelPool:
+    """
+    同じ設定のモデルインスタンスを最大 size 個保持するプール
+
+    MediaPipe のグラフは同時に process() を呼び出せないため、
+    インスタンスは貸し出し中のスレッドだけが使用する。
+    インスタンスは必要になった時点で size 個まで生成される。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], size: int = DEFAULT_POOL_SIZE,
+                 health_check: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.factory = factory
+        self.size = max(1, size)
+        self.health_check = health_check
+        self._instances: List[PooledModel] = []
+        self._idle: List[PooledModel] = []
+        self._creating = 0
+        self._next_id = 0
+        self._waiting = 0
+        self._replaced = 0
+        self._condition = threading.Condition()
+
+    def _create_instance(self) -> PooledModel:
+        start_time = time.time()
+        model = self.factory()
+        self._next_id += 1
+        return PooledModel(self._next_id, model, time.time() - start_time)
+
+    def reset(self) -> None:
+        """保持しているインスタンスを破棄する（fork 後の子プロセス用）"""
+        self._condition = threading.Condition()
+        self._instances = []
+        self._idle = []
+        self._creating = 0
+        self._waiting = 0
+
+    def checkout(self, timeout: Optional[float] = DEFAULT_CHECKOUT_TIMEOUT) -> PooledModel:
+        """インスタンスを借りる（空きが無い場合は返却を待つ）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+
+                if len(self._instances) + self._creating < self.size:
+                    self._creating += 1
+                    break
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise ModelCheckoutTimeout(
+                        f"{self.name} の空きインスタンスを {timeout} 秒待ちましたが取得できませんでした"
+                    )
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        # 生成はロックの外で行い、他のスレッドの返却をブロックしない
+        try:
+            pooled = self._create_instance()
+        except Exception:
+            with self._condition:
+                self._creating -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._creating -= 1
+            self._instances.append(pooled)
+        return pooled
+
+    def checkin(self, pooled: PooledModel, failed: bool = False) -> None:
+        """インスタンスを返却する（失敗時は健全性を確認し、異常なら破棄する）"""
+        if failed and not self._is_healthy(pooled):
+            pooled.healthy = False
+            self._discard(pooled)
+            return
+
+        with self._condition:
+            if pooled in self._instances:
+                self._idle.append(pooled)
+            self._condition.notify()
+
+    def _discard(self, pooled: PooledModel) -> None:
+        """異常なインスタンスをプールから外して解放する（空いた枠で新たに生成される）"""
+        with self._condition:
+            if pooled in self._instances:
+                self._instances.remove(pooled)
+            self._replaced += 1
+            self._condition.notify()
+
+        # MediaPipe のグラフはネイティブのスレッド・メモリを持つため明示的に閉じる
+        close = getattr(pooled.model, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def _is_healthy(self, pooled: PooledModel) -> bool:
+        if self.health_check is None:
+            return True
+        try:
+            self.health_check(pooled.model)
+            return True
+        except Exception:
+            return False
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = DEFAULT_CHECKOUT_TIMEOUT) -> Iterator[Any]:
+        """with 文でインスタンスを借りる"""
+        pooled = self.checkout(timeout)
+        start_time = time.time()
+        failed = False
+        try:
+            yield pooled.model
+        except Exception:
+            failed = True
+            pooled.errors += 1
+            raise
+        finally:
+            pooled.uses += 1
+            pooled.busy_time += time.time() - start_time
+            pooled.last_used = time.time()
+            self.checkin(pooled, failed)
+
+    def fill(self) -> None:
+        """インスタンスを size 個まで生成する"""
+        checked_out = []
+        try:
+            while len(self._instances) + self._creating < self.size:
+                checked_out.append(self.checkout(timeout=None))
+        finally:
+            for pooled in checked_out:
+                self.checkin(pooled)
+
+    def check_health(self) -> Dict[str, Any]:
+        """待機中のインスタンスの健全性を確認し、異常なものを破棄する"""
+        with self._condition:
+            targets = list(self._idle)
+            self._idle = []
+
+        results = {}
+        for pooled in targets:
+            healthy = self._is_healthy(pooled)
+            pooled.healthy = healthy
+            results[pooled.instance_id] = healthy
+            if healthy:
+                with self._condition:
+                    self._idle.append(pooled)
+                    self._condition.notify()
+            else:
+                self._discard(pooled)
+
+        return {
+            "checked": len(results),
+            "healthy": sum(1 for healthy in results.values() if healthy),
+            "instances": results
+        }
+
+    def get_pool_info(self) -> Dict[str, Any]:
+        """プールの状態を取得"""
+        with self._condition:
+            return {
+                "size": self.size,
+                "instances": len(self._instances),
+                "idle": len(self._idle),
+                "in_use": len(self._instances) - len(self._idle),
+                "waiting": self._waiting,
+                "replaced": self._replaced,
+                "instance_stats": [pooled.get_stats() for pooled in self._instances]
+            }
+
+
+class ModelRegistry:
+    """
+    MediaPipe モデルのプールを管理するレジストリ
+
+    モデルは初回使用時に生成され、同じ名前のモデルは全サービスで共有される。
+    MediaPipe のグラフはスレッドを持つため fork を跨いで使えない。
+    fork 後のプロセスで取得された場合は、引き継いだインスタンスを破棄して作り直す。
+    """
+
+    def __init__(self):
+        self._pools: Dict[str, ModelPool] = {}
+        self._owner_pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], size: int = DEFAULT_POOL_SIZE,
+                 health_check: Optional[Callable[[Any], None]] = None) -> None:
+        """モデルの生成関数を登録する"""
+        self._pools[name] = ModelPool(name, factory, size, health_check)
+
+    def _check_process(self) -> None:
+        """fork 後の子プロセスでは親から引き継いだモデルを使用しない"""
+        if self._owner_pid != os.getpid():
+            with self._lock:
+                if self._owner_pid != os.getpid():
+                    for pool in self._pools.values():
+                        pool.reset()
+                    self._owner_pid = os.getpid()
+
+    def pool(self, name: str) -> ModelPool:
+        """モデルのプールを取得する"""
+        self._check_process()
+        if name not in self._pools:
+            raise KeyError(f"未登録のモデルです: {name}")
+        return self._pools[name]
+
+    def acquire(self, name: str, timeout: Optional[float] = DEFAULT_CHECKOUT_TIMEOUT):
+        """with 文でモデルを借りる"""
+        return self.pool(name).acquire(timeout)
+
+    def is_loaded(self, name: str) -> bool:
+        """モデルが1つ以上生成済みかどうか"""
+        return self._owner_pid == os.getpid() and self._pools[name].get_pool_info()["instances"] > 0
+
+    def preload_modules(self) -> Dict[str, float]:
+        """
+        重いモジュールを読み込む
+
+        fork 前に呼び出すと、読み込んだモジュールのメモリをワーカー間で
+        コピーオンライトで共有できる（モデルのグラフは各ワーカーで生成される）。
+
+        Returns:
+            モジュールごとの読み込み時間（秒）
+        """
+        timings = {}
+        for module_name in HEAVY_MODULES:
+            start_time = time.time()
+            importlib.import_module(module_name)
+            timings[module_name] = time.time() - start_time
+        return timings
+
+    def preload(self, names: Optional[List[str]] = None) -> Dict[str, float]:
+        """
+        モデルのプールを上限数まで事前に生成する
+
+        Args:
+            names: 生成するモデル名（省略時は登録済みの全モデル）
+
+        Returns:
+            モデルごとの生成時間（秒）
+        """
+        timings = {}
+        for name in names or list(self._pools.keys()):
+            start_time = time.time()
+            self.pool(name).fill()
+            timings[name] = time.time() - start_time
+        return timings
+
+    def check_health(self) -> Dict[str, Any]:
+        """全プールの健全性を確認する"""
+        return {name: self.pool(name).check_health() for name in self._pools}
+
+    def get_registry_info(self) -> Dict[str, Any]:
+        """レジストリの状態を取得"""
+        self._check_process()
+        return {
+            "registered_models": list(self._pools.keys()),
+            "loaded_models": [name for name in self._pools if self.is_loaded(name)],
+            "pools": {name: pool.get_pool_info() for name, pool in self._pools.items()},
+            "face_mesh_config": FACE_MESH_CONFIG,
+            "face_mesh_tracking_config": FACE_MESH_TRACKING_CONFIG,
+            "face_detection_config": FACE_DETECTION_CONFIG
+        }
+
+    def get_memory_usage(self, top: int = 0) -> Dict[str, Any]:
+        """
+        生成済みのモデル数を取得する
+
+        MediaPipe のグラフはネイティブメモリに確保されるためバイト数は求められない
+        （プロセスの常駐メモリの増加で確認する）。
+        """
+        instances = {name: pool.get_pool_info()["instances"] for name, pool in self._pools.items()}
+        return {"entries": sum(instances.values()), "bytes": None, "largest": [], "instances": instances}
+
+
+model_registry = ModelRegistry()
+model_registry.register("face_mesh", _create_face_mesh, health_check=_check_mediapipe_model)
+model_registry.register("face_detection", _create_face_detection, health_check=_check_mediapipe_model)
+# 追跡の状態を持つため、借りた側が動画ごとに reset() してから使用する
+model_registry.register("face_mesh_tracking", _create_face_mesh_tracking, size=DEFAULT_TRACKING_POOL_SIZE,
+                        health_check=_check_mediapipe_model)
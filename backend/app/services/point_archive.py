@@ -0,0 +1,154 @@
+import io
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from app.services.point_statistics import FEATURE_TYPES, point_coordinates, point_type_codes
+from app.utils.points import point_field
+
+# アーカイブ形式のバージョン（列の追加・変更時に更新する）
+ARCHIVE_FORMAT_VERSION = 1
+
+ARCHIVE_MEDIA_TYPE = "application/x-npz"
+
+
+def pack_point_sets(point_sets: Iterable[Tuple[str, List[Any]]]) -> Dict[str, np.ndarray]:
+    """
+    特徴点集合の一覧を列指向の配列にまとめる
+
+    全画像の特徴点を1本の配列に連結し、offsets[i]:offsets[i + 1] が
+    image_ids[i] の特徴点の範囲となる。
+
+    Returns:
+        列名 -> 配列 の辞書
+    """
+    image_ids: List[str] = []
+    counts: List[int] = []
+    coords, codes, labels, confidences, landmark_indices = [], [], [], [], []
+
+    for image_id, points in point_sets:
+        image_ids.append(image_id)
+        counts.append(len(points))
+        coords.append(point_coordinates(points))
+        codes.append(point_type_codes(points))
+        labels.extend(str(point_field(point, 'label', '')) for point in points)
+        confidences.extend(
+            np.nan if point_field(point, 'confidence') is None else point_field(point, 'confidence')
+            for point in points
+        )
+        landmark_indices.extend(
+            -1 if point_field(point, 'landmark_index') is None else point_field(point, 'landmark_index')
+            for point in points
+        )
+
+    all_coords = np.concatenate(coords) if coords else np.zeros((0, 2))
+
+    return {
+        "format_version": np.array(ARCHIVE_FORMAT_VERSION, dtype=np.int32),
+        "feature_types": np.array(FEATURE_TYPES),
+        "image_ids": np.array(image_ids, dtype=str),
+        "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "x": all_coords[:, 0].astype(np.float64),
+        "y": all_coords[:, 1].astype(np.float64),
+        "type_codes": (np.concatenate(codes) if codes else np.zeros(0)).astype(np.uint8),
+        "labels": np.array(labels, dtype=str),
+        "confidence": np.array(confidences, dtype=np.float32),
+        "landmark_index": np.array(landmark_indices, dtype=np.int32)
+    }
+
+
+def validate_arrays(arrays: Dict[str, np.ndarray], feature_types: List[str]) -> None:
+    """
+    列指向の配列が特徴点データとして保存できる値かを確認する
+
+    Raises:
+        ValueError: 列の長さ・範囲・値が不正な場合
+    """
+    unknown_types = set(feature_types) - set(FEATURE_TYPES)
+    if unknown_types:
+        raise ValueError(f"未対応の特徴点タイプです: {sorted(unknown_types)}")
+
+    point_count = len(arrays["x"])
+    for name in ("y", "type_codes", "labels", "confidence", "landmark_index"):
+        if len(arrays[name]) != point_count:
+            raise ValueError(f"{name} の長さが特徴点数と一致しません")
+
+    offsets = arrays["offsets"]
+    if (len(offsets) != len(arrays["image_ids"]) + 1 or int(offsets[0]) != 0
+            or int(offsets[-1]) != point_count or np.any(np.diff(offsets) < 0)):
+        raise ValueError("offsets が不正です")
+
+    type_codes = arrays["type_codes"]
+    if type_codes.dtype.kind not in "ui" or np.any(type_codes < 0) or np.any(type_codes >= len(feature_types)):
+        raise ValueError("type_codes に範囲外の値が含まれています")
+
+    if not (np.all(np.isfinite(arrays["x"])) and np.all(np.isfinite(arrays["y"]))):
+        raise ValueError("座標に有限でない値が含まれています")
+
+    if arrays["labels"].dtype.kind != "U" or arrays["image_ids"].dtype.kind != "U":
+        raise ValueError("labels と image_ids は文字列の配列である必要があります")
+
+
+def unpack_point_sets(arrays: Dict[str, np.ndarray]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """列指向の配列から (image_id, 特徴点リスト) を順に取り出す"""
+    format_version = int(arrays["format_version"])
+    if format_version > ARCHIVE_FORMAT_VERSION:
+        raise ValueError(f"未対応のアーカイブ形式です: version {format_version}")
+
+    feature_types = [str(feature_type) for feature_type in arrays["feature_types"]]
+    offsets = arrays["offsets"]
+    validate_arrays(arrays, feature_types)
+
+    x, y = arrays["x"].tolist(), arrays["y"].tolist()
+    type_names = [feature_types[code] for code in arrays["type_codes"].tolist()]
+    labels = arrays["labels"].tolist()
+    confidences = arrays["confidence"].tolist()
+    landmark_indices = arrays["landmark_index"].tolist()
+
+    for index, image_id in enumerate(arrays["image_ids"].tolist()):
+        start, end = int(offsets[index]), int(offsets[index + 1])
+        yield image_id, [
+            {
+                "x": x[i],
+                "y": y[i],
+                "type": type_names[i],
+                "label": labels[i],
+                "confidence": None if np.isnan(confidences[i]) else confidences[i],
+                "landmark_index": None if landmark_indices[i] < 0 else landmark_indices[i]
+            }
+            for i in range(start, end)
+        ]
+
+
+def write_archive(fileobj: BinaryIO, point_sets: Iterable[Tuple[str, List[Any]]],
+                  compress: bool = False) -> int:
+    """
+    特徴点集合を .npz 形式で書き出す
+
+    列は全画像を連結した配列のため、全画像分の配列をメモリ上に作成してから書き出す。
+
+    Returns:
+        書き出した画像数
+    """
+    arrays = pack_point_sets(point_sets)
+    if compress:
+        np.savez_compressed(fileobj, **arrays)
+    else:
+        np.savez(fileobj, **arrays)
+    return len(arrays["image_ids"])
+
+
+def read_archive(fileobj: BinaryIO) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    .npz 形式のアーカイブから (image_id, 特徴点リスト) を順に読み出す
+
+    全画像分の配列を一度に読み込み、特徴点リストへの変換だけを画像ごとに行う。
+    """
+    if not hasattr(fileobj, "seek"):
+        # zip 形式のため、シークできない入力はメモリに読み込む
+        fileobj = io.BytesIO(fileobj.read())
+
+    with np.load(fileobj, allow_pickle=False) as archive:
+        arrays = {name: archive[name] for name in archive.files}
+
+    return unpack_point_sets(arrays)
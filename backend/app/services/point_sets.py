@@ -0,0 +1,77 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.utils.points import point_field
+
+
+def _as_dict(point: Any) -> Dict[str, Any]:
+    return point.model_dump() if hasattr(point, 'model_dump') else dict(point)
+
+
+def point_key(point: Any) -> str:
+    """
+    特徴点集合内で特徴点を識別するキー
+
+    自動抽出した特徴点はタイプと MediaPipe のランドマーク番号、手動の特徴点はラベルで識別する
+    （同じランドマークが複数のタイプに含まれるため、番号だけでは区別できない）。
+    """
+    landmark_index = point_field(point, 'landmark_index')
+    if landmark_index is not None:
+        return f"landmark:{point_field(point, 'type')}:{landmark_index}"
+    return f"label:{point_field(point, 'label')}"
+
+
+def upsert_points(existing: List[Any],
+                  updates: Iterable[Tuple[Optional[str], Any]]) -> Tuple[List[Dict[str, Any]], int, int]:
+    """
+    特徴点を追加・更新する
+
+    同じキーの特徴点がある場合はその位置で置き換え、ない場合は末尾に追加する
+    （比較は特徴点の並び順で対応を取るため、既存の特徴点の順序は変えない）。
+
+    Args:
+        existing: 現在の特徴点リスト
+        updates: (置き換える特徴点のキー, 新しい特徴点) のリスト。
+            キーが None の場合は新しい特徴点から求めたキーを使用する
+
+    Returns:
+        (更新後の特徴点リスト, 置き換えた数, 追加した数)
+    """
+    points = [_as_dict(point) for point in existing]
+    # 指定されたキーは更新前の特徴点集合で引く（ラベルの付け直しで他の特徴点のキーと入れ替わっても対応が崩れない）
+    original_positions: Dict[str, int] = {}
+    for index, point in enumerate(points):
+        original_positions.setdefault(point_key(point), index)
+    positions = dict(original_positions)
+
+    replaced = 0
+    added = 0
+    for key, point in updates:
+        point = _as_dict(point)
+        index = original_positions.get(key) if key is not None else None
+        if index is None:
+            index = positions.get(point_key(point))
+
+        if index is None:
+            positions[point_key(point)] = len(points)
+            points.append(point)
+            added += 1
+        else:
+            if positions.get(point_key(points[index])) == index:
+                del positions[point_key(points[index])]
+            positions[point_key(point)] = index
+            points[index] = point
+            replaced += 1
+
+    return points, replaced, added
+
+
+def delete_points(existing: List[Any], keys: Iterable[str]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    指定したキーの特徴点を削除する
+
+    Returns:
+        (更新後の特徴点リスト, 削除した数)
+    """
+    keys = set(keys)
+    points = [_as_dict(point) for point in existing if point_key(point) not in keys]
+    return points, len(existing) - len(points)
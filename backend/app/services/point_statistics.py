@@ -0,0 +1,300 @@
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+from app.services.memory_accounting import DEFAULT_TOP_ENTRIES, measure_entries
+
+# 特徴点タイプ（統計量の集計順）
+FEATURE_TYPES = ('rightEye', 'leftEye', 'nose', 'mouth', 'face_contour', 'other')
+_TYPE_CODES = {feature_type: code for code, feature_type in enumerate(FEATURE_TYPES)}
+_OTHER_CODE = _TYPE_CODES['other']
+
+
+def point_coordinates(points: Iterable[Any]) -> np.ndarray:
+    """特徴点リストを (N, 2) の座標配列に変換する"""
+    coords = []
+    for point in points:
+        # 辞書形式とオブジェクト形式の両方に対応
+        x = point.x if hasattr(point, 'x') else point.get('x', 0)
+        y = point.y if hasattr(point, 'y') else point.get('y', 0)
+        coords.append((x, y))
+
+    if not coords:
+        return np.zeros((0, 2), dtype=np.float64)
+
+    return np.asarray(coords, dtype=np.float64)
+
+
+def point_type_codes(points: Iterable[Any]) -> np.ndarray:
+    """特徴点リストをタイプコード配列（FEATURE_TYPES のインデックス）に変換する"""
+    codes = [
+        _TYPE_CODES.get(point.type if hasattr(point, 'type') else point.get('type', 'other'), _OTHER_CODE)
+        for point in points
+    ]
+    return np.asarray(codes, dtype=np.intp)
+
+
+def _grouped_sum(codes: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """タイプコードごとに値を合計する"""
+    # 空の場合 bincount は整数型を返すため、差分更新（+=）で型が変わらないよう float64 にそろえる
+    return np.bincount(codes, weights=values, minlength=len(FEATURE_TYPES)).astype(np.float64, copy=False)
+
+
+def grouped_pair_statistics(reference_points: List[Any],
+                            comparison_points: List[Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    2つの特徴点集合から特徴点タイプ別の十分統計量を計算する
+
+    タイプは基準画像側の特徴点のものを使用する。
+
+    Returns:
+        (Σx², Σx·y, Σy²) それぞれ FEATURE_TYPES 順の配列
+    """
+    reference_coords = point_coordinates(reference_points)
+    comparison_coords = point_coordinates(comparison_points)
+    codes = point_type_codes(reference_points)
+
+    return (
+        _grouped_sum(codes, np.sum(reference_coords * reference_coords, axis=1)),
+        _grouped_sum(codes, np.sum(reference_coords * comparison_coords, axis=1)),
+        _grouped_sum(codes, np.sum(comparison_coords * comparison_coords, axis=1)),
+    )
+
+
+class PointSetStatistics:
+    """特徴点集合の十分統計量（タイプ別 Σx²）と座標配列"""
+
+    def __init__(self, coords: np.ndarray, type_codes: np.ndarray, version: Optional[int] = None):
+        self.coords = coords
+        self.type_codes = type_codes
+        self.version = version
+        self.sum_sq_by_type = _grouped_sum(type_codes, np.sum(coords * coords, axis=1))
+        self.count_by_type = np.bincount(type_codes, minlength=len(FEATURE_TYPES))
+
+    @property
+    def count(self) -> int:
+        return len(self.coords)
+
+    @property
+    def sum_sq(self) -> float:
+        return float(np.sum(self.sum_sq_by_type))
+
+
+class PairStatistics:
+    """
+    2つの特徴点集合 a, b 間のタイプ別統計量
+
+    どちらを基準画像としても引けるよう、a のタイプ別と b のタイプ別の両方で集計する。
+    対象は共通する先頭 min(len(a), len(b)) 点。
+    """
+
+    def __init__(self, set_a: PointSetStatistics, set_b: PointSetStatistics):
+        n = min(set_a.count, set_b.count)
+        coords_a, coords_b = set_a.coords[:n], set_b.coords[:n]
+        codes_a, codes_b = set_a.type_codes[:n], set_b.type_codes[:n]
+
+        cross = np.sum(coords_a * coords_b, axis=1)
+        self.cross_by_a = _grouped_sum(codes_a, cross)
+        self.cross_by_b = _grouped_sum(codes_b, cross)
+        self.sq_b_by_a = _grouped_sum(codes_a, np.sum(coords_b * coords_b, axis=1))
+        self.sq_a_by_b = _grouped_sum(codes_b, np.sum(coords_a * coords_a, axis=1))
+
+
+class PointStatisticsCache:
+    """
+    比較用の十分統計量キャッシュ
+
+    D(λ) = Σ(xi - λ×yi)² = Σx² - 2λΣx·y + λ²Σy² であるため、
+    各特徴点集合の Σx² と画像ペアごとの Σx·y を保持しておけば
+    距離とλは特徴点数に依存せず求められる。
+    特徴点の追加・移動・削除時は変更された点の寄与だけを差し替える。
+    統計量は特徴点タイプ別に保持し、合計が全体の統計量になる。
+    """
+
+    def __init__(self):
+        self._sets: Dict[str, PointSetStatistics] = {}
+        # (image_id_a, image_id_b) -> ペア統計量（image_id_a < image_id_b）
+        self._pairs: Dict[Tuple[str, str], PairStatistics] = {}
+        # image_id -> ペアを組んでいる相手のimage_id
+        self._partners: Dict[str, set] = {}
+
+    @staticmethod
+    def _pair_key(image_id_a: str, image_id_b: str) -> Tuple[str, str]:
+        return (image_id_a, image_id_b) if image_id_a <= image_id_b else (image_id_b, image_id_a)
+
+    def update(self, image_id: str, points: List[Any], version: Optional[int] = None) -> np.ndarray:
+        """
+        特徴点集合を更新し、変更のあった点の寄与だけ統計量を差し替える
+
+        Args:
+            image_id: 画像ID
+            points: 更新後の特徴点リスト
+            version: 保存先での特徴点データのバージョン
+
+        Returns:
+            変更された点のインデックス配列
+        """
+        new_coords = point_coordinates(points)
+        new_codes = point_type_codes(points)
+        current = self._sets.get(image_id)
+
+        if current is None:
+            self._sets[image_id] = PointSetStatistics(new_coords, new_codes, version)
+            return np.arange(len(new_coords))
+
+        try:
+            changed = self._apply_changes(image_id, current, new_coords, new_codes)
+        except Exception:
+            # 途中まで差し替えた統計量は不整合なため破棄し、次回の ensure() で全点から作り直す
+            self.remove(image_id)
+            raise
+        # バージョンは差し替えが完了してから進める（失敗時に古い統計量が最新扱いされないようにする）
+        current.version = version
+        return changed
+
+    def _apply_changes(self, image_id: str, current: PointSetStatistics,
+                       new_coords: np.ndarray, new_codes: np.ndarray) -> np.ndarray:
+        """変更のあった点の旧い寄与を引き、新しい寄与を足す"""
+        old_coords, old_codes = current.coords, current.type_codes
+        common = min(len(old_coords), len(new_coords))
+
+        # 位置・タイプが変わった点と、追加・削除された末尾の点を変更点とする
+        moved = np.nonzero(
+            np.any(old_coords[:common] != new_coords[:common], axis=1)
+            | (old_codes[:common] != new_codes[:common])
+        )[0]
+        tail = np.arange(common, max(len(old_coords), len(new_coords)))
+        changed = np.concatenate([moved, tail]).astype(np.intp)
+
+        if len(changed) == 0:
+            return changed
+
+        old_idx = changed[changed < len(old_coords)]
+        new_idx = changed[changed < len(new_coords)]
+
+        current.sum_sq_by_type += (
+            _grouped_sum(new_codes[new_idx], np.sum(new_coords[new_idx] ** 2, axis=1))
+            - _grouped_sum(old_codes[old_idx], np.sum(old_coords[old_idx] ** 2, axis=1))
+        )
+        current.count_by_type += (
+            np.bincount(new_codes[new_idx], minlength=len(FEATURE_TYPES))
+            - np.bincount(old_codes[old_idx], minlength=len(FEATURE_TYPES))
+        )
+
+        for partner_id in self._partners.get(image_id, ()):
+            partner = self._sets[partner_id]
+            key = self._pair_key(image_id, partner_id)
+            self._update_pair(
+                self._pairs[key], image_id == key[0], partner,
+                old_coords, old_codes, old_idx[old_idx < partner.count],
+                new_coords, new_codes, new_idx[new_idx < partner.count]
+            )
+
+        current.coords = new_coords
+        current.type_codes = new_codes
+        return changed
+
+    @staticmethod
+    def _update_pair(pair: PairStatistics, is_a: bool, partner: PointSetStatistics,
+                     old_coords: np.ndarray, old_codes: np.ndarray, removed: np.ndarray,
+                     new_coords: np.ndarray, new_codes: np.ndarray, added: np.ndarray) -> None:
+        """ペア統計量から変更点の旧い寄与を引き、新しい寄与を足す"""
+        def contributions(coords, codes, idx):
+            own_codes = codes[idx]
+            partner_codes = partner.type_codes[idx]
+            partner_coords = partner.coords[idx]
+            cross = np.sum(coords[idx] * partner_coords, axis=1)
+            own_sq = np.sum(coords[idx] ** 2, axis=1)
+            return (
+                _grouped_sum(own_codes, cross),
+                _grouped_sum(partner_codes, cross),
+                _grouped_sum(own_codes, np.sum(partner_coords ** 2, axis=1)),
+                _grouped_sum(partner_codes, own_sq),
+            )
+
+        old = contributions(old_coords, old_codes, removed)
+        new = contributions(new_coords, new_codes, added)
+        cross_own, cross_partner, partner_sq_by_own, own_sq_by_partner = (
+            n - o for n, o in zip(new, old)
+        )
+
+        if is_a:
+            pair.cross_by_a += cross_own
+            pair.cross_by_b += cross_partner
+            pair.sq_b_by_a += partner_sq_by_own
+            pair.sq_a_by_b += own_sq_by_partner
+        else:
+            pair.cross_by_b += cross_own
+            pair.cross_by_a += cross_partner
+            pair.sq_a_by_b += partner_sq_by_own
+            pair.sq_b_by_a += own_sq_by_partner
+
+    def ensure(self, image_id: str, points: List[Any], version: Optional[int] = None) -> PointSetStatistics:
+        """
+        キャッシュに無い場合、またはバージョンが異なる場合のみ統計量を更新して返す
+
+        他のワーカープロセスが特徴点を更新した場合はバージョンが進んでいるため、
+        差分更新で追従する。
+        """
+        current = self._sets.get(image_id)
+        if current is None or (version is not None and current.version != version):
+            self.update(image_id, points, version)
+        return self._sets[image_id]
+
+    def get(self, image_id: str) -> Optional[PointSetStatistics]:
+        """キャッシュ済みの統計量を取得する"""
+        return self._sets.get(image_id)
+
+    def remove(self, image_id: str) -> None:
+        """特徴点集合とそれに関わるペア統計量を破棄する"""
+        self._sets.pop(image_id, None)
+        for partner_id in self._partners.pop(image_id, set()):
+            self._pairs.pop(self._pair_key(image_id, partner_id), None)
+            self._partners.get(partner_id, set()).discard(image_id)
+
+    def _pair(self, image_id_a: str, image_id_b: str) -> PairStatistics:
+        """ペア統計量を取得する（初回のみ全点から計算）"""
+        key = self._pair_key(image_id_a, image_id_b)
+        if key not in self._pairs:
+            self._pairs[key] = PairStatistics(self._sets[key[0]], self._sets[key[1]])
+            self._partners.setdefault(image_id_a, set()).add(image_id_b)
+            self._partners.setdefault(image_id_b, set()).add(image_id_a)
+        return self._pairs[key]
+
+    def pair_statistics(self, reference_id: str,
+                        comparison_id: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        比較に必要な十分統計量を取得する
+
+        タイプは基準画像側の特徴点のものを使用する。
+
+        Returns:
+            (Σx², Σx·y, Σy²) それぞれ FEATURE_TYPES 順の配列  x: 基準画像, y: 比較画像
+        """
+        reference = self._sets[reference_id]
+
+        if reference_id == comparison_id:
+            sum_sq = reference.sum_sq_by_type.copy()
+            return sum_sq, sum_sq.copy(), sum_sq.copy()
+
+        pair = self._pair(reference_id, comparison_id)
+        if reference_id <= comparison_id:
+            return reference.sum_sq_by_type.copy(), pair.cross_by_a.copy(), pair.sq_b_by_a.copy()
+        return reference.sum_sq_by_type.copy(), pair.cross_by_b.copy(), pair.sq_a_by_b.copy()
+
+    def get_cache_info(self) -> Dict[str, int]:
+        """キャッシュの状態を取得"""
+        return {
+            "point_sets": len(self._sets),
+            "pair_statistics": len(self._pairs),
+        }
+
+    def get_memory_usage(self, top: int = DEFAULT_TOP_ENTRIES) -> Dict[str, Any]:
+        """特徴点集合・ペア統計量のおおよそのメモリ使用量を取得する"""
+        point_sets = measure_entries(list(self._sets.items()), top)
+        pairs = measure_entries(list(self._pairs.items()), top)
+        return {
+            "entries": point_sets["entries"] + pairs["entries"],
+            "bytes": point_sets["bytes"] + pairs["bytes"],
+            "largest": point_sets["largest"],
+            "pair_statistics": pairs
+        }
@@ -0,0 +1,274 @@
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# プロファイルを取得するリクエストの割合（0 で無効）
+DEFAULT_SAMPLE_RATE = float(os.environ.get("FACE_PROFILE_SAMPLE_RATE", "0"))
+# この時間（ミリ秒）を超えたリクエストのプロファイルを保存する
+DEFAULT_THRESHOLD_MS = float(os.environ.get("FACE_PROFILE_THRESHOLD_MS", "1000"))
+# X-Profile ヘッダーでプロファイル取得を要求するためのトークン（空の場合はヘッダーによる要求を受け付けない）
+DEFAULT_PROFILE_TOKEN = os.environ.get("FACE_PROFILE_TOKEN", "")
+# スタックを取得する間隔（ミリ秒）
+DEFAULT_INTERVAL_MS = float(os.environ.get("FACE_PROFILE_INTERVAL_MS", "10"))
+# 同時にプロファイルを取得するリクエスト数の上限
+DEFAULT_MAX_ACTIVE = int(os.environ.get("FACE_PROFILE_MAX_ACTIVE", "1"))
+# 1リクエストで取得するスタックの上限数
+DEFAULT_MAX_SAMPLES = int(os.environ.get("FACE_PROFILE_MAX_SAMPLES", "5000"))
+# スタックの取得に使う時間の上限（リクエストの処理時間に対する割合）
+DEFAULT_MAX_OVERHEAD = float(os.environ.get("FACE_PROFILE_MAX_OVERHEAD", "0.05"))
+# 保存するプロファイルの数（超えた分は古いものから削除する）
+DEFAULT_MAX_FILES = int(os.environ.get("FACE_PROFILE_MAX_FILES", "50"))
+# 保存先（既定はプロジェクトルート直下の profiles/）
+DEFAULT_PROFILE_DIR = os.environ.get(
+    "FACE_PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))),
+                 "profiles")
+)
+
+# 記録するスタックの深さの上限
+MAX_STACK_DEPTH = 64
+# 待機中のスレッドとみなす最も内側のフレームのファイル
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+# プロファイルIDに使用できる文字
+PROFILE_ID_PATTERN = re.compile(r"^[0-9A-Za-z_.-]+$")
+
+
+def _frame_label(frame) -> str:
+    """フレームを「ディレクトリ/ファイル:関数」の形式で表す"""
+    code = frame.f_code
+    directory, filename = os.path.split(code.co_filename)
+    return f"{os.path.basename(directory)}/{filename}:{code.co_name}"
+
+
+class ProfileSession:
+    """
+    1リクエスト分のスタックサンプリング
+
+    リクエストの処理中、別スレッドで一定間隔ごとに全スレッドのスタックを取得する
+    （推論はスレッドプールで実行されるため、リクエストを処理したスレッドに限定しない）。
+    同時に処理中の他のリクエストのスタックも含まれるため、統計的な傾向として扱う。
+    """
+
+    def __init__(self, interval: float, max_samples: int, max_overhead: float):
+        self.interval = interval
+        self.max_samples = max_samples
+        self.max_overhead = max_overhead
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.sampling_time = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> float:
+        """サンプリングを終了し、経過時間（秒）を返す"""
+        self._stop.set()
+        self._thread.join()
+        return time.perf_counter() - self.started_at
+
+    def _run(self) -> None:
+        own_thread = threading.get_ident()
+        wait = self.interval
+        while not self._stop.wait(wait) and self.sample_count < self.max_samples:
+            sample_start = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+            cost = time.perf_counter() - sample_start
+            self.sampling_time += cost
+            # 取得にかかった時間が処理時間の max_overhead を超えないよう間隔を広げる
+            wait = max(self.interval, cost / self.max_overhead)
+
+    def summarize(self, top: int = 20) -> Dict[str, Any]:
+        """関数ごとの出現数（自身・呼び出し先を含む）の上位を求める"""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for label in set(frames):
+                total_counts[label] += count
+        return {
+            "top_self": self_counts.most_common(top),
+            "top_total": total_counts.most_common(top)
+        }
+
+
+class RequestProfiler:
+    """
+    遅いリクエストのプロファイルを保存する
+
+    sample_rate の割合のリクエストでスタックサンプリングを行い、処理時間が threshold_ms を
+    超えた場合だけ保存する（それ以外は破棄する）。同時に取得するリクエスト数・取得するスタック数・
+    取得にかける時間の割合に上限を設け、本番環境でのオーバーヘッドを抑える。
+    """
+
+    def __init__(self, sample_rate: float = DEFAULT_SAMPLE_RATE, threshold_ms: float = DEFAULT_THRESHOLD_MS,
+                 interval_ms: float = DEFAULT_INTERVAL_MS, max_active: int = DEFAULT_MAX_ACTIVE,
+                 max_samples: int = DEFAULT_MAX_SAMPLES, max_overhead: float = DEFAULT_MAX_OVERHEAD,
+                 max_files: int = DEFAULT_MAX_FILES, profile_dir: str = DEFAULT_PROFILE_DIR,
+                 token: str = DEFAULT_PROFILE_TOKEN):
+        self.sample_rate = sample_rate
+        self.threshold_ms = threshold_ms
+        self.interval = max(interval_ms, 1.0) / 1000
+        self.max_active = max_active
+        self.max_samples = max_samples
+        self.max_overhead = max_overhead
+        self.max_files = max_files
+        self.profile_dir = profile_dir
+        self.token = token
+        self.active = 0
+        self.profiled = 0
+        self.saved = 0
+        self.skipped_busy = 0
+        self._lock = threading.Lock()
+
+    def is_requested(self, header_value: Optional[str]) -> bool:
+        """X-Profile ヘッダーの値が設定したトークンと一致するか（トークン未設定の場合は常に False）"""
+        if not self.token or not header_value:
+            return False
+        return hmac.compare_digest(header_value.encode(), self.token.encode())
+
+    def start(self, force: bool = False) -> Optional[ProfileSession]:
+        """
+        リクエストのプロファイル取得を開始する
+
+        Args:
+            force: 割合によらず取得する（X-Profile ヘッダーのトークンが一致した場合）
+
+        Returns:
+            取得しない場合は None
+        """
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        with self._lock:
+            if self.active >= self.max_active:
+                self.skipped_busy += 1
+                return None
+            self.active += 1
+            self.profiled += 1
+
+        session = ProfileSession(self.interval, self.max_samples, self.max_overhead)
+        session.start()
+        return session
+
+    def finish(self, session: ProfileSession, request_info: Dict[str, Any]) -> Optional[str]:
+        """
+        プロファイル取得を終了し、遅いリクエストであれば保存する（ヘッダーで要求された場合も同じ）
+
+        Returns:
+            保存したプロファイルのID（保存しない場合は None）
+        """
+        try:
+            elapsed = session.stop()
+        finally:
+            with self._lock:
+                self.active -= 1
+
+        duration_ms = elapsed * 1000
+        if duration_ms < self.threshold_ms:
+            return None
+
+        request_id = request_info.get("request_id") or uuid.uuid4().hex
+        safe_request_id = re.sub(r"[^0-9A-Za-z_.-]", "_", str(request_id))[:64]
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_request_id}"
+        profile = {
+            "profile_id": profile_id,
+            **request_info,
+            "duration_ms": duration_ms,
+            "created_at": time.time(),
+            "interval_ms": session.interval * 1000,
+            "sample_count": session.sample_count,
+            "sampling_overhead_ms": session.sampling_time * 1000,
+            **session.summarize(),
+            "samples": dict(session.samples.most_common())
+        }
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with open(os.path.join(self.profile_dir, f"{profile_id}.json"), "w", encoding="utf-8") as profile_file:
+            json.dump(profile, profile_file, ensure_ascii=False)
+        self.saved += 1
+        self._prune()
+        return profile_id
+
+    def _profile_files(self) -> List[str]:
+        if not os.path.isdir(self.profile_dir):
+            return []
+        return sorted(name for name in os.listdir(self.profile_dir) if name.endswith(".json"))
+
+    def _prune(self) -> None:
+        """保存数の上限を超えたプロファイルを古いものから削除する"""
+        files = self._profile_files()
+        for name in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except OSError:
+                pass
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """保存されているプロファイルの一覧（新しい順、スタックは含まない）"""
+        profiles = []
+        for name in reversed(self._profile_files()):
+            try:
+                with open(os.path.join(self.profile_dir, name), encoding="utf-8") as profile_file:
+                    profile = json.load(profile_file)
+            except (OSError, ValueError):
+                continue
+            profiles.append({
+                key: profile.get(key) for key in
+                ("profile_id", "request_id", "method", "endpoint", "path", "params",
+                 "status_code", "duration_ms", "created_at", "sample_count")
+            })
+        return profiles
+
+    def profile_path(self, profile_id: str) -> Optional[str]:
+        """プロファイルのファイルパス（存在しない場合は None）"""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = os.path.join(self.profile_dir, f"{profile_id}.json")
+        return path if os.path.exists(path) else None
+
+    def load_profile(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = self.profile_path(profile_id)
+        if path is None:
+            return None
+        with open(path, encoding="utf-8") as profile_file:
+            return json.load(profile_file)
+
+    def get_profiler_info(self) -> Dict[str, Any]:
+        """プロファイラの設定と状態を取得"""
+        return {
+            "sample_rate": self.sample_rate,
+            "threshold_ms": self.threshold_ms,
+            "interval_ms": self.interval * 1000,
+            "max_active": self.max_active,
+            "max_samples": self.max_samples,
+            "max_overhead": self.max_overhead,
+            "max_files": self.max_files,
+            "profile_dir": self.profile_dir,
+            "header_enabled": bool(self.token),
+            "active": self.active,
+            "profiled": self.profiled,
+            "saved": self.saved,
+            "skipped_busy": self.skipped_busy
+        }
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,93 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    同じキーの処理の同時実行をまとめる
+
+    実行中の処理と同じキーの呼び出しは新たに処理を行わず、実行中の処理の結果を待つ
+    （ダブルクリックや再試行で同じ画像の推論が重複して実行されるのを防ぐ）。
+    処理は最初の呼び出し元がキャンセルされても、待っている呼び出し元のために最後まで実行する。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.executed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def _running(self, key: Hashable):
+        # タスクはイベントループごとに管理する（テスト等でループが切り替わる場合に対応）
+        task = self._calls.get(key)
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            return task
+        return None
+
+    def start(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> Tuple["asyncio.Task[T]", bool]:
+        """
+        処理を開始する（同じキーの処理が実行中の場合はそのタスクを返す）
+
+        Returns:
+            (タスク, 実行中の処理にまとめたか)
+        """
+        task = self._running(key)
+        if task is not None:
+            self.coalesced += 1
+            return task, True
+
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+        self.executed += 1
+
+        def finished(done: asyncio.Task) -> None:
+            if self._calls.get(key) is done:
+                del self._calls[key]
+            if done.cancelled() or done.exception() is not None:
+                self.failed += 1
+
+        task.add_done_callback(finished)
+        return task, False
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        処理を実行し、結果を返す
+
+        Returns:
+            (処理結果, 実行中の処理にまとめたか)
+        """
+        task, shared = self.start(key, func)
+        # 呼び出し元がキャンセルされても処理自体は継続する
+        return await asyncio.shield(task), shared
+
+    def get_flight_info(self) -> Dict[str, Any]:
+        """実行状況を取得"""
+        return {
+            "in_flight": sum(1 for task in self._calls.values() if not task.done()),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "failed": self.failed
+        }
+
+
+class SingleFlightController:
+    """処理の種類ごとの SingleFlight を管理する"""
+
+    def __init__(self):
+        self._flights: Dict[str, SingleFlight] = {}
+
+    def flight(self, name: str) -> SingleFlight:
+        """SingleFlight を取得する（初回のみ作成）"""
+        if name not in self._flights:
+            self._flights[name] = SingleFlight(name)
+        return self._flights[name]
+
+    def get_controller_info(self) -> Dict[str, Any]:
+        """全ての SingleFlight の実行状況を取得"""
+        return {name: flight.get_flight_info() for name, flight in self._flights.items()}
+
+
+single_flight_controller = SingleFlightController()
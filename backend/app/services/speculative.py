@@ -0,0 +1,179 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.services.memory_accounting import DEFAULT_TOP_ENTRIES, measure_entries
+
+# アップロード直後の処理方針
+# on_demand: 顔検出・特徴点抽出は明示的に要求されたときに実行する
+# speculative: アップロードを検証した直後にバックグラウンドで実行しておく
+UPLOAD_POLICIES = ("on_demand", "speculative")
+DEFAULT_UPLOAD_POLICY = os.environ.get("FACE_UPLOAD_POLICY", "on_demand")
+# バックグラウンド処理の同時実行数（明示的な要求の実行枠を使い切らないよう小さくする）
+DEFAULT_SPECULATIVE_MAX_CONCURRENT = int(os.environ.get("FACE_SPECULATIVE_MAX_CONCURRENT", "1"))
+# 実行待ちにできるバックグラウンド処理の数（超えた分は行わない）
+DEFAULT_SPECULATIVE_MAX_PENDING = int(os.environ.get("FACE_SPECULATIVE_MAX_PENDING", "32"))
+# 明示的な要求に渡すまで保持する処理結果の数（顔検出の結果は画像データを含むため少なめにする）
+DEFAULT_SPECULATIVE_MAX_RESULTS = int(os.environ.get("FACE_SPECULATIVE_MAX_RESULTS", "32"))
+
+
+class SpeculativeProcessor:
+    """
+    アップロード直後のバックグラウンド処理
+
+    処理の内容は configure で登録する（ルーターの処理を使用するため）。
+    結果は明示的な要求が来るまで保持し、1回だけ渡す（take）。
+    処理中に明示的な要求が来た場合は、同じキーの SingleFlight で実行中の処理にまとめられる。
+    """
+
+    def __init__(self, policy: str = DEFAULT_UPLOAD_POLICY,
+                 max_concurrent: int = DEFAULT_SPECULATIVE_MAX_CONCURRENT,
+                 max_pending: int = DEFAULT_SPECULATIVE_MAX_PENDING,
+                 max_results: int = DEFAULT_SPECULATIVE_MAX_RESULTS):
+        if policy not in UPLOAD_POLICIES:
+            raise ValueError(f"未対応のアップロード時の処理方針です: {policy}（{', '.join(UPLOAD_POLICIES)}）")
+        self.policy = policy
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_pending = max(0, max_pending)
+        self.max_results = max_results
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.skipped = 0
+        self.reused = 0
+        self.pending = 0
+        self.running = 0
+        self._job: Optional[Callable[[str], Awaitable[None]]] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._results: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy == "speculative" and self._job is not None
+
+    def configure(self, job: Callable[[str], Awaitable[None]]) -> None:
+        """画像IDを受け取って処理を行うコルーチン関数を登録する"""
+        self._job = job
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # セマフォはイベントループごとに作成する（テスト等でループが切り替わる場合に対応）
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._loop = loop
+        return self._semaphore
+
+    def schedule(self, image_id: str) -> bool:
+        """
+        バックグラウンド処理を予約する（イベントループ上で呼び出す）
+
+        Returns:
+            予約したか（無効な場合・実行待ちが満杯の場合は False）
+        """
+        if not self.enabled or image_id in self._tasks:
+            return False
+        if self.pending >= self.max_pending:
+            self.skipped += 1
+            return False
+
+        self.scheduled += 1
+        self.pending += 1
+        task = asyncio.get_running_loop().create_task(self._run(image_id))
+        self._tasks[image_id] = task
+
+        def finished(done: asyncio.Task) -> None:
+            if self._tasks.get(image_id) is done:
+                del self._tasks[image_id]
+            if done.cancelled():
+                self.cancelled += 1
+            elif done.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+        task.add_done_callback(finished)
+        return True
+
+    async def _run(self, image_id: str) -> None:
+        semaphore = self._get_semaphore()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.pending -= 1
+
+        self.running += 1
+        try:
+            await self._job(image_id)
+        finally:
+            self.running -= 1
+            semaphore.release()
+
+    def cancel(self, image_id: str) -> bool:
+        """
+        バックグラウンド処理を取り消す
+
+        実行待ちの処理と、まだ始まっていない段階は行わない。
+        実行中の推論は中断できないため最後まで実行されるが、結果は保持しない。
+        """
+        self.discard_results(image_id)
+        task = self._tasks.get(image_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    def keep(self, image_id: str, key: Hashable, result: Dict[str, Any]) -> None:
+        """処理結果を明示的な要求に渡すまで保持する"""
+        self._results[(image_id, key)] = result
+        self._results.move_to_end((image_id, key))
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def take(self, image_id: str, key: Hashable) -> Optional[Dict[str, Any]]:
+        """保持している処理結果を取り出す（1回だけ）"""
+        result = self._results.pop((image_id, key), None)
+        if result is not None:
+            self.reused += 1
+        return result
+
+    def discard_results(self, image_id: str, stage: Optional[str] = None) -> None:
+        """
+        画像の処理結果を破棄する
+
+        Args:
+            stage: 破棄する段階（"detect" / "extract"、省略時は全ての段階）
+        """
+        for result_key in [
+            result_key for result_key in self._results
+            if result_key[0] == image_id and (stage is None or result_key[1][0] == stage)
+        ]:
+            del self._results[result_key]
+
+    def get_memory_usage(self, top: int = DEFAULT_TOP_ENTRIES) -> Dict[str, Any]:
+        """保持している処理結果のおおよそのメモリ使用量を取得する"""
+        return measure_entries(list(self._results.items()), top)
+
+    def get_processor_info(self) -> Dict[str, Any]:
+        """バックグラウンド処理の状態を取得"""
+        return {
+            "policy": self.policy,
+            "enabled": self.enabled,
+            "max_concurrent": self.max_concurrent,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "running": self.running,
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "reused": self.reused,
+            "kept_results": len(self._results)
+        }
+
+
+speculative_processor = SpeculativeProcessor()
@@ -0,0 +1,563 @@
+import abc
+import json
+import os
+import select
+import socket
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.services.memory_accounting import DEFAULT_TOP_ENTRIES, measure_entries
+
+
+def _to_jsonable(value: Any) -> Any:
+    """Pydanticモデルを含む値をJSON化可能な形式に変換する"""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump()
+    if isinstance(value, dict):
+        return {key: _to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(item) for item in value]
+    return value
+
+
+class StateBackend(abc.ABC):
+    """
+    プロセス間で共有する状態の保存先（基底クラス）
+
+    値は namespace ごとの key で管理し、書き込み・削除のたびに key ごとの
+    バージョン番号を増やす。バージョンは削除後も引き継がれるため、
+    各プロセスのキャッシュはバージョンの比較だけで鮮度を判定できる。
+    """
+
+    name = "base"
+    # 値をこのプロセスのメモリに保持するか
+    resident = False
+
+    @abc.abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """値を取得する（存在しない場合は None）"""
+
+    @abc.abstractmethod
+    def set(self, namespace: str, key: str, value: Any) -> int:
+        """値を保存し、更新後のバージョンを返す"""
+
+    @abc.abstractmethod
+    def delete(self, namespace: str, key: str) -> bool:
+        """値を削除する（存在しなかった場合は False、バージョンも更新しない）"""
+
+    @abc.abstractmethod
+    def contains(self, namespace: str, key: str) -> bool:
+        """値が存在するか"""
+
+    @abc.abstractmethod
+    def keys(self, namespace: str) -> List[str]:
+        """namespace の全ての key を取得する"""
+
+    def count(self, namespace: str) -> int:
+        return len(self.keys(namespace))
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        """namespace の全ての (key, value) を列挙する"""
+        for key in self.keys(namespace):
+            value = self.get(namespace, key)
+            if value is not None:
+                yield key, value
+
+    def set_many(self, namespace: str, values: Dict[str, Any]) -> Dict[str, int]:
+        """複数の値をまとめて保存し、key ごとの更新後のバージョンを返す"""
+        return {key: self.set(namespace, key, value) for key, value in values.items()}
+
+    @abc.abstractmethod
+    def version(self, namespace: str, key: str) -> int:
+        """現在のバージョンを取得する（一度も書き込まれていない場合は0）"""
+
+    def store(self, namespace: str) -> "StateStore":
+        """namespace を辞書として扱うビューを返す"""
+        return StateStore(self, namespace)
+
+    def get_backend_info(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class MemoryStateBackend(StateBackend):
+    """プロセス内の辞書に保存する（単一ワーカー用）"""
+
+    name = "memory"
+    resident = True
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._versions: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _bump(self, namespace: str, key: str) -> int:
+        versions = self._versions.setdefault(namespace, {})
+        versions[key] = versions.get(key, 0) + 1
+        return versions[key]
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        return self._data.get(namespace, {}).get(key)
+
+    def set(self, namespace: str, key: str, value: Any) -> int:
+        with self._lock:
+            self._data.setdefault(namespace, {})[key] = value
+            return self._bump(namespace, key)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            if key not in self._data.get(namespace, {}):
+                return False
+            del self._data[namespace][key]
+            self._bump(namespace, key)
+            return True
+
+    def contains(self, namespace: str, key: str) -> bool:
+        return key in self._data.get(namespace, {})
+
+    def keys(self, namespace: str) -> List[str]:
+        return list(self._data.get(namespace, {}).keys())
+
+    def count(self, namespace: str) -> int:
+        return len(self._data.get(namespace, {}))
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        return iter(list(self._data.get(namespace, {}).items()))
+
+    def version(self, namespace: str, key: str) -> int:
+        return self._versions.get(namespace, {}).get(key, 0)
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    SQLite（WALモード）に保存する
+
+    同一ホスト上の複数ワーカープロセスで共有できる。
+    接続はプロセスごとに作成するため、fork 後も安全に使用できる。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state_versions ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, version INTEGER NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _bump(self, connection: sqlite3.Connection, namespace: str, key: str) -> int:
+        connection.execute(
+            "INSERT INTO state_versions (namespace, key, version) VALUES (?, ?, 1) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET version = version + 1",
+            (namespace, key)
+        )
+        row = connection.execute(
+            "SELECT version FROM state_versions WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        return row[0]
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: Any) -> int:
+        encoded = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT INTO state (namespace, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value",
+                    (namespace, key, encoded)
+                )
+                return self._bump(connection, namespace, key)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    "DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+                )
+                if cursor.rowcount == 0:
+                    return False
+                self._bump(connection, namespace, key)
+                return True
+
+    def contains(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT 1 FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row is not None
+
+    def keys(self, namespace: str) -> List[str]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT key FROM state WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT COUNT(*) FROM state WHERE namespace = ?", (namespace,)
+            ).fetchone()
+        return row[0]
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT key, value FROM state WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        for key, value in rows:
+            yield key, json.loads(value)
+
+    def set_many(self, namespace: str, values: Dict[str, Any]) -> Dict[str, int]:
+        # 1トランザクションでまとめて書き込む
+        encoded = [(namespace, key, json.dumps(value, ensure_ascii=False)) for key, value in values.items()]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT INTO state (namespace, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value",
+                    encoded
+                )
+                return {key: self._bump(connection, namespace, key) for key in values}
+
+    def version(self, namespace: str, key: str) -> int:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT version FROM state_versions WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get_backend_info(self) -> Dict[str, Any]:
+        return {"backend": self.name, "path": self.path}
+
+
+class RedisError(Exception):
+    """Redisサーバーがエラーを返した"""
+
+
+# 値とバージョンを1回の往復でまとめて更新する Lua スクリプト
+# （途中で他のワーカーの書き込みが割り込まないため、値とバージョンが食い違わない）
+# KEYS: 値のハッシュ, バージョンのハッシュ / ARGV: key, value
+REDIS_SET_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+"""
+
+# KEYS: 値のハッシュ, バージョンのハッシュ / ARGV: key1, value1, key2, value2, ...
+REDIS_SET_MANY_SCRIPT = """
+local versions = {}
+for index = 1, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[index], ARGV[index + 1])
+    versions[#versions + 1] = redis.call('HINCRBY', KEYS[2], ARGV[index], 1)
+end
+return versions
+"""
+
+# KEYS: 値のハッシュ, バージョンのハッシュ / ARGV: key
+REDIS_DELETE_SCRIPT = """
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+return 1
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Redisプロトコル（RESP）対応サーバーに保存する
+
+    複数ホストのワーカー間で共有できる。namespace ごとにハッシュを1つ使い、
+    バージョンは "<prefix>:<namespace>:versions" ハッシュで管理する。
+    値とバージョンの更新は Lua スクリプト（EVAL）で1つの操作として行う。
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "face-comparison", timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.url = url
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+        self._pid: Optional[int] = None
+
+    def _hash_key(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}"
+
+    def _version_key(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}:versions"
+
+    def _connect(self) -> None:
+        if self._socket is not None and self._pid == os.getpid():
+            return
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._socket.makefile("rb")
+        self._pid = os.getpid()
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", str(self.db))
+
+    def _close(self) -> None:
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._reader = None
+
+    def _send(self, *args: str) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._socket.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redisサーバーとの接続が切断されました")
+
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RedisError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if prefix == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"不正な応答です: {line!r}")
+
+    def _drop_stale_connection(self) -> None:
+        """待機中にサーバー側から切断された接続を破棄する（応答待ちでないのに読み取れる場合は切断済み）"""
+        if self._socket is None or self._pid != os.getpid():
+            return
+        try:
+            readable, _, _ = select.select([self._socket], [], [], 0)
+        except (OSError, ValueError):
+            readable = True
+        if readable:
+            self._close()
+
+    def _command(self, *args: str, idempotent: bool = True) -> Any:
+        """
+        コマンドを送信して応答を返す
+
+        Args:
+            idempotent: 再送しても結果が変わらないコマンドか。
+                バージョンを進めるスクリプト（EVAL）は応答を受け取れなかった場合でも
+                サーバー側で実行済みの可能性があり、再送するとバージョンが2回進むため再送しない。
+        """
+        with self._lock:
+            self._drop_stale_connection()
+            try:
+                self._connect()
+                return self._send(*args)
+            except (ConnectionError, OSError):
+                self._close()
+                if not idempotent:
+                    raise
+                # 接続が切れていた場合は1度だけ再接続する
+                self._connect()
+                return self._send(*args)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        value = self._command("HGET", self._hash_key(namespace), key)
+        return json.loads(value) if value is not None else None
+
+    def _eval(self, script: str, namespace: str, *args: str) -> Any:
+        return self._command("EVAL", script, "2", self._hash_key(namespace), self._version_key(namespace), *args,
+                             idempotent=False)
+
+    def set(self, namespace: str, key: str, value: Any) -> int:
+        return self._eval(REDIS_SET_SCRIPT, namespace, key, json.dumps(value, ensure_ascii=False))
+
+    def set_many(self, namespace: str, values: Dict[str, Any]) -> Dict[str, int]:
+        if not values:
+            return {}
+        args = []
+        for key, value in values.items():
+            args.extend((key, json.dumps(value, ensure_ascii=False)))
+        versions = self._eval(REDIS_SET_MANY_SCRIPT, namespace, *args)
+        return dict(zip(values, versions))
+
+    def delete(self, namespace: str, key: str) -> bool:
+        return bool(self._eval(REDIS_DELETE_SCRIPT, namespace, key))
+
+    def contains(self, namespace: str, key: str) -> bool:
+        return bool(self._command("HEXISTS", self._hash_key(namespace), key))
+
+    def keys(self, namespace: str) -> List[str]:
+        return self._command("HKEYS", self._hash_key(namespace)) or []
+
+    def count(self, namespace: str) -> int:
+        return self._command("HLEN", self._hash_key(namespace))
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        reply = self._command("HGETALL", self._hash_key(namespace)) or []
+        for index in range(0, len(reply), 2):
+            yield reply[index], json.loads(reply[index + 1])
+
+    def version(self, namespace: str, key: str) -> int:
+        value = self._command("HGET", self._version_key(namespace), key)
+        return int(value) if value is not None else 0
+
+    def get_backend_info(self) -> Dict[str, Any]:
+        return {"backend": self.name, "host": self.host, "port": self.port, "db": self.db}
+
+
+class StateStore(MutableMapping):
+    """
+    StateBackend の1つの namespace を辞書として扱うビュー
+
+    値は保存時にJSON化可能な形式（Pydanticモデルは辞書）に変換される。
+    """
+
+    def __init__(self, backend: StateBackend, namespace: str):
+        self.backend = backend
+        self.namespace = namespace
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.backend.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.backend.set(self.namespace, key, _to_jsonable(value))
+
+    def __delitem__(self, key: str) -> None:
+        if not self.backend.delete(self.namespace, key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.backend.contains(self.namespace, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.backend.keys(self.namespace))
+
+    def __len__(self) -> int:
+        return self.backend.count(self.namespace)
+
+    def put(self, key: str, value: Any) -> int:
+        """値を保存し、更新後のバージョンを返す"""
+        return self.backend.set(self.namespace, key, _to_jsonable(value))
+
+    def put_many(self, values: Dict[str, Any]) -> Dict[str, int]:
+        """複数の値をまとめて保存し、key ごとの更新後のバージョンを返す"""
+        return self.backend.set_many(
+            self.namespace, {key: _to_jsonable(value) for key, value in values.items()}
+        )
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """全ての (key, value) をまとめて取得する"""
+        return self.backend.items(self.namespace)
+
+    def discard(self, key: str) -> bool:
+        """値を削除する（存在しなかった場合はFalse）"""
+        return self.backend.delete(self.namespace, key)
+
+    def version(self, key: str) -> int:
+        """key の現在のバージョンを取得する"""
+        return self.backend.version(self.namespace, key)
+
+    def get_memory_usage(self, top: int = DEFAULT_TOP_ENTRIES) -> Dict[str, Any]:
+        """
+        このプロセスで保持している値のおおよそのメモリ使用量を取得する
+
+        プロセス外（SQLite・Redis）に保存している場合は値を読み込まず、エントリ数のみ返す。
+        """
+        if not self.backend.resident:
+            return {"entries": len(self), "bytes": None, "largest": [], "resident": False,
+                    "backend": self.backend.name}
+        return {**measure_entries(self.items(), top), "resident": True, "backend": self.backend.name}
+
+
+_state_backend: Optional[StateBackend] = None
+
+
+def create_state_backend() -> StateBackend:
+    """
+    環境変数から状態の保存先を作成する
+
+    FACE_STATE_BACKEND: memory（既定） / sqlite / redis
+    FACE_STATE_PATH: SQLiteファイルのパス（既定: <プロジェクトルート>/data/state.sqlite3）
+    FACE_REDIS_URL: RedisのURL（既定: redis://localhost:6379/0）
+    """
+    backend = os.environ.get("FACE_STATE_BACKEND", "memory").lower()
+
+    if backend == "memory":
+        return MemoryStateBackend()
+
+    if backend == "sqlite":
+        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        default_path = os.path.join(project_root, "data", "state.sqlite3")
+        return SQLiteStateBackend(os.environ.get("FACE_STATE_PATH", default_path))
+
+    if backend == "redis":
+        return RedisStateBackend(os.environ.get("FACE_REDIS_URL", "redis://localhost:6379/0"))
+
+    raise ValueError(f"未対応の状態保存先です: {backend}")
+
+
+def get_state_backend() -> StateBackend:
+    """プロセス内で共有する状態の保存先を取得する"""
+    global _state_backend
+    if _state_backend is None:
+        _state_backend = create_state_backend()
+    return _state_backend
@@ -0,0 +1,319 @@
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.model_registry import model_registry
+from app.utils.lazy_import import lazy_import
+
+# 重いモジュールは初回使用時に読み込む
+cv2 = lazy_import("cv2")
+
+# 受け付ける動画形式
+VIDEO_EXTENSIONS = ('mp4', 'mov', 'avi', 'mkv', 'webm')
+# アップロードできる動画の大きさの上限（バイト）
+DEFAULT_MAX_VIDEO_SIZE = int(os.environ.get("FACE_VIDEO_MAX_FILE_SIZE", str(100 * 1024 * 1024)))
+# 最初に解析する頻度（1秒あたりのフレーム数、顔の有無・品質に応じて間隔を変える）
+DEFAULT_SAMPLE_FPS = float(os.environ.get("FACE_VIDEO_SAMPLE_FPS", "4"))
+# 1本の動画で解析するフレーム数の上限（長い動画は間隔を広げて全体から選ぶ）
+DEFAULT_MAX_SAMPLED_FRAMES = int(os.environ.get("FACE_VIDEO_MAX_SAMPLED_FRAMES", "240"))
+# 選ぶフレーム数
+DEFAULT_SELECT_FRAMES = int(os.environ.get("FACE_VIDEO_SELECT_FRAMES", "3"))
+# 選ぶフレーム同士の最小の間隔（秒、ほぼ同じフレームを選ばないようにする）
+DEFAULT_MIN_GAP_SECONDS = float(os.environ.get("FACE_VIDEO_MIN_GAP_SECONDS", "0.5"))
+# FaceMesh に渡すフレームの長辺
+DEFAULT_ANALYSIS_EDGE = int(os.environ.get("FACE_VIDEO_ANALYSIS_EDGE", "640"))
+# 顔の大きさ（元フレームでの長辺のピクセル数）の下限
+DEFAULT_MIN_FACE_SIZE = int(os.environ.get("FACE_VIDEO_MIN_FACE_SIZE", "64"))
+
+# 鮮明さの指標に使う顔領域の大きさ（顔の大きさによらず比較できるよう、この大きさに揃える）
+SHARPNESS_EDGE = 128
+# この角度（度）で正面度が 0 になる
+MAX_POSE_ANGLE = 45.0
+# 顔検出モデルで再評価する候補数（選ぶフレーム数に対する倍率）
+CANDIDATE_FACTOR = 3
+# フレーム数が取得できない場合に想定するフレームレート
+FALLBACK_FPS = 30.0
+
+# 正面度の算出に使うランドマーク（MediaPipe Face Mesh）
+LEFT_EYE_CORNER = 33
+RIGHT_EYE_CORNER = 263
+FOREHEAD = 10
+CHIN = 152
+
+
+class VideoIngestionService:
+    """
+    動画から顔の比較に適したフレームを選ぶ
+
+    FaceMesh を追跡モード（static_image_mode=False）で実行し、前のフレームのランドマークから
+    顔を追跡する（見失った場合だけ顔検出を行う）ため、フレームごとに顔を検出し直すより軽い。
+    解析する間隔は、顔がない区間では広げ、良いフレームが見つかった付近では狭める。
+    鮮明さと正面度で候補を絞り、候補だけを顔検出モデルで再評価して検出スコアを掛け合わせる。
+    """
+
+    def __init__(self, sample_fps: float = DEFAULT_SAMPLE_FPS,
+                 max_sampled_frames: int = DEFAULT_MAX_SAMPLED_FRAMES,
+                 select_frames: int = DEFAULT_SELECT_FRAMES,
+                 min_gap_seconds: float = DEFAULT_MIN_GAP_SECONDS,
+                 analysis_edge: int = DEFAULT_ANALYSIS_EDGE,
+                 min_face_size: int = DEFAULT_MIN_FACE_SIZE):
+        self.model_registry = model_registry
+        self.sample_fps = sample_fps
+        self.max_sampled_frames = max(1, max_sampled_frames)
+        self.select_frames = select_frames
+        self.min_gap_seconds = min_gap_seconds
+        self.analysis_edge = analysis_edge
+        self.min_face_size = min_face_size
+
+    def select_best_frames(self, video_path: str, max_frames: Optional[int] = None) -> Dict[str, Any]:
+        """
+        動画を解析し、顔の比較に適したフレームを選ぶ
+
+        Args:
+            video_path: 動画ファイルのパス
+            max_frames: 選ぶフレーム数（省略時はサービスの設定）
+
+        Returns:
+            {success, message, video, sampling, frames}
+            frames は score の高い順で、各フレームは JPEG データ（jpeg）と評価値を含む
+        """
+        start_time = time.perf_counter()
+        max_frames = max_frames or self.select_frames
+
+        capture = cv2.VideoCapture(video_path)
+        try:
+            if not capture.isOpened():
+                return {"success": False, "message": "動画を開けませんでした", "frames": []}
+
+            fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+            if not math.isfinite(fps) or fps <= 0:
+                fps = FALLBACK_FPS
+            frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+            video_info = {
+                "fps": fps,
+                "frame_count": frame_count or None,
+                "duration": frame_count / fps if frame_count else None,
+                "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            }
+
+            candidates, sampling = self._scan(capture, fps, frame_count, max_frames * CANDIDATE_FACTOR)
+        finally:
+            capture.release()
+
+        frames = self._rescore(candidates)[:max_frames]
+        sampling["elapsed_ms"] = (time.perf_counter() - start_time) * 1000
+
+        if not frames:
+            return {
+                "success": False,
+                "message": "顔が写っているフレームが見つかりませんでした",
+                "video": video_info,
+                "sampling": sampling,
+                "frames": []
+            }
+
+        return {
+            "success": True,
+            "message": f"{sampling['sampled_frames']}フレームを解析し、{len(frames)}フレームを選びました",
+            "video": video_info,
+            "sampling": sampling,
+            "frames": frames
+        }
+
+    def _scan(self, capture, fps: float, frame_count: int, max_candidates: int):
+        """
+        追跡モードの FaceMesh でフレームを順に解析し、鮮明さ×正面度の高い候補を残す
+
+        Returns:
+            (候補のリスト, 解析の統計)
+        """
+        base_stride = max(1, round(fps / self.sample_fps))
+        min_stride = max(1, base_stride // 4)
+        max_stride = base_stride * 4
+        min_gap_frames = max(1, round(self.min_gap_seconds * fps))
+
+        stride = base_stride
+        frame_index = -1
+        sampled = 0
+        tracked = 0
+        lost = 0
+        best_score = 0.0
+        candidates: List[Dict[str, Any]] = []
+
+        with self.model_registry.acquire("face_mesh_tracking", timeout=None) as face_mesh:
+            # 前の動画の追跡状態を引き継がない
+            face_mesh.reset()
+
+            while sampled < self.max_sampled_frames:
+                # 解析しないフレームは grab で読み飛ばす（色変換・コピーを行わない）
+                skipped = True
+                for _ in range(stride - 1 if frame_index >= 0 else 0):
+                    if not capture.grab():
+                        skipped = False
+                        break
+                    frame_index += 1
+                if not skipped:
+                    break
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                frame_index += 1
+                sampled += 1
+
+                measured = self._measure_frame(face_mesh, frame)
+                if measured is None:
+                    lost += 1
+                    # 顔がない区間は間隔を広げて読み飛ばす
+                    stride = min(max_stride, stride * 2)
+                else:
+                    tracked += 1
+                    if measured["preliminary_score"] >= best_score * 0.9:
+                        # 良いフレームの付近は間隔を狭めて、より良いフレームを探す
+                        stride = max(min_stride, stride // 2)
+                    else:
+                        stride = base_stride
+                    best_score = max(best_score, measured["preliminary_score"])
+                    measured["frame_index"] = frame_index
+                    measured["timestamp"] = frame_index / fps
+                    self._keep_candidate(candidates, measured, frame, min_gap_frames, max_candidates)
+
+                # 残りのフレームを解析数の上限内で最後まで見られるよう、間隔を広げる
+                if frame_count:
+                    remaining_budget = max(1, self.max_sampled_frames - sampled)
+                    stride = max(stride, math.ceil((frame_count - frame_index - 1) / remaining_budget))
+
+        return candidates, {
+            "sampled_frames": sampled,
+            "last_frame_index": frame_index,
+            "faces_tracked": tracked,
+            "frames_without_face": lost,
+            "base_stride": base_stride
+        }
+
+    def _measure_frame(self, face_mesh, frame: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        フレームの顔の位置・鮮明さ・正面度を求める
+
+        Returns:
+            顔がない場合・小さすぎる場合は None
+        """
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.analysis_edge / max(h, w))
+        analysis_frame = frame if scale >= 1.0 else cv2.resize(
+            frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA
+        )
+
+        result = face_mesh.process(cv2.cvtColor(analysis_frame, cv2.COLOR_BGR2RGB))
+        if not result.multi_face_landmarks:
+            return None
+
+        # 正規化座標を元フレームのピクセル座標に変換（z は x と同じ尺度）
+        landmarks = np.array([(lm.x, lm.y, lm.z) for lm in result.multi_face_landmarks[0].landmark])
+        points = landmarks * (w, h, w)
+
+        x1, y1 = np.clip(points[:, :2].min(axis=0), 0, (w, h)).astype(int)
+        x2, y2 = np.clip(points[:, :2].max(axis=0), 0, (w, h)).astype(int)
+        face_size = max(x2 - x1, y2 - y1)
+        if face_size < self.min_face_size:
+            return None
+
+        # 鮮明さ: 一定の大きさに揃えた顔領域のラプラシアンの分散
+        face = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+        face = cv2.resize(face, (SHARPNESS_EDGE, SHARPNESS_EDGE), interpolation=cv2.INTER_AREA)
+        sharpness = float(cv2.Laplacian(face, cv2.CV_64F).var())
+
+        # 正面度: 両目の外側角・額とあごの奥行きの差から左右・上下の向きを求める
+        eye_vector = points[RIGHT_EYE_CORNER] - points[LEFT_EYE_CORNER]
+        face_vector = points[CHIN] - points[FOREHEAD]
+        yaw = float(np.degrees(np.arctan2(eye_vector[2], np.hypot(eye_vector[0], eye_vector[1]))))
+        pitch = float(np.degrees(np.arctan2(face_vector[2], np.hypot(face_vector[0], face_vector[1]))))
+        frontal_score = max(0.0, 1.0 - max(abs(yaw), abs(pitch)) / MAX_POSE_ANGLE)
+
+        return {
+            "face_bbox": {"x": int(x1), "y": int(y1), "width": int(x2 - x1), "height": int(y2 - y1)},
+            "sharpness": sharpness,
+            "yaw": yaw,
+            "pitch": pitch,
+            "frontal_score": frontal_score,
+            "preliminary_score": sharpness * frontal_score
+        }
+
+    def _keep_candidate(self, candidates: List[Dict[str, Any]], measured: Dict[str, Any],
+                        frame: np.ndarray, min_gap_frames: int, max_candidates: int) -> None:
+        """
+        候補に加える（近いフレームの候補とはスコアの高い方だけを残す）
+
+        フレームは JPEG に圧縮して保持し、候補数によらずメモリ使用量を抑える。
+        """
+        score = measured["preliminary_score"]
+        if score <= 0:
+            return
+        nearby = [
+            candidate for candidate in candidates
+            if abs(candidate["frame_index"] - measured["frame_index"]) < min_gap_frames
+        ]
+        if any(candidate["preliminary_score"] >= score for candidate in nearby):
+            return
+        nearby_ids = {id(candidate) for candidate in nearby}
+        others = [candidate for candidate in candidates if id(candidate) not in nearby_ids]
+        if len(others) >= max_candidates and min(candidate["preliminary_score"] for candidate in others) >= score:
+            return
+
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        if not ok:
+            return
+        candidates[:] = others
+        candidates.append(dict(measured, jpeg=encoded.tobytes(), width=frame.shape[1], height=frame.shape[0]))
+        candidates.sort(key=lambda candidate: candidate["preliminary_score"], reverse=True)
+        del candidates[max_candidates:]
+
+    def _rescore(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        候補を顔検出モデルで再評価し、検出スコア×鮮明さ×正面度の高い順に並べる
+
+        鮮明さは候補の中での最大値を 1 とした値を使う。
+        """
+        if not candidates:
+            return []
+        max_sharpness = max(candidate["sharpness"] for candidate in candidates) or 1.0
+
+        scored = []
+        with self.model_registry.acquire("face_detection") as face_detection:
+            for candidate in candidates:
+                frame = cv2.imdecode(np.frombuffer(candidate["jpeg"], dtype=np.uint8), cv2.IMREAD_COLOR)
+                h, w = frame.shape[:2]
+                scale = min(1.0, self.analysis_edge / max(h, w))
+                if scale < 1.0:
+                    frame = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                       interpolation=cv2.INTER_AREA)
+                detections = face_detection.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).detections
+                if not detections:
+                    continue
+                detection_score = float(detections[0].score[0])
+                sharpness_score = candidate["sharpness"] / max_sharpness
+                scored.append(dict(
+                    {key: value for key, value in candidate.items() if key != "preliminary_score"},
+                    detection_score=detection_score,
+                    sharpness_score=sharpness_score,
+                    score=detection_score * sharpness_score * candidate["frontal_score"]
+                ))
+
+        scored.sort(key=lambda candidate: candidate["score"], reverse=True)
+        return scored
+
+    def get_video_info(self) -> Dict[str, Any]:
+        """動画の処理設定を取得"""
+        return {
+            "supported_formats": list(VIDEO_EXTENSIONS),
+            "max_file_size": DEFAULT_MAX_VIDEO_SIZE,
+            "sample_fps": self.sample_fps,
+            "max_sampled_frames": self.max_sampled_frames,
+            "select_frames": self.select_frames,
+            "min_gap_seconds": self.min_gap_seconds,
+            "analysis_edge": self.analysis_edge,
+            "min_face_size": self.min_face_size
+        }
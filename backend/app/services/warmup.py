@@ -0,0 +1,150 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from starlette.concurrency import run_in_threadpool
+
+from app.services.model_registry import model_registry
+from app.utils.lazy_import import lazy_import
+
+cv2 = lazy_import("cv2")
+
+# ウォームアップに失敗した場合の再試行回数（0 で成功するまで再試行する）
+DEFAULT_WARMUP_MAX_ATTEMPTS = int(os.environ.get("FACE_WARMUP_MAX_ATTEMPTS", "0"))
+# 再試行までの最初の待ち時間（秒、失敗するたびに倍にする）
+DEFAULT_WARMUP_RETRY_DELAY = float(os.environ.get("FACE_WARMUP_RETRY_DELAY", "1"))
+# 再試行までの待ち時間の上限（秒）
+DEFAULT_WARMUP_MAX_RETRY_DELAY = float(os.environ.get("FACE_WARMUP_MAX_RETRY_DELAY", "60"))
+
+# 起動時に生成する静止画用のモデル
+STILL_IMAGE_MODELS = ("face_mesh", "face_detection")
+
+
+def _create_synthetic_image(size: int = 256) -> np.ndarray:
+    """ウォームアップ用の顔を模した合成画像（BGR）を作成する"""
+    image = np.full((size, size, 3), 200, dtype=np.uint8)
+    center = (size // 2, size // 2)
+    cv2.ellipse(image, center, (size // 4, size // 3), 0, 0, 360, (150, 180, 220), -1)
+    cv2.circle(image, (size // 2 - size // 10, size // 2 - size // 12), size // 30, (40, 40, 40), -1)
+    cv2.circle(image, (size // 2 + size // 10, size // 2 - size // 12), size // 30, (40, 40, 40), -1)
+    cv2.ellipse(image, (size // 2, size // 2 + size // 8), (size // 12, size // 40), 0, 0, 360, (60, 60, 160), -1)
+    return image
+
+
+class WarmupService:
+    """
+    起動時のウォームアップ
+
+    MediaPipe グラフの初期化や TFLite デリゲートの準備は初回の推論時に行われるため、
+    起動時に合成画像で推論を行い、最初のリクエストが遅くならないようにする。
+    """
+
+    def __init__(self, max_attempts: int = DEFAULT_WARMUP_MAX_ATTEMPTS,
+                 retry_delay: float = DEFAULT_WARMUP_RETRY_DELAY,
+                 max_retry_delay: float = DEFAULT_WARMUP_MAX_RETRY_DELAY):
+        # ウォームアップ完了を準備完了の条件とするか（モデルを使わない構成では不要）
+        self.required = False
+        self.max_attempts = max(0, max_attempts)
+        self.retry_delay = max(0.0, retry_delay)
+        self.max_retry_delay = max(self.retry_delay, max_retry_delay)
+        self.attempts = 0
+        self.next_retry_at: Optional[float] = None
+        self.status = "pending"  # pending / running / ready / failed
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.timings: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_ready(self) -> bool:
+        return not self.required or self.status == "ready"
+
+    def run(self) -> Dict[str, Any]:
+        """ウォームアップを実行する（ブロッキング）"""
+        # 循環インポートを避けるため、実行時にサービスを読み込む
+        from app.services.face_detection import FaceDetectionService
+        from app.services.auto_feature_extraction import AutoFeatureExtractionService
+
+        with self._lock:
+            if self.status == "running":
+                return self.get_status()
+            self.status = "running"
+            self.started_at = time.time()
+            self.error = None
+            self.attempts += 1
+            self.next_retry_at = None
+
+        try:
+            # プールの全インスタンスを生成し、それぞれで1回推論する
+            # （動画用の FaceMesh は動画を受け付ける構成でのみ使うため、初回の動画の処理時に生成する）
+            start_time = time.time()
+            self.timings["model_preload"] = sum(model_registry.preload(list(STILL_IMAGE_MODELS)).values())
+            model_registry.check_health()
+            self.timings["model_inference"] = time.time() - start_time - self.timings["model_preload"]
+
+            # サービス経由で一連の処理（画像読み込み・変換・推論）を実行する
+            with tempfile.TemporaryDirectory() as temp_dir:
+                image_path = os.path.join(temp_dir, "warmup.jpg")
+                cv2.imwrite(image_path, _create_synthetic_image())
+
+                start_time = time.time()
+                FaceDetectionService().detect_and_process_face(image_path)
+                self.timings["face_detection"] = time.time() - start_time
+
+                start_time = time.time()
+                AutoFeatureExtractionService().extract_auto_features(image_path=image_path)
+                self.timings["auto_feature_extraction"] = time.time() - start_time
+
+            self.status = "ready"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+
+        return self.get_status()
+
+    async def run_with_retry(self) -> Dict[str, Any]:
+        """
+        ウォームアップを成功するまで実行する
+
+        失敗した場合は待ち時間を倍にしながら（上限 max_retry_delay）再試行する。
+        max_attempts 回失敗した場合は failed のままにする（0 の場合は上限なし）。
+        """
+        delay = self.retry_delay
+        while True:
+            status = await run_in_threadpool(self.run)
+            if status["status"] != "failed":
+                return status
+            if self.max_attempts and self.attempts >= self.max_attempts:
+                return status
+
+            self.next_retry_at = time.time() + delay
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def get_status(self) -> Dict[str, Any]:
+        """ウォームアップの状態を取得"""
+        return {
+            "required": self.required,
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": (
+                self.finished_at - self.started_at
+                if self.started_at and self.finished_at else None
+            ),
+            "timings": dict(self.timings),
+            "error": self.error,
+            "attempts": self.attempts,
+            "next_retry_at": self.next_retry_at
+        }
+
+
+warmup_service = WarmupService()
@@ -0,0 +1,119 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.services.point_statistics import FEATURE_TYPES, point_coordinates, point_type_codes
+from app.utils.points import point_field
+
+# orjson・msgpack はインストールされている場合のみ使用する
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 特徴点の表現形式
+#   json:     従来どおり特徴点ごとのオブジェクトのリスト
+#   columnar: 項目ごとの配列（x, y, type, label, ...）
+#   binary:   座標を float32 のバッファ（x0, y0, x1, y1, ...）、タイプを uint8 のバッファで表現
+WIRE_FORMATS = ("json", "columnar", "binary")
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+def encode_points(points: List[Any], wire_format: str, raw_buffers: bool = False) -> Any:
+    """
+    特徴点リストを指定された表現形式に変換する
+
+    Args:
+        points: 特徴点リスト
+        wire_format: WIRE_FORMATS のいずれか
+        raw_buffers: binary 形式でバッファを base64 文字列ではなく bytes のまま返す（msgpack 用）
+    """
+    if wire_format == "json":
+        return points
+
+    labels = [point_field(point, 'label') for point in points]
+    confidences = [point_field(point, 'confidence') for point in points]
+    landmark_indices = [point_field(point, 'landmark_index') for point in points]
+
+    if wire_format == "columnar":
+        coords = point_coordinates(points)
+        return {
+            "count": len(points),
+            "x": coords[:, 0].tolist(),
+            "y": coords[:, 1].tolist(),
+            "type": [FEATURE_TYPES[code] for code in point_type_codes(points).tolist()],
+            "label": labels,
+            "confidence": confidences,
+            "landmark_index": landmark_indices
+        }
+
+    if wire_format == "binary":
+        # リトルエンディアンの float32 で x, y を交互に並べる
+        coords = point_coordinates(points).astype('<f4').tobytes()
+        type_codes = point_type_codes(points).astype(np.uint8).tobytes()
+        return {
+            "count": len(points),
+            "encoding": "float32le" if raw_buffers else "float32le-base64",
+            "xy": coords if raw_buffers else base64.b64encode(coords).decode(),
+            "type_codes": type_codes if raw_buffers else base64.b64encode(type_codes).decode(),
+            "feature_types": list(FEATURE_TYPES),
+            "label": labels,
+            "confidence": confidences,
+            "landmark_index": landmark_indices
+        }
+
+    raise ValueError(f"未対応の表現形式です: {wire_format}")
+
+
+def wants_msgpack(request: Optional[Request]) -> bool:
+    """クライアントが msgpack を要求しており、かつ利用可能かどうか"""
+    return (
+        msgpack is not None and request is not None
+        and MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
+    )
+
+
+def compact_response(content: Dict[str, Any], request: Optional[Request] = None,
+                     status_code: int = 200) -> Response:
+    """
+    サーバーが生成したデータを再検証せずにシリアライズしてレスポンスを返す
+
+    Accept: application/x-msgpack の場合は msgpack、それ以外はJSON
+    （orjson が利用可能な場合は orjson）で返す。
+    """
+    if wants_msgpack(request):
+        return Response(
+            content=msgpack.packb(content, use_bin_type=True),
+            status_code=status_code,
+            media_type=MSGPACK_MEDIA_TYPE
+        )
+
+    if orjson is not None:
+        body = orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    else:
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode()
+
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+def _json_default(value: Any) -> Any:
+    """標準のjsonで扱えない値を変換する"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if hasattr(value, 'model_dump'):
+        return value.model_dump()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
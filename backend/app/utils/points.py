@@ -0,0 +1,6 @@
+from typing import Any
+
+
+def point_field(point: Any, name: str, default: Any = None) -> Any:
+    """特徴点の項目を取得する（辞書形式とオブジェクト形式（Pydanticモデル）の両方に対応）"""
+    return getattr(point, name, default) if hasattr(point, name) else point.get(name, default)
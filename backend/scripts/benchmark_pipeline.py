@@ -0,0 +1,188 @@
+"""
+顔検出の処理構成（accurate / fast）の比較
+
+accurate（顔検出モデル + 切り出した顔への FaceMesh）と fast（縮小画像への FaceMesh のみ）で
+同じ画像を処理し、レイテンシとランドマークの一致度を計測する。
+一致度は accurate のランドマークを基準とした平均誤差を両目の外側角の距離で割った値（NME）で表す。
+
+使い方（backend ディレクトリで実行）:
+    # 合成画像で計測
+    python scripts/benchmark_pipeline.py --images 16 --repeat 5
+
+    # 手元の画像で計測
+    python scripts/benchmark_pipeline.py photos/*.jpg
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# 両目の外側角（MediaPipe Face Mesh のランドマーク番号）
+LEFT_EYE_CORNER = 33
+RIGHT_EYE_CORNER = 263
+
+
+def load_images(paths: List[str], count: int, seed: int) -> Dict[str, str]:
+    """画像のパスを返す（指定がない場合は合成画像を一時ディレクトリに生成する）"""
+    if paths:
+        return {os.path.basename(path): path for path in paths}
+
+    from load_test import generate_face_images
+
+    temp_dir = tempfile.mkdtemp(prefix="benchmark_pipeline_")
+    images = {}
+    for index, data in enumerate(generate_face_images(count, seed)):
+        path = os.path.join(temp_dir, f"synthetic_{index:03d}.jpg")
+        with open(path, "wb") as image_file:
+            image_file.write(data)
+        images[os.path.basename(path)] = path
+    return images
+
+
+def bbox_iou(a: Dict[str, int], b: Dict[str, int]) -> float:
+    """2つの境界ボックスの IoU"""
+    x1, y1 = max(a["x"], b["x"]), max(a["y"], b["y"])
+    x2 = min(a["x"] + a["width"], b["x"] + b["width"])
+    y2 = min(a["y"] + a["height"], b["y"] + b["height"])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a["width"] * a["height"] + b["width"] * b["height"] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def time_call(function, repeat: int):
+    """function を repeat 回実行し、(最後の結果, 各回の所要時間[ms]) を返す"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        durations.append((time.perf_counter() - start_time) * 1000)
+    return result, durations
+
+
+def compare_image(service, path: str, repeat: int) -> Dict[str, Optional[float]]:
+    """1枚の画像を両方の構成で処理し、レイテンシと一致度を求める"""
+    import cv2
+
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"画像を読み込めません: {path}")
+
+    accurate, accurate_ms = time_call(lambda: service._locate_face_accurate(image), repeat)
+    fast, fast_ms = time_call(lambda: service._locate_face_fast(image), repeat)
+
+    # 画像の読み込みから処理済み画像の作成までを含めた時間
+    _, accurate_total_ms = time_call(lambda: service.detect_and_process_face(path, None, "accurate"), repeat)
+    _, fast_total_ms = time_call(lambda: service.detect_and_process_face(path, None, "fast"), repeat)
+
+    row = {
+        "accurate_found": accurate is not None and accurate["points"] is not None,
+        "fast_found": fast is not None,
+        "accurate_ms": float(np.median(accurate_ms)),
+        "fast_ms": float(np.median(fast_ms)),
+        "accurate_total_ms": float(np.median(accurate_total_ms)),
+        "fast_total_ms": float(np.median(fast_total_ms)),
+        "nme": None,
+        "bbox_iou": None,
+        "angle_diff": None
+    }
+
+    if row["accurate_found"] and row["fast_found"]:
+        reference = accurate["points"]
+        interocular = np.linalg.norm(reference[RIGHT_EYE_CORNER] - reference[LEFT_EYE_CORNER])
+        errors = np.linalg.norm(fast["points"] - reference, axis=1)
+        row["nme"] = float(errors.mean() / max(interocular, 1e-6))
+        row["bbox_iou"] = bbox_iou(accurate["bbox"], fast["bbox"])
+        row["angle_diff"] = abs(service._eye_angle(fast["points"]) - service._eye_angle(reference))
+
+    return row
+
+
+def summarize(rows: Dict[str, dict]) -> dict:
+    """画像ごとの結果を集計する"""
+    values = list(rows.values())
+
+    def median(key: str) -> Optional[float]:
+        samples = [row[key] for row in values if row[key] is not None]
+        return float(np.median(samples)) if samples else None
+
+    def percentile(key: str, q: float) -> Optional[float]:
+        samples = [row[key] for row in values if row[key] is not None]
+        return float(np.percentile(samples, q)) if samples else None
+
+    accurate_ms = median("accurate_ms")
+    fast_ms = median("fast_ms")
+    return {
+        "images": len(values),
+        "accurate_detected": sum(row["accurate_found"] for row in values),
+        "fast_detected": sum(row["fast_found"] for row in values),
+        "accurate_ms_p50": accurate_ms,
+        "fast_ms_p50": fast_ms,
+        "speedup": accurate_ms / fast_ms if accurate_ms and fast_ms else None,
+        "accurate_total_ms_p50": median("accurate_total_ms"),
+        "fast_total_ms_p50": median("fast_total_ms"),
+        "nme_p50": median("nme"),
+        "nme_p95": percentile("nme", 95),
+        "bbox_iou_p50": median("bbox_iou"),
+        "angle_diff_p50": median("angle_diff")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="顔検出の処理構成（accurate / fast）の比較")
+    parser.add_argument("paths", nargs="*", help="画像ファイル（省略時は合成画像を生成）")
+    parser.add_argument("--images", type=int, default=16, help="生成する合成画像の枚数")
+    parser.add_argument("--repeat", type=int, default=5, help="画像ごとの繰り返し回数（中央値を使用）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    from app.services.face_detection import FaceDetectionService
+
+    service = FaceDetectionService()
+    images = load_images(args.paths, args.images, args.seed)
+
+    # モデルの読み込みを計測から除外する
+    first_path = next(iter(images.values()))
+    service.detect_and_process_face(first_path, None, "accurate")
+    service.detect_and_process_face(first_path, None, "fast")
+
+    rows = {name: compare_image(service, path, args.repeat) for name, path in images.items()}
+    summary = summarize(rows)
+
+    if args.json:
+        print(json.dumps({"summary": summary, "images": rows}, indent=2, ensure_ascii=False))
+        return
+
+    def fmt(value: Optional[float], spec: str) -> str:
+        return "-" if value is None else format(value, spec)
+
+    print(f"{'image':<24} {'accurate':>9} {'fast':>9} {'total(acc)':>11} {'total(fast)':>12} "
+          f"{'NME':>7} {'IoU':>6} {'angle':>6}")
+    for name, row in rows.items():
+        print(f"{name:<24} {fmt(row['accurate_ms'], '7.1f')}ms {fmt(row['fast_ms'], '7.1f')}ms "
+              f"{fmt(row['accurate_total_ms'], '9.1f')}ms {fmt(row['fast_total_ms'], '10.1f')}ms "
+              f"{fmt(row['nme'], '7.3f')} {fmt(row['bbox_iou'], '6.2f')} {fmt(row['angle_diff'], '6.2f')}")
+
+    print()
+    print(f"検出: accurate {summary['accurate_detected']}/{summary['images']}, "
+          f"fast {summary['fast_detected']}/{summary['images']}")
+    print(f"顔の位置推定 p50: accurate {fmt(summary['accurate_ms_p50'], '.1f')}ms, "
+          f"fast {fmt(summary['fast_ms_p50'], '.1f')}ms（{fmt(summary['speedup'], '.2f')}倍）")
+    print(f"全体 p50: accurate {fmt(summary['accurate_total_ms_p50'], '.1f')}ms, "
+          f"fast {fmt(summary['fast_total_ms_p50'], '.1f')}ms")
+    print(f"ランドマークの一致度: NME p50 {fmt(summary['nme_p50'], '.3f')}, p95 {fmt(summary['nme_p95'], '.3f')}, "
+          f"境界ボックス IoU p50 {fmt(summary['bbox_iou_p50'], '.2f')}, "
+          f"傾きの差 p50 {fmt(summary['angle_diff_p50'], '.2f')}°")
+
+
+if __name__ == "__main__":
+    main()
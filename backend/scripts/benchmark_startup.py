@@ -0,0 +1,85 @@
+"""
+起動時間のベンチマーク
+
+新しいプロセスで app.main をインポートし、最初のリクエストに応答するまでの時間と
+読み込まれた重いモジュールを構成ごとに計測する。
+
+使い方（backend ディレクトリで実行）:
+    python scripts/benchmark_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 計測する構成（名前: FACE_API_ROUTERS）
+CONFIGURATIONS = {
+    "full": "images,comparison,face_detection,auto_features",
+    "comparison-only": "images,comparison"
+}
+
+HEAVY_MODULES = ["mediapipe", "cv2", "scipy", "PIL", "numpy"]
+
+# 子プロセスで実行する計測コード
+MEASURE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(app.main.app)
+response = client.get("/api/comparison-status")
+responded = time.perf_counter()
+print(json.dumps({
+    "import_time": imported - start,
+    "first_response_time": responded - start,
+    "status_code": response.status_code,
+    "loaded_modules": [name for name in %r if name in sys.modules]
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(routers: str) -> dict:
+    """新しいプロセスで1回計測する"""
+    env = dict(os.environ, FACE_API_ROUTERS=routers)
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE_SCRIPT],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間のベンチマーク")
+    parser.add_argument("--runs", type=int, default=5, help="構成ごとの計測回数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    results = {}
+    for name, routers in CONFIGURATIONS.items():
+        runs = [measure(routers) for _ in range(args.runs)]
+        results[name] = {
+            "routers": routers,
+            "import_time_median": statistics.median(run["import_time"] for run in runs),
+            "first_response_time_median": statistics.median(run["first_response_time"] for run in runs),
+            "status_code": runs[-1]["status_code"],
+            "loaded_modules": runs[-1]["loaded_modules"]
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return
+
+    for name, result in results.items():
+        print(f"[{name}] routers={result['routers']}")
+        print(f"  import:         {result['import_time_median'] * 1000:.0f} ms (median of {args.runs})")
+        print(f"  first response: {result['first_response_time_median'] * 1000:.0f} ms")
+        print(f"  heavy modules:  {', '.join(result['loaded_modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
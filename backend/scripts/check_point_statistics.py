@@ -0,0 +1,178 @@
+"""
+比較用の十分統計量（PointStatisticsCache）の差分更新の確認
+
+特徴点集合を 空 → 追加 → 移動・タイプ変更・追加・削除 → 空 の順に更新し、
+更新のたびに差分更新した統計量（特徴点集合のタイプ別 Σx²・点数とペア統計量）が
+全点から計算し直した値と一致することを確認する。
+差分更新が途中で失敗した場合に、統計量が破棄され ensure() で作り直されることも確認する。
+
+使い方（backend ディレクトリで実行）:
+    python scripts/check_point_statistics.py --rounds 200 --seed 0
+"""
+import argparse
+import os
+import random
+import sys
+from typing import Any, Dict, List
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.services.point_statistics import (  # noqa: E402
+    FEATURE_TYPES,
+    PairStatistics,
+    PointSetStatistics,
+    PointStatisticsCache,
+    point_coordinates,
+    point_type_codes
+)
+
+# 差分更新と再計算の許容誤差（相対）
+TOLERANCE = 1e-9
+
+
+def random_point(rng: random.Random) -> Dict[str, Any]:
+    return {"x": rng.uniform(0, 512), "y": rng.uniform(0, 512), "type": rng.choice(FEATURE_TYPES)}
+
+
+def change_points(points: List[Dict[str, Any]], rng: random.Random) -> List[Dict[str, Any]]:
+    """一部の点の移動・タイプ変更と、末尾への追加・末尾からの削除を行う"""
+    points = [dict(point) for point in points]
+    for point in points:
+        if rng.random() < 0.3:
+            point["x"] += rng.uniform(-5, 5)
+        if rng.random() < 0.1:
+            point["type"] = rng.choice(FEATURE_TYPES)
+    if rng.random() < 0.5:
+        points.extend(random_point(rng) for _ in range(rng.randint(1, 5)))
+    elif points:
+        del points[-rng.randint(1, len(points)):]
+    return points
+
+
+def fresh_statistics(points: List[Dict[str, Any]]) -> PointSetStatistics:
+    return PointSetStatistics(point_coordinates(points), point_type_codes(points))
+
+
+def compare(name: str, actual: np.ndarray, expected: np.ndarray, failures: List[str]) -> None:
+    if actual.dtype.kind != expected.dtype.kind:
+        failures.append(f"{name}: 型が異なります（{actual.dtype} / {expected.dtype}）")
+    elif not np.allclose(actual, expected, rtol=TOLERANCE, atol=TOLERANCE):
+        failures.append(f"{name}: {actual.tolist()}（再計算 {expected.tolist()}）")
+
+
+def check_round(cache: PointStatisticsCache, point_sets: Dict[str, List[Dict[str, Any]]],
+                step: str) -> List[str]:
+    """キャッシュの統計量を全点からの再計算と比較する"""
+    failures: List[str] = []
+    fresh = {image_id: fresh_statistics(points) for image_id, points in point_sets.items()}
+
+    for image_id, expected in fresh.items():
+        actual = cache.get(image_id)
+        compare(f"{step} {image_id} Σx²", actual.sum_sq_by_type, expected.sum_sq_by_type, failures)
+        compare(f"{step} {image_id} 点数", actual.count_by_type, expected.count_by_type, failures)
+
+    image_ids = sorted(point_sets)
+    for index, image_id_a in enumerate(image_ids):
+        for image_id_b in image_ids[index + 1:]:
+            # ペア統計量を作成済みにしておき、以降の更新で差分更新されるようにする
+            actual = cache._pair(image_id_a, image_id_b)
+            expected = PairStatistics(fresh[image_id_a], fresh[image_id_b])
+            for attribute in ("cross_by_a", "cross_by_b", "sq_b_by_a", "sq_a_by_b"):
+                compare(f"{step} {image_id_a}/{image_id_b} {attribute}",
+                        getattr(actual, attribute), getattr(expected, attribute), failures)
+    return failures
+
+
+def run_checks(rounds: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    cache = PointStatisticsCache()
+    image_ids = ("a", "b", "c")
+    # 更新済みの特徴点集合（キャッシュに載っているもの）
+    point_sets: Dict[str, List[Dict[str, Any]]] = {}
+    failures: List[str] = []
+    version = 0
+
+    def update(image_id: str, points: List[Dict[str, Any]], step: str) -> None:
+        nonlocal version
+        version += 1
+        point_sets[image_id] = points
+        try:
+            cache.update(image_id, points, version)
+        except Exception as e:
+            failures.append(f"{step} {image_id}: 更新に失敗しました: {e!r}")
+            return
+        failures.extend(check_round(cache, point_sets, step))
+
+    # 空の集合から始める
+    for image_id in image_ids:
+        update(image_id, [], "空")
+
+    # 空 → 追加 → 変更
+    for image_id in image_ids:
+        update(image_id, [random_point(rng) for _ in range(rng.randint(1, 20))], "追加")
+    for round_index in range(rounds):
+        image_id = rng.choice(image_ids)
+        update(image_id, change_points(point_sets[image_id], rng), f"変更{round_index}")
+
+    # 空に戻してから再び追加する
+    for image_id in image_ids:
+        update(image_id, [], "全削除")
+        update(image_id, [random_point(rng) for _ in range(rng.randint(1, 20))], "再追加")
+    return failures
+
+
+def check_failed_update(seed: int) -> List[str]:
+    """差分更新が途中で失敗した場合、古い統計量が新しいバージョンとして残らないことを確認する"""
+    rng = random.Random(seed)
+    cache = PointStatisticsCache()
+    failures: List[str] = []
+    points_a = [random_point(rng) for _ in range(10)]
+    points_b = [random_point(rng) for _ in range(10)]
+    cache.update("a", points_a, 1)
+    cache.update("b", points_b, 1)
+    cache._pair("a", "b")
+
+    changed_a = change_points(points_a, rng) + [random_point(rng)]
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("ペア統計量の更新に失敗")
+
+    original = PointStatisticsCache._update_pair
+    PointStatisticsCache._update_pair = staticmethod(fail)
+    try:
+        cache.update("a", changed_a, 2)
+        failures.append("失敗時: 例外が送出されませんでした")
+    except RuntimeError:
+        pass
+    finally:
+        PointStatisticsCache._update_pair = original
+
+    if cache.get("a") is not None:
+        failures.append(f"失敗時: 統計量が残っています（バージョン {cache.get('a').version}）")
+
+    # 次回の取得時に全点から作り直される
+    cache.ensure("a", changed_a, 2)
+    failures.extend(check_round(cache, {"a": changed_a, "b": points_b}, "失敗後"))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較用の十分統計量の差分更新の確認")
+    parser.add_argument("--rounds", type=int, default=200, help="変更の回数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    args = parser.parse_args()
+
+    failures = run_checks(args.rounds, args.seed) + check_failed_update(args.seed)
+    if failures:
+        for failure in failures[:20]:
+            print(failure)
+        print(f"NG（{len(failures)}件）")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
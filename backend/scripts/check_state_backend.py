@@ -0,0 +1,300 @@
+"""
+状態の保存先（FACE_STATE_BACKEND）の動作確認
+
+memory / sqlite / redis の各保存先に同じ操作を行い、値とバージョンの扱い
+（書き込み・削除のたびに増える、存在しない key の削除では増えない、削除後も引き継がれる）が
+一致することを確認する。
+--redis-url を省略した場合は、RedisStateBackend が使うコマンドだけを実装した
+ローカルの代替サーバー（RESP）を起動して確認するため、Redis は不要。
+代替サーバーでは、応答前の切断（書き込みは再送されずバージョンが1回だけ進む）と
+待機中の切断（次のコマンドの前に再接続する）も確認する。
+
+使い方（backend ディレクトリで実行）:
+    # ローカルの代替サーバーで確認
+    python scripts/check_state_backend.py
+
+    # 実際の Redis で確認（"<prefix>:check-*" のキーを使用し、終了時に削除する）
+    python scripts/check_state_backend.py --redis-url redis://localhost:6379/0
+"""
+import argparse
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.services.state_backend import (  # noqa: E402
+    REDIS_DELETE_SCRIPT,
+    REDIS_SET_MANY_SCRIPT,
+    REDIS_SET_SCRIPT,
+    MemoryStateBackend,
+    RedisStateBackend,
+    SQLiteStateBackend,
+    StateBackend
+)
+
+
+class LocalRedisData:
+    """代替サーバーのデータ（ハッシュのみ）"""
+
+    def __init__(self):
+        self.hashes: Dict[str, Dict[str, str]] = {}
+        self.lock = threading.Lock()
+        # True の間、次のコマンドを実行した後に応答せず切断する
+        self.drop_next_reply = False
+        self.connections: List[socket.socket] = []
+
+    def hset(self, key: str, field: str, value: str) -> int:
+        fields = self.hashes.setdefault(key, {})
+        added = field not in fields
+        fields[field] = value
+        return int(added)
+
+    def hdel(self, key: str, field: str) -> int:
+        return int(self.hashes.get(key, {}).pop(field, None) is not None)
+
+    def hincrby(self, key: str, field: str, amount: str) -> int:
+        fields = self.hashes.setdefault(key, {})
+        value = int(fields.get(field, "0")) + int(amount)
+        fields[field] = str(value)
+        return value
+
+    def run(self, command: str, args: List[str]) -> Any:
+        """コマンドを実行する（Lua スクリプトは RedisStateBackend のものだけを同じ手順で実行する）"""
+        if command in ("AUTH", "SELECT", "PING"):
+            return "OK"
+        if command == "HGET":
+            return self.hashes.get(args[0], {}).get(args[1])
+        if command == "HSET":
+            return self.hset(*args)
+        if command == "HDEL":
+            return self.hdel(*args)
+        if command == "HINCRBY":
+            return self.hincrby(*args)
+        if command == "HEXISTS":
+            return int(args[1] in self.hashes.get(args[0], {}))
+        if command == "HKEYS":
+            return list(self.hashes.get(args[0], {}))
+        if command == "HLEN":
+            return len(self.hashes.get(args[0], {}))
+        if command == "HGETALL":
+            return [item for pair in self.hashes.get(args[0], {}).items() for item in pair]
+        if command == "EVAL":
+            script, key_count = args[0], int(args[1])
+            keys, argv = args[2:2 + key_count], args[2 + key_count:]
+            return self.eval(script, keys, argv)
+        raise ValueError(f"ERR unknown command '{command}'")
+
+    def eval(self, script: str, keys: List[str], argv: List[str]) -> Any:
+        if script == REDIS_SET_SCRIPT:
+            self.hset(keys[0], argv[0], argv[1])
+            return self.hincrby(keys[1], argv[0], "1")
+        if script == REDIS_SET_MANY_SCRIPT:
+            versions = []
+            for index in range(0, len(argv), 2):
+                self.hset(keys[0], argv[index], argv[index + 1])
+                versions.append(self.hincrby(keys[1], argv[index], "1"))
+            return versions
+        if script == REDIS_DELETE_SCRIPT:
+            if self.hdel(keys[0], argv[0]) == 0:
+                return 0
+            self.hincrby(keys[1], argv[0], "1")
+            return 1
+        raise ValueError("ERR unknown script")
+
+
+class LocalRedisHandler(socketserver.StreamRequestHandler):
+    """RESP のリクエストを読み、LocalRedisData で実行して応答する"""
+
+    def _read_command(self) -> Optional[List[str]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    def _encode(self, value: Any) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, list):
+            return f"*{len(value)}\r\n".encode() + b"".join(self._encode(item) for item in value)
+        data = str(value).encode("utf-8")
+        return f"${len(data)}\r\n".encode() + data + b"\r\n"
+
+    def handle(self) -> None:
+        data: LocalRedisData = self.server.data
+        with data.lock:
+            data.connections.append(self.connection)
+        while (args := self._read_command()) is not None:
+            try:
+                with data.lock:
+                    reply = self._encode(data.run(args[0].upper(), args[1:]))
+            except Exception as e:
+                reply = f"-{e}\r\n".encode()
+            with data.lock:
+                drop_reply, data.drop_next_reply = data.drop_next_reply, False
+            if drop_reply:
+                # 実行済みのコマンドの応答が失われた状態を再現する
+                return
+            self.wfile.write(reply)
+
+
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    """RedisStateBackend の確認用の代替サーバー（127.0.0.1 の空きポートで待ち受ける）"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), LocalRedisHandler)
+        self.data = LocalRedisData()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def close_connections(self) -> None:
+        """接続中のクライアントをサーバー側から切断する（アイドルタイムアウト・再起動の再現）"""
+        with self.data.lock:
+            connections, self.data.connections = self.data.connections, []
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        # 切断がクライアント側に届くまで待つ
+        time.sleep(0.05)
+
+
+def check_backend(backend: StateBackend, namespace: str) -> List[str]:
+    """保存先に一連の操作を行い、期待と異なった項目を返す"""
+    failures = []
+
+    def expect(name: str, actual: Any, expected: Any) -> None:
+        if actual != expected:
+            failures.append(f"{name}: {actual!r}（期待値 {expected!r}）")
+
+    point = {"x": 1.5, "y": 2.0, "type": "nose", "label": "鼻_1", "landmark_index": 1}
+    expect("未保存のバージョン", backend.version(namespace, "a"), 0)
+    expect("未保存の値", backend.get(namespace, "a"), None)
+    expect("保存後のバージョン", backend.set(namespace, "a", [point]), 1)
+    expect("上書き後のバージョン", backend.set(namespace, "a", [point, point]), 2)
+    expect("取得した値", backend.get(namespace, "a"), [point, point])
+    expect("存在確認", backend.contains(namespace, "a"), True)
+    expect("まとめて保存", backend.set_many(namespace, {"a": [], "b": [point]}), {"a": 3, "b": 1})
+    expect("key の一覧", sorted(backend.keys(namespace)), ["a", "b"])
+    expect("件数", backend.count(namespace), 2)
+    expect("全ての値", dict(backend.items(namespace)), {"a": [], "b": [point]})
+    expect("削除", backend.delete(namespace, "a"), True)
+    expect("削除後のバージョン", backend.version(namespace, "a"), 4)
+    expect("存在しない key の削除", backend.delete(namespace, "a"), False)
+    expect("存在しない key の削除後のバージョン", backend.version(namespace, "a"), 4)
+    expect("削除後の存在確認", backend.contains(namespace, "a"), False)
+    expect("再保存後のバージョン", backend.set(namespace, "a", [point]), 5)
+    expect("空のまとめて保存", backend.set_many(namespace, {}), {})
+    return failures
+
+
+def check_connection_loss(backend: RedisStateBackend, server: LocalRedisServer, namespace: str) -> List[str]:
+    """接続が切れた場合に、書き込みを再送せず読み取りだけ再送することを確認する"""
+    failures = []
+
+    def expect(name: str, actual: Any, expected: Any) -> None:
+        if actual != expected:
+            failures.append(f"{name}: {actual!r}（期待値 {expected!r}）")
+
+    point = {"x": 1.0, "y": 1.0, "type": "nose", "label": "鼻_1"}
+    expect("保存後のバージョン", backend.set(namespace, "lost", [point]), 1)
+
+    # 書き込みの応答が失われた場合は再送せずにエラーとする（バージョンは1回だけ進む）
+    server.data.drop_next_reply = True
+    try:
+        backend.set(namespace, "lost", [point, point])
+        failures.append("応答が失われた書き込み: 例外が送出されませんでした")
+    except (ConnectionError, OSError):
+        pass
+    expect("応答が失われた書き込み後のバージョン", backend.version(namespace, "lost"), 2)
+
+    # 読み取りの応答が失われた場合は再接続して再送する
+    server.data.drop_next_reply = True
+    expect("応答が失われた読み取り", backend.get(namespace, "lost"), [point, point])
+
+    # 待機中に切断された接続は、書き込みの前に再接続する
+    server.close_connections()
+    try:
+        expect("切断後の書き込みのバージョン", backend.set(namespace, "lost", [point]), 3)
+    except (ConnectionError, OSError) as e:
+        failures.append(f"切断後の書き込み: {e}")
+    return failures
+
+
+def run_checks(redis_url: Optional[str]) -> Dict[str, List[str]]:
+    """memory / sqlite / redis の各保存先を確認する"""
+    namespace = f"check-{uuid.uuid4().hex[:8]}"
+    results: Dict[str, List[str]] = {}
+
+    results["memory"] = check_backend(MemoryStateBackend(), namespace)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sqlite_backend = SQLiteStateBackend(os.path.join(temp_dir, "state.sqlite3"))
+        results["sqlite"] = check_backend(sqlite_backend, namespace)
+        sqlite_backend._connect().close()
+
+    server = None
+    if redis_url is None:
+        server = LocalRedisServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        redis_url = server.url
+
+    redis_backend = RedisStateBackend(redis_url)
+    try:
+        results["redis" if server is None else "redis (local stand-in)"] = check_backend(redis_backend, namespace)
+        if server is not None:
+            results["redis (connection loss)"] = check_connection_loss(redis_backend, server, namespace)
+    finally:
+        if server is None:
+            # 実際の Redis では確認に使ったキーを削除する
+            redis_backend._command("DEL", redis_backend._hash_key(namespace), redis_backend._version_key(namespace))
+        redis_backend._close()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="状態の保存先の動作確認")
+    parser.add_argument("--redis-url", help="確認する Redis の URL（省略時はローカルの代替サーバーを使用）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    results = run_checks(args.redis_url)
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        for name, failures in results.items():
+            print(f"{name:<24} {'OK' if not failures else 'NG'}")
+            for failure in failures:
+                print(f"    {failure}")
+
+    sys.exit(1 if any(results.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
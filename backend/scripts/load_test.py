@@ -0,0 +1,283 @@
+"""
+HTTP負荷テスト
+
+アップロード → 顔検出 → 自動特徴点抽出 → 比較 の一連のAPIを、
+指定した同時接続数とリクエストの比率で呼び出し、エンドポイントごとの
+スループットとレイテンシ（p50/p95/p99）を計測する。
+画像は顔を模した合成画像を生成して使用するため、ネットワークやデータセットは不要。
+
+使い方（backend ディレクトリで実行）:
+    # アプリをプロセス内（ASGI）で実行して計測
+    python scripts/load_test.py --concurrency 8 --duration 30
+
+    # 起動中のサーバーに対して計測
+    python scripts/load_test.py --url http://localhost:8000 --mix upload=1,detect=1,extract=1,compare=8
+
+計測の終了後、アップロードした画像と処理済み画像・特徴点データは削除する
+（処理済み画像のファイルは、プロセス内で実行した場合のみ削除できる）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# 操作名 -> エンドポイント（集計のキー）
+OPERATIONS = {
+    "upload": "POST /api/upload-image",
+    "detect": "POST /api/detect-face",
+    "extract": "POST /api/extract-auto-features",
+    "compare": "POST /api/compare"
+}
+
+DEFAULT_MIX = "upload=1,detect=1,extract=1,compare=4"
+
+
+def generate_face_images(count: int, seed: int = 0) -> List[bytes]:
+    """顔を模した合成画像（JPEG）を大きさ・傾き・色を変えて生成する"""
+    import cv2
+    from app.services.warmup import _create_synthetic_image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        size = int(rng.choice([256, 384, 512, 768, 1024]))
+        image = _create_synthetic_image(size).astype(np.float32)
+
+        # 肌の色・明るさ・傾き・ノイズを変える
+        image *= rng.uniform(0.8, 1.15, size=3)
+        rotation = cv2.getRotationMatrix2D((size / 2, size / 2), float(rng.uniform(-12, 12)), 1.0)
+        image = cv2.warpAffine(image, rotation, (size, size), borderMode=cv2.BORDER_REPLICATE)
+        image += rng.normal(0, 4, size=image.shape)
+
+        ok, encoded = cv2.imencode(".jpg", np.clip(image, 0, 255).astype(np.uint8))
+        if not ok:
+            raise RuntimeError("合成画像のエンコードに失敗しました")
+        images.append(encoded.tobytes())
+    return images
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """"upload=1,compare=4" 形式のリクエスト比率を解析する"""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"未対応の操作です: {name}（{', '.join(OPERATIONS)}）")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class LoadTestState:
+    """仮想ユーザー間で共有する画像の処理段階"""
+
+    def __init__(self):
+        self.images: List[str] = []
+        self.uploaded: List[str] = []
+        self.detected: List[str] = []
+        self.extracted: List[str] = []
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.status_codes: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    def record(self, operation: str, duration: float, status_code: int) -> None:
+        endpoint = OPERATIONS[operation]
+        self.latencies[endpoint].append(duration)
+        self.status_codes[endpoint][status_code] += 1
+
+    def runnable(self, operation: str) -> str:
+        """前段の処理が済んでいない場合は、前段の操作に置き換える"""
+        if operation == "compare" and len(self.extracted) < 3:
+            operation = "extract"
+        if operation == "extract" and not self.detected:
+            operation = "detect"
+        if operation == "detect" and not self.uploaded:
+            operation = "upload"
+        return operation
+
+
+async def run_operation(client, operation: str, state: LoadTestState, images: List[bytes],
+                        rng: random.Random) -> None:
+    """1リクエストを実行して記録する"""
+    start_time = time.perf_counter()
+
+    if operation == "upload":
+        response = await client.post(
+            "/api/upload-image",
+            files={"file": ("face.jpg", rng.choice(images), "image/jpeg")}
+        )
+        if response.status_code == 200:
+            image_id = response.json()["image_id"]
+            state.images.append(image_id)
+            state.uploaded.append(image_id)
+
+    elif operation == "detect":
+        image_id = state.uploaded.pop(0)
+        response = await client.post("/api/detect-face", json={"image_id": image_id})
+        if response.status_code == 200 and response.json().get("success"):
+            state.detected.append(image_id)
+        elif response.status_code in (429, 503):
+            # 過負荷で拒否された画像は後で再試行する
+            state.uploaded.append(image_id)
+        else:
+            state.failures["detect"] += 1
+
+    elif operation == "extract":
+        image_id = state.detected.pop(0)
+        response = await client.post("/api/extract-auto-features", json={"image_id": image_id})
+        if response.status_code == 200 and response.json().get("success"):
+            state.extracted.append(image_id)
+        elif response.status_code in (429, 503):
+            state.detected.append(image_id)
+        else:
+            state.failures["extract"] += 1
+
+    else:
+        reference_id, *compare_ids = rng.sample(state.extracted, 3)
+        response = await client.post(
+            "/api/compare", json={"reference_id": reference_id, "compare_ids": compare_ids}
+        )
+
+    state.record(operation, time.perf_counter() - start_time, response.status_code)
+
+
+async def virtual_user(client, state: LoadTestState, weights: Dict[str, float], images: List[bytes],
+                       deadline: float, remaining: List[int], seed: int) -> None:
+    """仮想ユーザー（終了時刻・リクエスト数に達するまで繰り返す）"""
+    rng = random.Random(seed)
+    names, values = list(weights), list(weights.values())
+
+    while time.perf_counter() < deadline and remaining[0] > 0:
+        remaining[0] -= 1
+        operation = state.runnable(rng.choices(names, values)[0])
+        try:
+            await run_operation(client, operation, state, images, rng)
+        except Exception as e:
+            state.failures[operation] += 1
+            print(f"エラー ({operation}): {e}", file=sys.stderr)
+
+
+async def cleanup(client, state: LoadTestState, uploads_dir: Optional[str]) -> None:
+    """
+    アップロードした画像と処理済み画像・特徴点データを削除する
+
+    Args:
+        uploads_dir: 処理済み画像のファイルを削除するディレクトリ（プロセス内で実行した場合）
+    """
+    for image_id in state.images:
+        try:
+            response = await client.get(f"/api/processed-image/{image_id}")
+            if response.status_code == 200:
+                filename = response.json().get("processed_image_filename")
+                if uploads_dir and filename:
+                    path = os.path.join(uploads_dir, filename)
+                    if os.path.exists(path):
+                        os.remove(path)
+                await client.delete(f"/api/processed-image/{image_id}")
+            await client.delete(f"/api/image/{image_id}")
+        except Exception as e:
+            print(f"削除エラー ({image_id}): {e}", file=sys.stderr)
+
+
+def summarize(state: LoadTestState, elapsed: float) -> Dict[str, dict]:
+    """エンドポイントごとのスループットとレイテンシを集計する"""
+    summary = {}
+    for endpoint, samples in state.latencies.items():
+        latencies = np.array(samples) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary[endpoint] = {
+            "requests": len(samples),
+            "throughput_rps": len(samples) / elapsed,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(latencies.max()),
+            "status_codes": dict(state.status_codes[endpoint])
+        }
+    return summary
+
+
+async def run_load_test(url: Optional[str], concurrency: int, duration: float, max_requests: int,
+                        weights: Dict[str, float], image_count: int, seed: int) -> dict:
+    import httpx
+
+    images = generate_face_images(image_count, seed)
+
+    uploads_dir = None
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=120)
+    else:
+        # アプリをプロセス内で実行する（起動イベントは実行されないためウォームアップは行わない）
+        from app.main import app, uploads_dir
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load-test", timeout=120)
+
+    state = LoadTestState()
+    remaining = [max_requests]
+
+    async with client:
+        start_time = time.perf_counter()
+        await asyncio.gather(*[
+            virtual_user(client, state, weights, images, start_time + duration, remaining, seed + index)
+            for index in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start_time
+        await cleanup(client, state, uploads_dir)
+
+    total = sum(len(samples) for samples in state.latencies.values())
+    return {
+        "target": url or "in-process (ASGI)",
+        "concurrency": concurrency,
+        "mix": weights,
+        "elapsed": elapsed,
+        "total_requests": total,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "failures": dict(state.failures),
+        "endpoints": summarize(state, elapsed)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP負荷テスト")
+    parser.add_argument("--url", help="サーバーのURL（省略時はアプリをプロセス内で実行）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時接続数（仮想ユーザー数）")
+    parser.add_argument("--duration", type=float, default=30.0, help="計測時間（秒）")
+    parser.add_argument("--requests", type=int, default=10 ** 9, help="最大リクエスト数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"リクエストの比率（既定: {DEFAULT_MIX}）")
+    parser.add_argument("--images", type=int, default=8, help="生成する合成画像の種類")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load_test(
+        args.url, args.concurrency, args.duration, args.requests,
+        parse_mix(args.mix), args.images, args.seed
+    ))
+
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return
+
+    print(f"target={result['target']} concurrency={result['concurrency']} "
+          f"elapsed={result['elapsed']:.1f}s requests={result['total_requests']} "
+          f"throughput={result['throughput_rps']:.1f} req/s")
+    print(f"{'endpoint':<34} {'reqs':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  status")
+    for endpoint, stats in sorted(result["endpoints"].items()):
+        status = " ".join(f"{code}:{count}" for code, count in sorted(stats["status_codes"].items()))
+        print(f"{endpoint:<34} {stats['requests']:>6} {stats['throughput_rps']:>7.1f} "
+              f"{stats['p50_ms']:>6.1f}ms {stats['p95_ms']:>6.1f}ms {stats['p99_ms']:>6.1f}ms "
+              f"{stats['max_ms']:>6.1f}ms  {status}")
+    if result["failures"]:
+        print(f"failures: {result['failures']}")
+
+
+if __name__ == "__main__":
+    main()
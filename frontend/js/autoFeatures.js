@@ -102,11 +102,9 @@ async function extractAutoFeatures() {
           landmark_index: point.landmark_index
         }));
         
-        // 既存の手動特徴点と統合
-        const existingManualPoints = imageData[imageType].points.filter(
-          p => p.landmark_index === undefined
-        );
-        imageData[imageType].points = [...existingManualPoints, ...newPoints];
+        // 既存の特徴点と統合（サーバーと同じく、ランドマーク番号が同じ特徴点は置き換える）
+        imageData[imageType].points = upsertFeaturePoints(imageData[imageType].points, newPoints);
+        markFeaturePointsSynced(imageType, result.version);
         
         console.log(`自動抽出成功 (${imageType}): ${newPoints.length}点追加`);
         console.log(`Total points for ${imageType}: ${imageData[imageType].points.length}`);
@@ -168,10 +166,13 @@ async function clearAutoFeatures() {
       });
       
       if (response.ok) {
+        const result = await response.json();
+        
         // ローカルデータからも自動特徴点を削除
         imageData[imageType].points = imageData[imageType].points.filter(
-          p => p.landmark_index === undefined
+          p => p.landmark_index === undefined || p.landmark_index === null
         );
+        markFeaturePointsSynced(imageType, result.version ?? null);
         
         successCount++;
       }
@@ -151,7 +151,7 @@ function displayDetectionInfo(detectionResults) {
         if (result.success && result.processing_info) {
             infoHtml += `<div class="detection-detail-item">
                 <span class="detection-detail-label">　検出信頼度</span>
-                <span class="detection-detail-value">${(result.processing_info.detection_confidence * 100).toFixed(1)}%</span>
+                <span class="detection-detail-value">${result.processing_info.detection_confidence != null ? (result.processing_info.detection_confidence * 100).toFixed(1) + '%' : '-'}</span>
             </div>`;
             
             infoHtml += `<div class="detection-detail-item">
@@ -46,8 +46,126 @@ function redrawFeaturePoints(imageType, isProcessed = false) {
     }
 }
 
-// 特徴点データをサーバーに保存
+// 最後にサーバーと同期した時点での各特徴点のキー
+const syncedPointKeys = new WeakMap();
+
+// 特徴点を識別するキー（サーバーの point_key と同じ規則）
+function getFeaturePointKey(point) {
+    if (point.landmark_index !== undefined && point.landmark_index !== null) {
+        return `landmark:${point.type}:${point.landmark_index}`;
+    }
+    return `label:${point.label}`;
+}
+
+// サーバーに送る形式の特徴点
+function toFeaturePointPayload(point) {
+    return {
+        x: point.x,
+        y: point.y,
+        type: point.type,
+        label: point.label,
+        confidence: point.confidence ?? null,
+        landmark_index: point.landmark_index ?? null
+    };
+}
+
+// 現在の特徴点をサーバーと同期済みとして記録する
+function markFeaturePointsSynced(imageType, version = null) {
+    const data = imageData[imageType];
+    data.syncedPoints = new Map();
+    data.points.forEach(point => {
+        const key = getFeaturePointKey(point);
+        syncedPointKeys.set(point, key);
+        data.syncedPoints.set(key, JSON.stringify(toFeaturePointPayload(point)));
+    });
+    data.pointsVersion = version;
+}
+
+// 特徴点を追加・更新する（同じキーの特徴点はその位置で置き換える。サーバーの upsert と同じ規則）
+function upsertFeaturePoints(points, newPoints) {
+    const merged = [...points];
+    const positions = new Map();
+    merged.forEach((point, index) => {
+        const key = getFeaturePointKey(point);
+        if (!positions.has(key)) positions.set(key, index);
+    });
+
+    newPoints.forEach(point => {
+        const key = getFeaturePointKey(point);
+        if (positions.has(key)) {
+            merged[positions.get(key)] = point;
+        } else {
+            positions.set(key, merged.length);
+            merged.push(point);
+        }
+    });
+    return merged;
+}
+
+// 前回の同期からの差分（追加・変更した特徴点と削除した特徴点のキー）
+function diffFeaturePoints(imageType) {
+    const data = imageData[imageType];
+    const remainingKeys = new Set();
+    const upsert = [];
+
+    data.points.forEach(point => {
+        const previousKey = syncedPointKeys.get(point);
+        const payload = toFeaturePointPayload(point);
+        if (previousKey !== undefined && data.syncedPoints.has(previousKey)) {
+            remainingKeys.add(previousKey);
+            if (data.syncedPoints.get(previousKey) === JSON.stringify(payload)) {
+                return;
+            }
+        }
+        upsert.push({ key: previousKey ?? null, point: payload });
+    });
+
+    const deleted = [...data.syncedPoints.keys()].filter(key => !remainingKeys.has(key));
+    return { upsert: upsert, delete: deleted };
+}
+
+// 特徴点データをサーバーに保存（同期済みの場合は差分のみ送る）
 async function saveFeaturePoints(imageType) {
+    const data = imageData[imageType];
+
+    if (data.syncedPoints) {
+        try {
+            const delta = diffFeaturePoints(imageType);
+            if (delta.upsert.length === 0 && delta.delete.length === 0) {
+                return;
+            }
+
+            const response = await fetch(`/api/feature-points/${data.id}`, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    upsert: delta.upsert,
+                    delete: delta.delete,
+                    base_version: data.pointsVersion
+                })
+            });
+
+            if (response.ok) {
+                const result = await response.json();
+                markFeaturePointsSynced(imageType, result.version);
+                console.log(`Feature points updated for ${imageType}:`, result);
+                return;
+            }
+
+            // 他の画面等で更新されていた場合（409）は全体を保存し直す
+            console.warn(`Delta sync failed for ${imageType} (${response.status}), saving all points`);
+        } catch (error) {
+            console.warn('Delta sync failed, saving all points:', error);
+        }
+    }
+
+    await saveAllFeaturePoints(imageType);
+}
+
+// 特徴点データ全体をサーバーに保存
+async function saveAllFeaturePoints(imageType) {
     const imageId = imageData[imageType].id;
     const points = imageData[imageType].points;
 
@@ -59,7 +177,7 @@ async function saveFeaturePoints(imageType) {
             },
             body: JSON.stringify({
                 image_id: imageId,
-                points: points
+                points: points.map(toFeaturePointPayload)
             })
         });
 
@@ -68,6 +186,7 @@ async function saveFeaturePoints(imageType) {
         }
 
         const result = await response.json();
+        markFeaturePointsSynced(imageType, result.version);
         console.log(`Feature points saved for ${imageType}:`, result);
 
     } catch (error) {
@@ -2,9 +2,9 @@
 
 // アプリケーション状態
 const imageData = {
-    reference: { id: null, file: null, canvas: null, points: [], processed: false, processedImage: null },
-    compare1: { id: null, file: null, canvas: null, points: [], processed: false, processedImage: null },
-    compare2: { id: null, file: null, canvas: null, points: [], processed: false, processedImage: null }
+    reference: { id: null, file: null, canvas: null, points: [], processed: false, processedImage: null, syncedPoints: null, pointsVersion: null },
+    compare1: { id: null, file: null, canvas: null, points: [], processed: false, processedImage: null, syncedPoints: null, pointsVersion: null },
+    compare2: { id: null, file: null, canvas: null, points: [], processed: false, processedImage: null, syncedPoints: null, pointsVersion: null }
 };
 
 let currentFeatureType = 'rightEye';
@@ -1,5 +1,12 @@
 // 画像アップロード機能
 
+// アップロード前に縮小する長辺の最大ピクセル数（顔検出にはこれ以上の解像度は不要）
+const MAX_UPLOAD_EDGE = 1600;
+// 縮小した画像のJPEG品質
+const UPLOAD_JPEG_QUALITY = 0.92;
+// アップロード可能なファイルサイズ（サーバーの MAX_FILE_SIZE と同じ）
+const MAX_UPLOAD_SIZE = 5 * 1024 * 1024;
+
 // ファイル選択処理
 async function handleFileSelect(event, imageType) {
     const file = event.target.files[0];
@@ -11,23 +18,28 @@ async function handleFileSelect(event, imageType) {
         return;
     }
 
-    // ファイルサイズチェック（5MB）
-    if (file.size > 5 * 1024 * 1024) {
-        alert('ファイルサイズは5MB以下にしてください。');
-        return;
-    }
-
     try {
+        // ブラウザで縮小してからアップロードする
+        const prepared = await resizeImageForUpload(file);
+
+        // ファイルサイズチェック（5MB、縮小後のサイズで判定）
+        if (prepared.file.size > MAX_UPLOAD_SIZE) {
+            alert('ファイルサイズは5MB以下にしてください。');
+            return;
+        }
+
         // 画像をアップロード
-        const uploadResult = await uploadImage(file);
+        const uploadResult = await uploadImage(prepared.file, prepared.originalWidth, prepared.originalHeight);
         
-        // 画像データを保存
+        // 画像データを保存（特徴点の座標はアップロードした画像が基準）
         imageData[imageType].id = uploadResult.image_id;
-        imageData[imageType].file = file;
+        imageData[imageType].file = prepared.file;
         imageData[imageType].points = [];
+        imageData[imageType].syncedPoints = null;
+        imageData[imageType].pointsVersion = null;
 
         // Canvas に画像を表示
-        displayImageOnCanvas(file, imageType);
+        displayImageOnCanvas(prepared.file, imageType);
         
         // UI更新
         updateUI();
@@ -40,11 +52,84 @@ async function handleFileSelect(event, imageType) {
     }
 }
 
+// 画像を読み込む（EXIFの向きを適用した状態で取得する）
+async function loadOrientedImage(file) {
+    if (typeof createImageBitmap === 'function') {
+        try {
+            return await createImageBitmap(file, { imageOrientation: 'from-image' });
+        } catch (error) {
+            // オプション未対応のブラウザは img 要素で読み込む
+        }
+    }
+
+    // img 要素は既定でEXIFの向きを適用して表示される
+    return await new Promise((resolve, reject) => {
+        const url = URL.createObjectURL(file);
+        const img = new Image();
+        img.onload = () => {
+            URL.revokeObjectURL(url);
+            resolve(img);
+        };
+        img.onerror = () => {
+            URL.revokeObjectURL(url);
+            reject(new Error('画像を読み込めません'));
+        };
+        img.src = url;
+    });
+}
+
+// 長辺が MAX_UPLOAD_EDGE を超える画像を縮小してJPEGに再エンコードする
+async function resizeImageForUpload(file) {
+    let source;
+    try {
+        source = await loadOrientedImage(file);
+    } catch (error) {
+        // ブラウザで読み込めない形式はそのままアップロードする（サーバー側で検証）
+        return { file: file, originalWidth: null, originalHeight: null };
+    }
+
+    const originalWidth = source.naturalWidth || source.width;
+    const originalHeight = source.naturalHeight || source.height;
+    const scale = Math.min(1, MAX_UPLOAD_EDGE / Math.max(originalWidth, originalHeight));
+
+    if (scale >= 1) {
+        if (source.close) source.close();
+        return { file: file, originalWidth: originalWidth, originalHeight: originalHeight };
+    }
+
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.round(originalWidth * scale);
+    canvas.height = Math.round(originalHeight * scale);
+    const ctx = canvas.getContext('2d');
+    ctx.imageSmoothingEnabled = true;
+    ctx.imageSmoothingQuality = 'high';
+    ctx.drawImage(source, 0, 0, canvas.width, canvas.height);
+    if (source.close) source.close();
+
+    const blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', UPLOAD_JPEG_QUALITY));
+    if (!blob) {
+        return { file: file, originalWidth: originalWidth, originalHeight: originalHeight };
+    }
+
+    const filename = file.name.replace(/\.[^.]+$/, '') + '.jpg';
+    return {
+        file: new File([blob], filename, { type: 'image/jpeg' }),
+        originalWidth: originalWidth,
+        originalHeight: originalHeight
+    };
+}
+
 // 画像アップロードAPI呼び出し
-async function uploadImage(file) {
+async function uploadImage(file, originalWidth = null, originalHeight = null) {
     const formData = new FormData();
     formData.append('file', file);
 
+    // 縮小前の大きさ（サーバーで縮小率を記録する）
+    if (originalWidth && originalHeight) {
+        formData.append('original_width', originalWidth);
+        formData.append('original_height', originalHeight);
+    }
+
     const response = await fetch('/api/upload-image', {
         method: 'POST',
         body: formData